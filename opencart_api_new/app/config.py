@@ -12,6 +12,18 @@ class Settings:
     # Secret key for JWT
     SECRET_KEY: str = os.getenv("SECRET_KEY", secrets.token_urlsafe(32))
     
+    # Session cookie: signing key (an explicitly set SECRET_KEY when unset;
+    # the app refuses to start without either, as a per-process random key
+    # would void every cookie on restart or in another worker), lifetime in
+    # seconds, the Secure flag, sessions kept in each worker's memory and the UTC date
+    # (e.g. "2026-12-01") after which unsigned pre-signing cookies are
+    # rejected; unset, they are adopted as long as their session is known
+    SESSION_SECRET: str = os.getenv("SESSION_SECRET", os.getenv("SECRET_KEY", ""))
+    SESSION_MAX_AGE: int = int(os.getenv("SESSION_MAX_AGE", "2592000"))
+    SESSION_COOKIE_SECURE: bool = os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
+    SESSION_CACHE_SIZE: int = int(os.getenv("SESSION_CACHE_SIZE", "100000"))
+    SESSION_LEGACY_UNTIL: str = os.getenv("SESSION_LEGACY_UNTIL", "")
+    
     # Database settings
     MYSQL_USER: str = os.getenv("MYSQL_USER", "root")
     MYSQL_PASSWORD: str = os.getenv("MYSQL_PASSWORD", "")
@@ -20,4 +32,111 @@ class Settings:
     MYSQL_DB: str = os.getenv("MYSQL_DB", "opencart_updated")
     DATABASE_URL: str = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_SERVER}:{MYSQL_PORT}/{MYSQL_DB}"
 
+    # Directory for files written by offline jobs (recommendations, checkpoints)
+    DATA_DIR: str = os.getenv("DATA_DIR", "data")
+
+    # Seconds before the in-memory product identifier index is fully reloaded
+    PRODUCT_LOOKUP_TTL: int = int(os.getenv("PRODUCT_LOOKUP_TTL", "300"))
+
+    # Search autocomplete: rebuild interval (seconds), keyword history window (days)
+    # and number of popular keywords merged with product names
+    SEARCH_SUGGEST_REFRESH: int = int(os.getenv("SEARCH_SUGGEST_REFRESH", "600"))
+    SEARCH_SUGGEST_QUERY_DAYS: int = int(os.getenv("SEARCH_SUGGEST_QUERY_DAYS", "90"))
+    SEARCH_SUGGEST_MAX_QUERIES: int = int(os.getenv("SEARCH_SUGGEST_MAX_QUERIES", "5000"))
+
+    # Largest number of typos corrected per word by the "did you mean" fallback
+    SEARCH_MAX_EDIT_DISTANCE: int = int(os.getenv("SEARCH_MAX_EDIT_DISTANCE", "2"))
+
+    # Neighbours precomputed per product by the similar products job
+    SIMILAR_PRODUCTS_TOP_K: int = int(os.getenv("SIMILAR_PRODUCTS_TOP_K", "20"))
+
+    # Co-view / co-purchase recommendations kept per product and how often
+    # (seconds) workers reload them from the database
+    RECOMMENDATIONS_TOP_K: int = int(os.getenv("RECOMMENDATIONS_TOP_K", "20"))
+    RECOMMENDATIONS_RELOAD: int = int(os.getenv("RECOMMENDATIONS_RELOAD", "3600"))
+
+    # Trending products: counters per category, score half-life and checkpoint
+    # interval, both in seconds
+    TRENDING_CAPACITY: int = int(os.getenv("TRENDING_CAPACITY", "500"))
+    TRENDING_HALF_LIFE: int = int(os.getenv("TRENDING_HALF_LIFE", "21600"))
+    TRENDING_CHECKPOINT: int = int(os.getenv("TRENDING_CHECKPOINT", "300"))
+
+    # Seconds between flushes of the HyperLogLog unique visitor registers
+    UNIQUE_COUNT_FLUSH: int = int(os.getenv("UNIQUE_COUNT_FLUSH", "60"))
+
+    # Seconds between flushes of buffered oc_product.viewed increments and
+    # api_product_view rows
+    PRODUCT_VIEW_FLUSH: int = int(os.getenv("PRODUCT_VIEW_FLUSH", "10"))
+
+    # Enhanced tracking writes events to a local spool instead of MySQL when
+    # enabled; `python -m app.utils.spool_ingest` loads them. Segment size in
+    # bytes and seconds between fsyncs of the spool
+    EVENT_SPOOL: bool = os.getenv("EVENT_SPOOL", "false").lower() == "true"
+    EVENT_SPOOL_DIR: str = os.getenv("EVENT_SPOOL_DIR", os.path.join(DATA_DIR, "spool"))
+    EVENT_SPOOL_SEGMENT_BYTES: int = int(os.getenv("EVENT_SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+    EVENT_SPOOL_FSYNC: float = float(os.getenv("EVENT_SPOOL_FSYNC", "1.0"))
+
+    # Seconds between bulk inserts of buffered /track/batch beacon events
+    # (only used when the event spool is disabled)
+    BEACON_FLUSH: float = float(os.getenv("BEACON_FLUSH", "1.0"))
+
+    # Bot filtering ahead of tracking writes: extra user agent substrings (e.g.
+    # "curl/,python-requests" when no first-party client uses them) and
+    # comma-separated CIDR ranges (defaults are Googlebot and Bingbot) treated
+    # as bots, and hits per minute above which a session counts as a bot
+    # until a later minute is back under it
+    BOT_FILTER: bool = os.getenv("BOT_FILTER", "true").lower() == "true"
+    BOT_EXTRA_SIGNATURES: str = os.getenv("BOT_EXTRA_SIGNATURES", "")
+    BOT_IP_RANGES: str = os.getenv("BOT_IP_RANGES", "66.249.64.0/19,157.55.39.0/24,207.46.13.0/24,40.77.167.0/24")
+    BOT_MAX_REQUESTS_PER_MINUTE: int = int(os.getenv("BOT_MAX_REQUESTS_PER_MINUTE", "120"))
+
+    # Share of activity events stored per event type, e.g.
+    # "pageview=0.1,search=0.5"; types not listed (cart events) keep them all
+    EVENT_SAMPLE_RATES: str = os.getenv("EVENT_SAMPLE_RATES", "")
+
+    # Seconds a computed conversion funnel is served from the per-worker cache
+    FUNNEL_CACHE_TTL: int = int(os.getenv("FUNNEL_CACHE_TTL", "300"))
+
+    # Seconds before cohort retention reads sessions changed since its last refresh
+    COHORT_REFRESH: int = int(os.getenv("COHORT_REFRESH", "900"))
+
+    # Seconds between live stats pushed to /analytics/v2/live subscribers
+    LIVE_STATS_INTERVAL: float = float(os.getenv("LIVE_STATS_INTERVAL", "2.0"))
+
+    # Seconds between runs aggregating closed days into api_attribution_daily
+    ATTRIBUTION_REFRESH: int = int(os.getenv("ATTRIBUTION_REFRESH", "3600"))
+
+    # Guest history stitched to the customer after a login: seconds between
+    # stitch runs, rows per UPDATE and seconds paused between UPDATEs
+    STITCH_INTERVAL: int = int(os.getenv("STITCH_INTERVAL", "30"))
+    STITCH_CHUNK: int = int(os.getenv("STITCH_CHUNK", "1000"))
+    STITCH_PAUSE: float = float(os.getenv("STITCH_PAUSE", "0.05"))
+
+    # Carts idle this many seconds are snapshotted into api_abandoned_cart
+    # by a scan every ABANDONED_CART_SCAN seconds
+    ABANDONED_CART_AFTER: int = int(os.getenv("ABANDONED_CART_AFTER", "3600"))
+    ABANDONED_CART_SCAN: int = int(os.getenv("ABANDONED_CART_SCAN", "300"))
+
+    # Guest carts (oc_cart and api_cart) untouched this many days are deleted
+    # by a job every GUEST_CART_GC_INTERVAL seconds, at most GUEST_CART_GC_MAX_ROWS
+    # rows per table and run, GUEST_CART_GC_CHUNK rows per DELETE with
+    # GUEST_CART_GC_PAUSE seconds between them
+    GUEST_CART_RETENTION_DAYS: int = int(os.getenv("GUEST_CART_RETENTION_DAYS", "30"))
+    GUEST_CART_GC_INTERVAL: int = int(os.getenv("GUEST_CART_GC_INTERVAL", "3600"))
+    GUEST_CART_GC_MAX_ROWS: int = int(os.getenv("GUEST_CART_GC_MAX_ROWS", "100000"))
+    GUEST_CART_GC_CHUNK: int = int(os.getenv("GUEST_CART_GC_CHUNK", "500"))
+    GUEST_CART_GC_PAUSE: float = float(os.getenv("GUEST_CART_GC_PAUSE", "0.1"))
+
+    # Tracking data retention: whole months kept in the database, monthly
+    # partitions created in advance and where expired rows are archived
+    TRACKING_RETENTION_MONTHS: int = int(os.getenv("TRACKING_RETENTION_MONTHS", "13"))
+    PARTITION_MONTHS_AHEAD: int = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    ARCHIVE_DIR: str = os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive"))
+
+    # Analytics older than ANALYTICS_HOT_DAYS are answered from the columnar
+    # archive, which exports days once they are COLUMNAR_EXPORT_DELAY_DAYS old
+    ANALYTICS_HOT_DAYS: int = int(os.getenv("ANALYTICS_HOT_DAYS", "90"))
+    COLUMNAR_DIR: str = os.getenv("COLUMNAR_DIR", os.path.join(DATA_DIR, "columnar"))
+    COLUMNAR_EXPORT_DELAY_DAYS: int = int(os.getenv("COLUMNAR_EXPORT_DELAY_DAYS", "31"))
+
 settings = Settings()
\ No newline at end of file
@@ -4,7 +4,24 @@ from fastapi.middleware.cors import CORSMiddleware
 
 from app.routes import router
 from app.config import settings
+from app.middleware.enhanced_tracking import EnhancedTrackingMiddleware
+from app.middleware.session import SessionCookieMiddleware
 from app.middleware.tracking import TrackingMiddleware
+from app.utils.abandoned_carts import abandoned_cart_job
+from app.utils.attribution import attribution_job
+from app.utils.beacons import beacon_buffer, beacon_flush_job
+from app.utils.cart_gc import guest_cart_gc_job
+from app.utils.event_spool import event_spool, event_spool_sync_job
+from app.utils.fuzzy_search import spelling_index_job
+from app.utils.hyperloglog import unique_count_flush_job, unique_counter
+from app.utils.search_suggest import suggestion_index_job
+from app.utils.session_stitching import session_stitch_job
+from app.utils.trending import CHECKPOINT_PATH, trending_checkpoint_job, trending_tracker
+from app.utils.view_counter import product_view_counter, product_view_flush_job
+
+if not settings.SESSION_SECRET:
+    # A random key per process would invalidate every session cookie on restart
+    raise RuntimeError("Set SESSION_SECRET (or SECRET_KEY) to sign session cookies")
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -23,9 +40,54 @@ app.add_middleware(
 # Add tracking middleware
 app.add_middleware(TrackingMiddleware)
 
+# Sessions, activity events, unique counts, product views, trending and live stats
+app.add_middleware(EnhancedTrackingMiddleware)
+
+# Added last so it runs first: resolves request.state.session for tracking and routes
+app.add_middleware(SessionCookieMiddleware)
+
 # Include API routes
 app.include_router(router, prefix="/api")
 
+@app.on_event("startup")
+def start_background_jobs():
+    suggestion_index_job.start()
+    spelling_index_job.start()
+    trending_tracker.restore(CHECKPOINT_PATH)
+    trending_checkpoint_job.start()
+    unique_count_flush_job.start()
+    product_view_flush_job.start()
+    attribution_job.start()
+    session_stitch_job.start()
+    abandoned_cart_job.start()
+    guest_cart_gc_job.start()
+    if settings.EVENT_SPOOL:
+        event_spool_sync_job.start()
+    else:
+        beacon_flush_job.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    suggestion_index_job.stop(timeout=5)
+    spelling_index_job.stop(timeout=5)
+    trending_checkpoint_job.stop(timeout=5)
+    trending_tracker.checkpoint(CHECKPOINT_PATH)
+    unique_count_flush_job.stop(timeout=5)
+    unique_counter.flush()
+    product_view_flush_job.stop(timeout=5)
+    product_view_counter.flush()
+    attribution_job.stop(timeout=5)
+    session_stitch_job.stop(timeout=5)
+    abandoned_cart_job.stop(timeout=5)
+    guest_cart_gc_job.stop(timeout=5)
+    event_spool_sync_job.stop(timeout=5)
+    event_spool.close()
+    beacon_flush_job.stop(timeout=5)
+    try:
+        beacon_buffer.flush()
+    except Exception as e:
+        print(f"Error flushing beacon events: {e}")
+
 @app.get("/", tags=["Root"])
 def read_root():
     return {
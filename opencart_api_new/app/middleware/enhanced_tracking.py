@@ -1,62 +1,94 @@
 from fastapi import Request
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.responses import Response
 import time
 import json
-import uuid
 from datetime import datetime
 import re
 from user_agents import parse
 from urllib.parse import urlparse, parse_qs
 import requests
 
+from app.config import settings
 from app.database import SessionLocal
-from app.models.analytics import UserActivity, SessionTracking
+from app.middleware.tracking import UNTRACKED_PATHS
+from app.utils.activity_store import record_events
+from app.utils.bot_filter import is_bot_request
+from app.utils.event_spool import event_spool, session_details
+from app.utils.hyperloglog import unique_counter
+from app.utils.live_stats import live_counters
+from app.utils.sampling import event_sampler
+from app.utils.session_tracking import touch_session
+from app.utils.trending import trending_tracker
+from app.utils.view_counter import product_view_counter, view_source
 
 # Device detection regex patterns
 MOBILE_PATTERN = r"(android|bb\d+|meego).+mobile|avantgo|bada\/|blackberry|blazer|compal|elaine|fennec|hiptop|iemobile|ip(hone|od)|iris|kindle|lge |maemo|midp|mmp|mobile.+firefox|netfront|opera m(ob|in)i|palm( os)?|phone|p(ixi|re)\/|plucker|pocket|psp|series(4|6)0|symbian|treo|up\.(browser|link)|vodafone|wap|windows ce|xda|xiino"
 TABLET_PATTERN = r"(android|bb\d+|meego).+mobile|avantgo|bada\/|blackberry|blazer|compal|elaine|fennec|hiptop|iemobile|ip(hone|od)|iris|kindle|lge |maemo|midp|mmp|mobile.+firefox|netfront|opera m(ob|in)i|palm( os)?|phone|p(ixi|pre)\/|plucker|pocket|psp|series(4|6)0|symbian|treo|up\.(browser|link)|vodafone|wap|windows ce|xda|xiino|android|ipad|playbook|silk"
 
+# Product detail pages, e.g. /api/products/42
+PRODUCT_VIEW_PATH = re.compile(r"/products/(\d+)/?$")
+
 # Cache for IP geolocation data to reduce API calls
 GEOLOCATION_CACHE = {}
 
+# Seconds to wait for the geolocation API before tracking the hit without a location
+GEOLOCATION_TIMEOUT = 2
+
+
+def lookup_geolocation(client_ip: str) -> dict:
+    """Country, region and city of an IP from ipinfo.io, cached, failures included. Blocking."""
+    geo_data = GEOLOCATION_CACHE.get(client_ip)
+    if geo_data is not None:
+        return geo_data
+    geo_data = {"country": None, "region": None, "city": None}
+    try:
+        geo_response = requests.get(f"https://ipinfo.io/{client_ip}/json", timeout=GEOLOCATION_TIMEOUT)
+        if geo_response.status_code == 200:
+            data = geo_response.json()
+            geo_data = {"country": data.get("country"), "region": data.get("region"), "city": data.get("city")}
+    except Exception:
+        # Geolocation lookup failed
+        pass
+    GEOLOCATION_CACHE[client_ip] = geo_data
+    return geo_data
+
+
 class EnhancedTrackingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        # Start timer for request
-        start_time = time.time()
+        # CORS preflights are not page views and have no session
+        if request.method == "OPTIONS":
+            return await call_next(request)
         
-        # Get or generate session ID
-        session_id = request.cookies.get("session_id")
-        is_new_session = False
-        if not session_id:
-            session_id = str(uuid.uuid4())
-            is_new_session = True
+        # Session resolved (and its cookie issued) by SessionCookieMiddleware
+        session = request.state.session
+        session_id = session.session_id
         
         # Process the request
         response = await call_next(request)
         
-        # Skip tracking for static files and API docs
+        # Skip tracking for static files, API docs, beacons and suggestions
         url_path = request.url.path
-        if url_path.startswith(("/static/", "/api-docs", "/openapi.json")):
-            # Still set the session cookie if needed
-            if is_new_session:
-                response.set_cookie(key="session_id", value=session_id, httponly=True, max_age=2592000)  # 30 days
+        if url_path.startswith(UNTRACKED_PATHS):
             return response
         
-        # Calculate time spent
-        time_spent = int((time.time() - start_time) * 1000)  # milliseconds
-        
         # Get client IP
         client_ip = request.client.host
         
         # Get user agent
         user_agent_str = request.headers.get("user-agent", "")
         
+        # Bots are only counted by the filter, nothing is written for them
+        if is_bot_request(request):
+            return response
+        
         # Determine event type
         event_type = "pageview"
         if "search" in url_path.lower():
             event_type = "search"
-        elif "product" in url_path.lower() and url_path.split("/")[-1].isdigit():
+        elif request.method == "GET" and "product" in url_path.lower() and url_path.split("/")[-1].isdigit():
+            # Not PUT/DELETE, which admins send to the same URL
             event_type = "product_view"
         elif "cart" in url_path.lower():
             if request.method == "POST":
@@ -66,21 +98,29 @@ class EnhancedTrackingMiddleware(BaseHTTPMiddleware):
             elif request.method == "PUT":
                 event_type = "update_cart"
         
+        # Feed the in-memory trending and live counters before any database work
+        live_counters.record_hit(session_id, event_type)
+        product_match = PRODUCT_VIEW_PATH.search(url_path)
+        if event_type == "product_view" and product_match and response.status_code == 200:
+            trending_tracker.record(event_type, int(product_match.group(1)))
+        
         # Extract query params
         query_params = {}
         if request.query_params:
             query_params = dict(request.query_params)
         
-        # Determine user type and customer ID
-        customer_id = None
-        user_type = "guest"
+        # Customer the session logged in as, bound by the login route
+        customer_id = session.customer_id
+        user_type = "customer" if customer_id else "guest"
         
-        # Try to get auth info from request state (if auth middleware has processed it)
-        if hasattr(request.state, "user") and request.state.user:
-            user_type = request.state.user.get("type", "guest")
-            user = request.state.user.get("user")
-            if user:
-                customer_id = getattr(user, "customer_id", None) or getattr(user, "user_id", None)
+        unique_counter.record(ip=client_ip, session_id=session_id, customer_id=customer_id)
+        
+        # Buffered oc_product.viewed and api_product_view writes, flushed in bulk
+        if event_type == "product_view" and product_match and response.status_code == 200:
+            product_view_counter.record(
+                int(product_match.group(1)), session_id, customer_id,
+                view_source(request.headers.get("referer", ""))
+            )
         
         # Extract UTM parameters
         utm_source = query_params.get("utm_source")
@@ -124,105 +164,61 @@ class EnhancedTrackingMiddleware(BaseHTTPMiddleware):
             # Fallback if parsing fails
             pass
         
-        # Get geolocation data
+        # Get geolocation data, off the event loop; only real IPs (not localhost)
         country = None
         region = None
         city = None
-        
-        # Check cache first to reduce API calls
-        if client_ip in GEOLOCATION_CACHE:
-            geo_data = GEOLOCATION_CACHE[client_ip]
+        if client_ip not in ("127.0.0.1", "localhost", "::1"):
+            geo_data = GEOLOCATION_CACHE.get(client_ip) or await run_in_threadpool(lookup_geolocation, client_ip)
             country = geo_data.get("country")
-            region = geo_data.get("region") 
+            region = geo_data.get("region")
             city = geo_data.get("city")
+        
+        event = {
+            "ts": time.time(),
+            "session_id": session_id,
+            "customer_id": customer_id,
+            "user_type": user_type,
+            "ip_address": client_ip,
+            "user_agent": user_agent_str,
+            "url": str(request.url),
+            "referer": referer,
+            "event_type": event_type,
+            # 0 keeps the hit on the session but stores no activity row
+            "sample_weight": event_sampler.weight(session_id, event_type),
+            "country": country,
+            "region": region,
+            "city": city,
+            "device_type": device_type,
+            "browser": browser,
+            "os": os,
+            "utm_source": utm_source,
+            "utm_medium": utm_medium,
+            "utm_campaign": utm_campaign,
+            "referring_site": referring_site
+        }
+        
+        if settings.EVENT_SPOOL:
+            # Local append only, the spool ingester loads it into the database
+            try:
+                event_spool.append(event)
+            except Exception as e:
+                print(f"Error spooling user activity: {e}")
         else:
-            # Only call geolocation API for real IPs (not localhost)
-            if client_ip not in ("127.0.0.1", "localhost", "::1"):
-                try:
-                    geo_response = requests.get(f"https://ipinfo.io/{client_ip}/json")
-                    if geo_response.status_code == 200:
-                        geo_data = geo_response.json()
-                        country = geo_data.get("country")
-                        region = geo_data.get("region")
-                        city = geo_data.get("city")
-                        
-                        # Cache for future use
-                        GEOLOCATION_CACHE[client_ip] = {
-                            "country": country,
-                            "region": region,
-                            "city": city
-                        }
-                except:
-                    # Geolocation lookup failed
-                    pass
-        
-        # Record the activity in the database
-        try:
-            db = SessionLocal()
-            
-            # 1. First update or create the session
-            session = db.query(SessionTracking).filter(SessionTracking.session_id == session_id).first()
-            
-            if session:
-                # Update existing session
-                session.last_activity = datetime.utcnow()
-                session.visit_count += 1
-                if customer_id and not session.customer_id:
-                    session.customer_id = customer_id  # Associate session with customer if now logged in
-                    session.user_type = user_type
-            else:
-                # Create new session
-                session = SessionTracking(
-                    session_id=session_id,
-                    customer_id=customer_id,
-                    user_type=user_type,
-                    ip_address=client_ip,
-                    user_agent=user_agent_str,
-                    first_visit=datetime.utcnow(),
-                    last_activity=datetime.utcnow(),
-                    visit_count=1,
-                    country=country,
-                    region=region,
-                    city=city,
-                    device_type=device_type,
-                    browser=browser,
-                    os=os,
-                    utm_source=utm_source,
-                    utm_medium=utm_medium,
-                    utm_campaign=utm_campaign,
-                    referring_site=referring_site
-                )
-                db.add(session)
-            
-            # 2. Record this activity
-            activity = UserActivity(
-                session_id=session_id,
-                customer_id=customer_id,
-                user_type=user_type,
-                ip_address=client_ip,
-                user_agent=user_agent_str,
-                url=str(request.url),
-                referer=referer,
-                page_title=url_path.split("/")[-1] or "Home",
-                query_params=json.dumps(query_params) if query_params else None,
-                time_spent=time_spent,
-                event_type=event_type,
-                event_data=None,  # Could be populated with request body data in more advanced implementations
-                country=country,
-                region=region,
-                city=city,
-                date_added=datetime.utcnow()
-            )
-            db.add(activity)
-            
-            db.commit()
-        except Exception as e:
-            print(f"Error tracking user activity: {e}")
-        finally:
-            db.close()
-        
-        # Set session ID cookie if new session
-        if is_new_session:
-            response.set_cookie(key="session_id", value=session_id, httponly=True, max_age=2592000)  # 30 days
+            # Record the activity in the database
+            try:
+                db = SessionLocal()
+                
+                # 1. Count the hit on the session (one upsert, safe under concurrent requests)
+                touch_session(db, session_id, customer_id, user_type, **session_details(event))
+                
+                # 2. Record this activity
+                record_events(db, [event])
+                
+                db.commit()
+            except Exception as e:
+                print(f"Error tracking user activity: {e}")
+            finally:
+                db.close()
         
         return response
\ No newline at end of file
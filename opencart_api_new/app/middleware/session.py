@@ -0,0 +1,38 @@
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.responses import Response
+
+from app.config import settings
+from app.utils.sessions import COOKIE_NAME, session_store
+
+class SessionCookieMiddleware(BaseHTTPMiddleware):
+    """
+    Resolves the signed session cookie into request.state.session before
+    any other middleware or route runs, and sets the cookie once for new
+    sessions. Must be added after the tracking middleware so it wraps it.
+    CORS preflights carry no cookie and get no session.
+    """
+    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+        if request.method == "OPTIONS":
+            return await call_next(request)
+        cookie = request.cookies.get(COOKIE_NAME)
+        session = session_store.cached(cookie)
+        if session is None:
+            # May read api_session, keep it off the event loop
+            session = await run_in_threadpool(session_store.load, cookie)
+        request.state.session = session
+        
+        response = await call_next(request)
+        
+        if session.needs_cookie:
+            response.set_cookie(
+                key=COOKIE_NAME,
+                value=session_store.sign(session.session_id),
+                max_age=settings.SESSION_MAX_AGE,
+                httponly=True,
+                samesite="lax",
+                secure=settings.SESSION_COOKIE_SECURE
+            )
+            session.needs_cookie = False
+        return response
@@ -2,30 +2,33 @@ from fastapi import Request
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.responses import Response
 import time
-import uuid
 from datetime import datetime
 from app.database import SessionLocal
 from app.models.online_user import OnlineUser
+from app.utils.bot_filter import is_bot_request
+
+# Requests that are not page hits: static files, API docs, sendBeacon
+# batches (their events are recorded by the /track/batch route) and
+# search-as-you-type suggestions, one per keystroke
+UNTRACKED_PATHS = ("/static/", "/api-docs", "/openapi.json", "/api/track/", "/api/search/suggest")
 
 class TrackingMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        # Generate a unique session ID if not present
-        session_id = request.cookies.get("session_id")
-        if not session_id:
-            session_id = str(uuid.uuid4())
+        # CORS preflights are not page views and have no session
+        if request.method == "OPTIONS":
+            return await call_next(request)
         
         # Process the request
         response = await call_next(request)
         
-        # Record the user activity in the database
+        # Record the user activity in the database. Sessions, unique counts
+        # and activity events are recorded by EnhancedTrackingMiddleware
         url_path = request.url.path
-        if not url_path.startswith(("/static/", "/api-docs", "/openapi.json")):
+        client_ip = request.client.host
+        if not url_path.startswith(UNTRACKED_PATHS) and not is_bot_request(request):
             try:
                 db = SessionLocal()
                 
-                # Get client IP
-                client_ip = request.client.host
-                
                 # Try to find existing session
                 online_user = db.query(OnlineUser).filter(OnlineUser.ip == client_ip).first()
                 
@@ -51,8 +54,4 @@ class TrackingMiddleware(BaseHTTPMiddleware):
             finally:
                 db.close()
         
-        # Set session ID cookie if not present
-        if "session_id" not in request.cookies:
-            response.set_cookie(key="session_id", value=session_id, httponly=True)
-        
         return response
\ No newline at end of file
@@ -1,9 +1,12 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Boolean
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Date, DateTime, Text, Float, Boolean, LargeBinary, BINARY, VARBINARY, Index
 from datetime import datetime
 from app.database import Base
 
 class UserActivity(Base):
-    """Enhanced user activity tracking table (separate from original OpenCart tables)"""
+    """
+    Enhanced user activity tracking table (separate from original OpenCart tables).
+    Legacy layout, new events are written to ActivityEvent.
+    """
     __tablename__ = "api_user_activity"
 
     activity_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -30,7 +33,7 @@ class SearchQuery(Base):
     __tablename__ = "api_search_query"
 
     search_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    session_id = Column(String(40), nullable=False)
+    session_id = Column(String(40), nullable=False, index=True)
     customer_id = Column(Integer, nullable=True, index=True)
     keyword = Column(String(255), nullable=False)
     category_id = Column(Integer, nullable=True)
@@ -45,7 +48,7 @@ class ProductView(Base):
 
     view_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     product_id = Column(Integer, nullable=False, index=True)
-    session_id = Column(String(40), nullable=False)
+    session_id = Column(String(40), nullable=False, index=True)
     customer_id = Column(Integer, nullable=True, index=True)
     source = Column(String(50), nullable=True)  # search, category, related, homepage
     time_spent = Column(Integer, nullable=True)  # seconds viewing product
@@ -73,4 +76,136 @@ class SessionTracking(Base):
     utm_source = Column(String(100), nullable=True)
     utm_medium = Column(String(100), nullable=True)
     utm_campaign = Column(String(100), nullable=True)
-    referring_site = Column(String(255), nullable=True)
\ No newline at end of file
+    referring_site = Column(String(255), nullable=True)
+
+class ProductRecommendation(Base):
+    """Item-to-item recommendations computed by the co-occurrence job"""
+    __tablename__ = "api_product_recommendation"
+
+    product_id = Column(Integer, primary_key=True)
+    kind = Column(String(20), primary_key=True)  # co_view, co_purchase
+    related_id = Column(Integer, primary_key=True)
+    score = Column(Float, nullable=False)
+    co_count = Column(Integer, nullable=False)
+    date_modified = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class UniqueCountRegister(Base):
+    """Hourly HyperLogLog registers for approximate distinct counts"""
+    __tablename__ = "api_unique_count"
+
+    metric = Column(String(20), primary_key=True)  # ip, session, customer
+    hour_start = Column(DateTime, primary_key=True)  # UTC
+    registers = Column(LargeBinary, nullable=False)  # zlib compressed registers
+    date_modified = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SpoolOffset(Base):
+    """
+    Progress of the event loaders: bytes of each spool segment already
+    ingested, or the last legacy row id copied by the activity backfill
+    """
+    __tablename__ = "api_spool_offset"
+
+    segment = Column(String(64), primary_key=True)  # segment file name without suffix, or loader name
+    offset = Column(BigInteger, nullable=False, default=0)
+    date_modified = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+
+class ActivityEvent(Base):
+    """
+    Compact user activity events. Repeated strings live in the api_dim_*
+    tables, event and user types are small integer codes
+    (app.utils.activity_store) and the IP is stored packed.
+    """
+    __tablename__ = "api_activity_event"
+
+    event_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    date_added = Column(DateTime, nullable=False, default=datetime.utcnow)
+    session_key = Column(Integer, nullable=False, index=True)
+    customer_id = Column(Integer, nullable=True, index=True)
+    user_type = Column(SmallInteger, nullable=False, default=0)
+    event_type = Column(SmallInteger, nullable=False)
+    ip_address = Column(VARBINARY(16), nullable=True)  # 4 or 16 bytes
+    url_id = Column(Integer, nullable=False)
+    referer_id = Column(Integer, nullable=True)
+    user_agent_id = Column(Integer, nullable=True)
+    geo_id = Column(Integer, nullable=True)
+    time_spent = Column(Integer, nullable=True)  # milliseconds
+    event_data = Column(Text, nullable=True)
+    sample_weight = Column(Float, nullable=False, default=1.0, server_default="1")  # events represented by this row
+
+    __table_args__ = (
+        Index("ix_activity_event_type_date", "event_type", "date_added"),
+        Index("ix_activity_event_date", "date_added"),
+    )
+
+
+class SessionKey(Base):
+    """Integer key for each session id, used by ActivityEvent"""
+    __tablename__ = "api_dim_session"
+
+    session_key = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(40), nullable=False, unique=True)
+
+
+class UrlDimension(Base):
+    """Distinct request URLs (query string included)"""
+    __tablename__ = "api_dim_url"
+
+    url_id = Column(Integer, primary_key=True, autoincrement=True)
+    url_hash = Column(BINARY(16), nullable=False, unique=True)  # MD5 of url
+    url = Column(Text, nullable=False)
+    page_title = Column(String(255), nullable=True)
+
+
+class RefererDimension(Base):
+    """Distinct referer headers"""
+    __tablename__ = "api_dim_referer"
+
+    referer_id = Column(Integer, primary_key=True, autoincrement=True)
+    referer_hash = Column(BINARY(16), nullable=False, unique=True)  # MD5 of referer
+    referer = Column(Text, nullable=False)
+
+
+class UserAgentDimension(Base):
+    """Distinct user agent strings and what was parsed from them"""
+    __tablename__ = "api_dim_user_agent"
+
+    user_agent_id = Column(Integer, primary_key=True, autoincrement=True)
+    user_agent_hash = Column(BINARY(16), nullable=False, unique=True)  # MD5 of user_agent
+    user_agent = Column(Text, nullable=False)
+    device_type = Column(String(20), nullable=True)
+    browser = Column(String(50), nullable=True)
+    os = Column(String(50), nullable=True)
+
+
+class GeoDimension(Base):
+    """Distinct country, region and city combinations"""
+    __tablename__ = "api_dim_geo"
+
+    geo_id = Column(Integer, primary_key=True, autoincrement=True)
+    geo_hash = Column(BINARY(16), nullable=False, unique=True)  # MD5 of the joined fields
+    country = Column(String(100), nullable=True)
+    region = Column(String(100), nullable=True)
+    city = Column(String(100), nullable=True)
+
+
+class AttributionDaily(Base):
+    """
+    Sessions started and orders attributed per day and channel, maintained
+    by app.utils.attribution for closed days. Orders and revenue are
+    attributed by `model`: the customer's first or last session before the
+    order.
+    """
+    __tablename__ = "api_attribution_daily"
+
+    day = Column(Date, primary_key=True)
+    model = Column(String(12), primary_key=True)  # first_touch, last_touch
+    source = Column(String(100), primary_key=True)  # utm_source, referring host or (direct)
+    medium = Column(String(100), primary_key=True)  # utm_medium, referral or (none)
+    campaign = Column(String(100), primary_key=True)  # utm_campaign or ""
+    sessions = Column(Integer, nullable=False, default=0)
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)
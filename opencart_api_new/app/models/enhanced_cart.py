@@ -15,7 +15,7 @@ class EnhancedCart(Base):
     options = Column(Text, nullable=True)  # JSON string of product options
     price = Column(Float, nullable=False, default=0.0)  # Price at time of adding to cart
     date_added = Column(DateTime, nullable=False, default=datetime.utcnow)
-    last_updated = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_updated = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
     saved_for_later = Column(Boolean, nullable=False, default=False)
     source = Column(String(50), nullable=True)  # How item was added: quick_add, product_page, etc.
     notes = Column(Text, nullable=True)  # Customer notes for this item
@@ -27,7 +27,7 @@ class CartHistory(Base):
 
     history_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     cart_id = Column(Integer, ForeignKey("api_cart.cart_id"), nullable=False)
-    session_id = Column(String(40), nullable=False)
+    session_id = Column(String(40), nullable=False, index=True)
     customer_id = Column(Integer, nullable=True)
     product_id = Column(Integer, nullable=False)
     action = Column(String(20), nullable=False)  # add, update, remove
@@ -44,7 +44,7 @@ class AbandonedCart(Base):
     __tablename__ = "api_abandoned_cart"
 
     abandoned_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    session_id = Column(String(40), nullable=False)
+    session_id = Column(String(40), nullable=False, index=True)
     customer_id = Column(Integer, nullable=True, index=True)
     email = Column(String(255), nullable=True)
     phone = Column(String(32), nullable=True)
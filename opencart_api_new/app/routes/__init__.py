@@ -2,7 +2,7 @@ from fastapi import APIRouter
 from app.routes import ( 
     product, category, customer, order,
      product_image, product_description, product_option, product_option_value,
-     auth,address, country, zone, analytics, cart 
+     auth,address, country, zone, analytics, cart, search, enhanced_analytics, tracking
 )
 
 router = APIRouter()
@@ -20,4 +20,7 @@ router.include_router(address.router)  # Add new router
 router.include_router(country.router)  # Add new router
 router.include_router(zone.router)     # Add new router
 router.include_router(analytics.router)  # Add analytics router
-router.include_router(cart.router)       # Add cart router
\ No newline at end of file
+router.include_router(cart.router)       # Add cart router
+router.include_router(search.router)     # Add search router
+router.include_router(enhanced_analytics.router)  # Add v2 analytics router
+router.include_router(tracking.router)    # Add beacon tracking router
\ No newline at end of file
@@ -7,6 +7,9 @@ from datetime import datetime, timedelta
 from app.database import get_db
 from app.models.online_user import OnlineUser
 from app.utils.auth import get_current_admin
+from app.utils.bot_filter import bot_filter
+from app.utils.cart_gc import guest_cart_collector
+from app.utils.hyperloglog import unique_counter
 
 router = APIRouter(
     prefix="/analytics",
@@ -54,11 +57,24 @@ def get_online_users(
 def get_visitor_count(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin),
-    days: int = Query(7, ge=1)
+    days: int = Query(7, ge=1),
+    exact: bool = Query(False, description="Count with COUNT(DISTINCT) instead of the HyperLogLog estimate")
 ):
     """
     Get visitor count statistics (admin only)
+    
+    By default the counts are HyperLogLog estimates over whole UTC hours,
+    within about 1.6% of the true value 95% of the time.
     """
+    if not exact:
+        start = datetime.utcnow() - timedelta(days=days)
+        return {
+            "total_visitors": unique_counter.count(db, "ip", start),
+            "unique_customers": unique_counter.count(db, "customer", start),
+            "period_days": days,
+            "approximate": True
+        }
+    
     cutoff_date = datetime.now() - timedelta(days=days)
     
     total_visitors = db.query(func.count(OnlineUser.ip.distinct())).filter(
@@ -73,7 +89,8 @@ def get_visitor_count(
     return {
         "total_visitors": total_visitors,
         "unique_customers": unique_customers,
-        "period_days": days
+        "period_days": days,
+        "approximate": False
     }
 
 @router.get("/stats/popular-pages")
@@ -105,4 +122,24 @@ def get_popular_pages(
             } for url, count in popular_pages
         ],
         "period_days": days
-    }
\ No newline at end of file
+    }
+
+@router.get("/stats/bots")
+def get_bot_stats(current_admin = Depends(get_current_admin)):
+    """
+    Requests skipped by bot filtering in this worker since it started, by reason (admin only)
+    """
+    return bot_filter.stats()
+
+@router.get("/stats/cart-gc")
+def get_cart_gc_stats(
+    current_admin = Depends(get_current_admin),
+    dry_run: bool = Query(False, description="Also count the guest cart rows the next run would delete")
+):
+    """
+    Guest cart rows deleted by this worker's garbage collection since it started (admin only)
+    """
+    stats = guest_cart_collector.stats()
+    if dry_run:
+        stats["pending"] = guest_cart_collector.run(dry_run=True)
+    return stats
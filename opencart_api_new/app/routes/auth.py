@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import Any
@@ -11,6 +11,8 @@ from app.utils.auth import (
     verify_password_customer, verify_password_admin,
     create_access_token, get_current_customer, get_current_admin
 )
+from app.utils.session_stitching import session_stitcher
+from app.utils.sessions import session_store
 
 router = APIRouter(
     prefix="/auth",
@@ -18,7 +20,7 @@ router = APIRouter(
 )
 
 @router.post("/customer/login", response_model=Token)
-def login_customer(login_data: CustomerLogin, db: Session = Depends(get_db)) -> Any:
+def login_customer(login_data: CustomerLogin, request: Request, db: Session = Depends(get_db)) -> Any:
     """
     Customer login endpoint
     """
@@ -48,6 +50,10 @@ def login_customer(login_data: CustomerLogin, db: Session = Depends(get_db)) ->
         }
     )
     
+    # Attribute the browsing done as a guest to the customer, off the request path
+    session_store.bind_customer(request.state.session, customer.customer_id)
+    session_stitcher.enqueue(request.state.session.session_id, customer.customer_id)
+    
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/admin/login", response_model=Token)
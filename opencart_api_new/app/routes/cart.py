@@ -1,15 +1,15 @@
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Request, Cookie
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from datetime import datetime
 import json
-import uuid
 
 from app.database import get_db
 from app.models.cart import Cart
 from app.models.product import Product, ProductDescription
 from app.schemas.cart import CartItem, CartItemCreate, CartItemUpdate, CartSummary
 from app.utils.auth import get_current_customer, get_current_user
+from app.utils.trending import trending_tracker
 
 router = APIRouter(
     prefix="/cart",
@@ -17,16 +17,9 @@ router = APIRouter(
     responses={404: {"description": "Item not found"}},
 )
 
-def get_user_session_id(
-    session_id: Optional[str] = Cookie(None),
-    request: Request = None
-):
-    """Get the user's session ID from cookie or create one if not exists"""
-    if not session_id and request:
-        session_id = str(uuid.uuid4())
-        # Note: we would normally set the cookie here, but that requires access to the response
-        # which FastAPI doesn't support in dependencies. This is handled in the tracking middleware.
-    return session_id or str(uuid.uuid4())
+def get_user_session_id(request: Request) -> str:
+    """The session id of the request, issued and persisted by SessionCookieMiddleware"""
+    return request.state.session.session_id
 
 @router.get("/", response_model=CartSummary)
 def get_cart(
@@ -138,6 +131,8 @@ def add_to_cart(
         db.commit()
         db.refresh(cart_item)
     
+    trending_tracker.record("add_to_cart", item_data.product_id)
+    
     # Get product description for response
     product_desc = db.query(ProductDescription).filter(
         ProductDescription.product_id == item_data.product_id,
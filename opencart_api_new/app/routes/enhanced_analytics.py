@@ -1,13 +1,30 @@
+import asyncio
+import json
+import math
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, and_, distinct
+from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 
 from app.database import get_db
-from app.models.analytics import UserActivity, SearchQuery, ProductView, SessionTracking
-from app.models.enhanced_cart import EnhancedCart, CartHistory, AbandonedCart
+from app.models.analytics import ActivityEvent, SearchQuery, ProductView, SessionTracking, SessionKey, UrlDimension
+from app.models.enhanced_cart import AbandonedCart
+from app.utils.activity_store import EVENT_TYPES, popular_pages as query_popular_pages
+from app.utils.attribution import DIMENSIONS as ATTRIBUTION_DIMENSIONS, MODELS as ATTRIBUTION_MODELS, attribution_report
 from app.utils.auth import get_current_admin
+from app.utils.cohorts import GRANULARITIES as COHORT_GRANULARITIES, cohort_engine, cohort_report
+from app.utils.columnar_archive import columnar_archive, hot_window_start
+from app.utils.dashboard_stats import COMPARE_MODES as DASHBOARD_COMPARE_MODES, dashboard_stats, period_change
+from app.utils.funnel import DIMENSIONS as FUNNEL_DIMENSIONS, FUNNEL_STEPS, funnel_cache, funnel_report
+from app.utils.live_stats import live_broadcaster
+
+# Hot window rows ranked per requested row when merging with archived counts
+HOT_CANDIDATE_FACTOR = 20
+
+# Seconds between SSE comments that keep idle proxies from closing the stream
+LIVE_KEEPALIVE = 15
 
 router = APIRouter(
     prefix="/analytics/v2",
@@ -19,95 +36,34 @@ router = APIRouter(
 def get_dashboard_stats(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin),
-    days: int = Query(7, ge=1, le=90)
+    days: int = Query(7, ge=1, le=3660),
+    exact: bool = Query(False, description="Count unique customers with COUNT(DISTINCT)"),
+    compare: Optional[str] = Query(None, description="previous_period: also compute the preceding window of the same length")
 ):
     """
     Get comprehensive dashboard statistics (admin only)
-    """
-    cutoff_date = datetime.utcnow() - timedelta(days=days)
-    
-    # Get visitor stats
-    total_sessions = db.query(func.count(distinct(SessionTracking.session_id))).filter(
-        SessionTracking.first_visit >= cutoff_date
-    ).scalar() or 0
-    
-    returning_sessions = db.query(func.count(distinct(SessionTracking.session_id))).filter(
-        SessionTracking.first_visit < cutoff_date,
-        SessionTracking.last_activity >= cutoff_date
-    ).scalar() or 0
-    
-    unique_customers = db.query(func.count(distinct(SessionTracking.customer_id))).filter(
-        SessionTracking.customer_id.isnot(None),
-        SessionTracking.last_activity >= cutoff_date
-    ).scalar() or 0
-    
-    # Get device stats
-    device_stats = db.query(
-        SessionTracking.device_type,
-        func.count(distinct(SessionTracking.session_id)).label("count")
-    ).filter(
-        SessionTracking.last_activity >= cutoff_date
-    ).group_by(SessionTracking.device_type).all()
-    
-    device_breakdown = {device: count for device, count in device_stats}
-    
-    # Get page view stats
-    page_views = db.query(func.count(UserActivity.activity_id)).filter(
-        UserActivity.date_added >= cutoff_date,
-        UserActivity.event_type == "pageview"
-    ).scalar() or 0
-    
-    product_views = db.query(func.count(UserActivity.activity_id)).filter(
-        UserActivity.date_added >= cutoff_date,
-        UserActivity.event_type == "product_view"
-    ).scalar() or 0
-    
-    search_count = db.query(func.count(SearchQuery.search_id)).filter(
-        SearchQuery.date_added >= cutoff_date
-    ).scalar() or 0
-    
-    # Get cart stats
-    cart_add_count = db.query(func.count(CartHistory.history_id)).filter(
-        CartHistory.date_added >= cutoff_date,
-        CartHistory.action == "add"
-    ).scalar() or 0
-    
-    abandoned_carts = db.query(func.count(AbandonedCart.abandoned_id)).filter(
-        AbandonedCart.abandoned_date >= cutoff_date,
-        AbandonedCart.recovery_status == "pending"
-    ).scalar() or 0
-    
-    # Get location stats
-    location_stats = db.query(
-        SessionTracking.country,
-        func.count(distinct(SessionTracking.session_id)).label("count")
-    ).filter(
-        SessionTracking.last_activity >= cutoff_date,
-        SessionTracking.country.isnot(None)
-    ).group_by(SessionTracking.country).order_by(desc("count")).limit(5).all()
-    
-    location_breakdown = [{"country": country, "count": count} for country, count in location_stats]
     
-    # Combine all stats
-    return {
-        "visitors": {
-            "total_sessions": total_sessions,
-            "returning_sessions": returning_sessions,
-            "unique_customers": unique_customers,
-            "device_breakdown": device_breakdown
-        },
-        "activity": {
-            "page_views": page_views,
-            "product_views": product_views,
-            "searches": search_count,
-            "cart_adds": cart_add_count,
-            "abandoned_carts": abandoned_carts
-        },
-        "geo": {
-            "top_countries": location_breakdown
-        },
-        "period_days": days
+    Whole days older than the hot window (ANALYTICS_HOT_DAYS) are read from
+    the columnar archive, the rest from the database. Both windows of a
+    comparison come from the same scans.
+    """
+    if compare is not None and compare not in DASHBOARD_COMPARE_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown compare mode: {compare}")
+    
+    stats = dashboard_stats(db, days, exact, compare)
+    current = stats["current"]
+    
+    result = {
+        "visitors": current["visitors"],
+        "activity": current["activity"],
+        "geo": current["geo"],
+        "period_days": days,
+        "archived_days_missing": current["archived_days_missing"]
     }
+    if stats["previous"]:
+        result["previous_period"] = stats["previous"]
+        result["change"] = period_change(current, stats["previous"])
+    return result
 
 @router.get("/visitors/online", response_model=Dict[str, Any])
 def get_online_visitors(
@@ -125,12 +81,28 @@ def get_online_visitors(
         SessionTracking.last_activity >= cutoff_time
     ).all()
     
-    # For each session, get the last activity
+    # Last page of every session in one query: latest event per session key
+    last_pages = {}
+    if sessions:
+        latest = db.query(
+            SessionKey.session_id,
+            func.max(ActivityEvent.event_id).label("event_id")
+        ).join(
+            ActivityEvent, ActivityEvent.session_key == SessionKey.session_key
+        ).filter(
+            SessionKey.session_id.in_([session.session_id for session in sessions]),
+            ActivityEvent.date_added >= cutoff_time
+        ).group_by(SessionKey.session_id).subquery()
+        rows = db.query(latest.c.session_id, UrlDimension.url, UrlDimension.page_title).join(
+            ActivityEvent, ActivityEvent.event_id == latest.c.event_id
+        ).join(
+            UrlDimension, UrlDimension.url_id == ActivityEvent.url_id
+        ).all()
+        last_pages = {session_id: (url, title) for session_id, url, title in rows}
+    
     result = []
     for session in sessions:
-        last_activity = db.query(UserActivity).filter(
-            UserActivity.session_id == session.session_id
-        ).order_by(desc(UserActivity.date_added)).first()
+        last_url, last_page = last_pages.get(session.session_id, (None, None))
         
         result.append({
             "session_id": session.session_id,
@@ -141,8 +113,8 @@ def get_online_visitors(
             "browser": session.browser,
             "location": f"{session.city or ''}, {session.region or ''}, {session.country or ''}",
             "last_activity_time": session.last_activity,
-            "last_url": last_activity.url if last_activity else None,
-            "last_page": last_activity.page_title if last_activity else None,
+            "last_url": last_url,
+            "last_page": last_page,
             "visit_count": session.visit_count
         })
     
@@ -152,56 +124,122 @@ def get_online_visitors(
         "time_window_minutes": minutes
     }
 
+@router.get("/live")
+async def stream_live_stats(
+    request: Request,
+    current_admin = Depends(get_current_admin)
+):
+    """
+    Server-Sent Events stream of online visitors, per-minute pageview,
+    product view and cart add rates and recent orders (admin only)
+    
+    Figures come from in-memory counters of the worker serving the stream.
+    One snapshot every LIVE_STATS_INTERVAL seconds is shared by all
+    subscribers; a client that falls behind skips snapshots.
+    """
+    queue = live_broadcaster.subscribe()
+    
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    payload = await asyncio.wait_for(queue.get(), timeout=LIVE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: stats\ndata: {payload}\n\n"
+        finally:
+            live_broadcaster.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Disable nginx response buffering
+    })
+
 @router.get("/content/popular", response_model=Dict[str, Any])
 def get_popular_content(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin),
-    days: int = Query(7, ge=1, le=90),
+    days: int = Query(7, ge=1, le=3660),
     limit: int = Query(10, ge=1, le=100)
 ):
     """
     Get most popular content (admin only)
+    
+    Ranges reaching past the hot window add archived counts to the database
+    counts of the top candidates from the hot window.
     """
     cutoff_date = datetime.utcnow() - timedelta(days=days)
+    hot_start = max(cutoff_date, hot_window_start())
     
-    # Get popular pages
-    popular_pages = db.query(
-        UserActivity.url,
-        UserActivity.page_title,
-        func.count(UserActivity.activity_id).label("view_count")
-    ).filter(
-        UserActivity.date_added >= cutoff_date,
-        UserActivity.event_type == "pageview"
-    ).group_by(UserActivity.url, UserActivity.page_title).order_by(
-        desc("view_count")
-    ).limit(limit).all()
-    
-    # Get popular products
-    popular_products = db.query(
-        ProductView.product_id,
-        func.count(ProductView.view_id).label("view_count")
-    ).filter(
-        ProductView.date_added >= cutoff_date
-    ).group_by(ProductView.product_id).order_by(
-        desc("view_count")
-    ).limit(limit).all()
-    
-    # Get popular search terms
-    popular_searches = db.query(
-        SearchQuery.keyword,
-        func.count(SearchQuery.search_id).label("search_count")
-    ).filter(
-        SearchQuery.date_added >= cutoff_date
-    ).group_by(SearchQuery.keyword).order_by(
-        desc("search_count")
-    ).limit(limit).all()
+    if cutoff_date >= hot_start:
+        # Get popular pages
+        popular_pages = query_popular_pages(db, cutoff_date, limit)
+        
+        # Get popular products
+        popular_products = db.query(
+            ProductView.product_id,
+            func.count(ProductView.view_id).label("view_count")
+        ).filter(
+            ProductView.date_added >= cutoff_date
+        ).group_by(ProductView.product_id).order_by(
+            desc("view_count")
+        ).limit(limit).all()
+        
+        # Get popular search terms
+        popular_searches = db.query(
+            SearchQuery.keyword,
+            func.count(SearchQuery.search_id).label("search_count")
+        ).filter(
+            SearchQuery.date_added >= cutoff_date
+        ).group_by(SearchQuery.keyword).order_by(
+            desc("search_count")
+        ).limit(limit).all()
+    else:
+        candidates = limit * HOT_CANDIDATE_FACTOR
+        
+        page_counts = columnar_archive.top_values(
+            "activity", "url_id", cutoff_date, hot_start, {"event_type": EVENT_TYPES["pageview"]}, "sample_weight"
+        )
+        page_counts.update(dict(db.query(
+            ActivityEvent.url_id,
+            func.sum(ActivityEvent.sample_weight).label("view_count")
+        ).filter(
+            ActivityEvent.event_type == EVENT_TYPES["pageview"],
+            ActivityEvent.date_added >= hot_start
+        ).group_by(ActivityEvent.url_id).order_by(desc("view_count")).limit(candidates).all()))
+        top_pages = page_counts.most_common(limit)
+        pages = {
+            url_id: (url, title) for url_id, url, title in db.query(
+                UrlDimension.url_id, UrlDimension.url, UrlDimension.page_title
+            ).filter(UrlDimension.url_id.in_([url_id for url_id, _ in top_pages]))
+        }
+        popular_pages = [(*pages[url_id], count) for url_id, count in top_pages if url_id in pages]
+        
+        product_counts = columnar_archive.top_values("product_view", "product_id", cutoff_date, hot_start)
+        product_counts.update(dict(db.query(
+            ProductView.product_id,
+            func.count(ProductView.view_id)
+        ).filter(
+            ProductView.date_added >= hot_start
+        ).group_by(ProductView.product_id).all()))
+        popular_products = product_counts.most_common(limit)
+        
+        search_counts = columnar_archive.top_values("search", "keyword", cutoff_date, hot_start)
+        search_counts.update(dict(db.query(
+            SearchQuery.keyword,
+            func.count(SearchQuery.search_id).label("search_count")
+        ).filter(
+            SearchQuery.date_added >= hot_start
+        ).group_by(SearchQuery.keyword).order_by(desc("search_count")).limit(candidates).all()))
+        popular_searches = search_counts.most_common(limit)
     
     return {
         "popular_pages": [
             {
                 "url": url,
                 "title": title or url.split("/")[-1],
-                "view_count": count
+                "view_count": round(count)
             } for url, title, count in popular_pages
         ],
         "popular_products": [
@@ -219,6 +257,109 @@ def get_popular_content(
         "period_days": days
     }
 
+@router.get("/funnel", response_model=Dict[str, Any])
+def get_conversion_funnel(
+    current_admin = Depends(get_current_admin),
+    days: int = Query(7, ge=1, le=90),
+    dimension: Optional[str] = Query(None, description=f"Break down by one of: {', '.join(FUNNEL_DIMENSIONS)}"),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """
+    Get view -> product view -> add to cart -> order funnel (admin only)
+    
+    Counts sessions reaching each step in order. Orders are attributed to
+    logged-in sessions only. Results are cached per (days, dimension) for
+    FUNNEL_CACHE_TTL seconds.
+    """
+    if dimension is not None and dimension not in FUNNEL_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown dimension: {dimension}")
+    
+    computed_at, counts = funnel_cache.get(days, dimension)
+    
+    # Overall funnel is the sum of the breakdown
+    total = [sum(step_counts) for step_counts in zip(*counts.values())] or [0] * len(FUNNEL_STEPS)
+    breakdown = sorted(counts.items(), key=lambda item: -item[1][0])[:limit]
+    
+    return {
+        "funnel": funnel_report(total),
+        "breakdown": [
+            {"value": value, **funnel_report(value_counts)} for value, value_counts in breakdown
+        ] if dimension else [],
+        "dimension": dimension,
+        "computed_at": computed_at,
+        "period_days": days
+    }
+
+@router.get("/cohorts", response_model=Dict[str, Any])
+def get_cohort_retention(
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin),
+    granularity: str = Query("week", description=f"One of: {', '.join(COHORT_GRANULARITIES)}"),
+    cohorts: int = Query(12, ge=1, le=104)
+):
+    """
+    Get retention of visitor cohorts by week or month of first visit (admin only)
+    
+    Customers are followed across sessions, guests within their session
+    cookie. Computed in memory from api_session, refreshed with sessions
+    changed since the last refresh every COHORT_REFRESH seconds.
+    """
+    if granularity not in COHORT_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity: {granularity}")
+    
+    cohort_periods, counts, refreshed_at = cohort_engine.retention(db, granularity)
+    
+    return {
+        "cohorts": cohort_report(cohort_periods, counts, granularity, cohorts, refreshed_at),
+        "granularity": granularity,
+        "refreshed_at": refreshed_at
+    }
+
+@router.get("/attribution", response_model=Dict[str, Any])
+def get_attribution(
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin),
+    days: int = Query(30, ge=1, le=3660),
+    model: str = Query("last_touch", description=f"One of: {', '.join(ATTRIBUTION_MODELS)}"),
+    group_by: str = Query("source,medium", description=f"Comma separated: {', '.join(ATTRIBUTION_DIMENSIONS)}"),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """
+    Get sessions, orders and revenue per UTM campaign or referrer (admin only)
+
+    Orders are credited to the customer's first or last session before
+    them. Closed days come from the daily aggregate, only today is read
+    from raw sessions.
+    """
+    if model not in ATTRIBUTION_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}")
+    dimensions = [name.strip() for name in group_by.split(",") if name.strip()]
+    unknown = [name for name in dimensions if name not in ATTRIBUTION_DIMENSIONS]
+    if unknown or not dimensions:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by: {group_by}")
+
+    today = datetime.utcnow().date()
+    start = today - timedelta(days=days - 1)
+    report = attribution_report(db, start, today, model, dimensions)
+
+    rows = sorted(report["rows"].items(), key=lambda item: (-item[1]["revenue"], -item[1]["sessions"]))
+    return {
+        "channels": [
+            {
+                **dict(zip(dimensions, key)),
+                "sessions": values["sessions"],
+                "orders": values["orders"],
+                "revenue": round(values["revenue"], 2),
+                "conversion_rate": values["orders"] / values["sessions"] if values["sessions"] else None
+            }
+            for key, values in rows[:limit]
+        ],
+        "model": model,
+        "period": f"{start} - {today}",
+        "aggregated_through": report["aggregated_through"],
+        "pending_days": report["pending_days"]
+    }
+
 @router.get("/carts/abandoned", response_model=Dict[str, Any])
 def get_abandoned_carts(
     db: Session = Depends(get_db),
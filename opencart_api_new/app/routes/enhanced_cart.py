@@ -1,9 +1,8 @@
 from typing import List, Optional, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, Request, Cookie
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import json
-import uuid
 
 from app.database import get_db
 from app.models.enhanced_cart import EnhancedCart, CartHistory, AbandonedCart
@@ -11,6 +10,7 @@ from app.models.product import Product, ProductDescription
 from app.schemas.enhanced_cart import EnhancedCart as EnhancedCartSchema
 from app.schemas.enhanced_cart import EnhancedCartCreate, EnhancedCartUpdate
 from app.utils.auth import get_current_customer, get_current_user
+from app.utils.trending import trending_tracker
 
 router = APIRouter(
     prefix="/cart/v2",
@@ -18,14 +18,9 @@ router = APIRouter(
     responses={404: {"description": "Item not found"}},
 )
 
-def get_user_session_id(
-    session_id: Optional[str] = Cookie(None),
-    request: Request = None
-):
-    """Get the user's session ID from cookie or create one if not exists"""
-    if not session_id and request:
-        session_id = str(uuid.uuid4())
-    return session_id or str(uuid.uuid4())
+def get_user_session_id(request: Request) -> str:
+    """The session id of the request, issued and persisted by SessionCookieMiddleware"""
+    return request.state.session.session_id
 
 @router.get("/", response_model=Dict[str, Any])
 def get_cart(
@@ -201,6 +196,8 @@ def add_to_cart(
         db.add(history)
         db.commit()
     
+    trending_tracker.record("add_to_cart", item_data.product_id)
+    
     # Get product description for response
     product_desc = db.query(ProductDescription).filter(
         ProductDescription.product_id == item_data.product_id,
@@ -7,6 +7,7 @@ from app.database import get_db
 from app.models.order import Order, OrderProduct, OrderHistory
 from app.schemas.order import OrderInList, OrderDetail, OrderCreate, OrderUpdate
 from app.utils.auth import get_current_admin, get_current_customer, get_current_user  # Add this import
+from app.utils.live_stats import live_counters
 
 router = APIRouter(
     prefix="/orders",
@@ -171,6 +172,8 @@ def create_order(
     db.commit()
     db.refresh(new_order)
     
+    live_counters.record_order(new_order.order_id, new_order.customer_id, new_order.total)
+    
     return new_order
 
 @router.put("/{order_id}", response_model=OrderDetail)
@@ -1,13 +1,25 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import or_
 from datetime import datetime
 
 from app.database import get_db
-from app.models.product import Product, ProductDescription, ProductImage, ProductToCategory, ProductSpecification, ProductOption
-from app.schemas.product import ProductInList, ProductDetail, ProductCreate, ProductUpdate
+from app.models.product import (
+    Product, ProductDescription, ProductImage, ProductToCategory, ProductSpecification,
+    ProductOption, ProductRelated
+)
+from app.schemas.product import (
+    ProductInList, ProductDetail, ProductCreate, ProductUpdate,
+    ProductLookupResult, ProductLookupBatchRequest, ProductLookupBatchResult, SimilarProduct
+)
 from app.utils.auth import get_current_admin, get_current_user  # Add this import
+from app.utils.product_lookup import IDENTIFIER_FIELDS, product_identifier_index
+from app.utils.recommendations import recommendation_store
+from app.utils.similar_products import similar_products
+from app.utils.trending import ALL_CATEGORIES, trending_tracker
+from app.utils.catalog import catalog_changed
+from app.utils.fuzzy_search import spelling_index
 
 router = APIRouter(
     prefix="/products",
@@ -15,20 +27,16 @@ router = APIRouter(
     responses={404: {"description": "Product not found"}},
 )
 
-@router.get("/", response_model=List[ProductInList])
-def get_products(
-    db: Session = Depends(get_db),
-    skip: int = 0,
-    limit: int = 100,
-    search: Optional[str] = None,
-    category_id: Optional[int] = None,
-    min_price: Optional[float] = None,
-    max_price: Optional[float] = None,
-    status: Optional[bool] = None,
+def _query_products(
+    db: Session,
+    skip: int,
+    limit: int,
+    search: Optional[str],
+    category_id: Optional[int],
+    min_price: Optional[float],
+    max_price: Optional[float],
+    status: Optional[bool],
 ):
-    """
-    Get list of products with optional filtering
-    """
     query = db.query(Product).join(
         ProductDescription, 
         Product.product_id == ProductDescription.product_id
@@ -58,7 +66,33 @@ def get_products(
     if status is not None:
         query = query.filter(Product.status == status)
     
-    products = query.offset(skip).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+@router.get("/", response_model=List[ProductInList])
+def get_products(
+    response: Response,
+    db: Session = Depends(get_db),
+    skip: int = 0,
+    limit: int = 100,
+    search: Optional[str] = None,
+    category_id: Optional[int] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    status: Optional[bool] = None,
+):
+    """
+    Get list of products with optional filtering.
+    A search without results is retried once with spelling corrections,
+    the corrected phrase is returned in the X-Search-Corrected header.
+    """
+    products = _query_products(db, skip, limit, search, category_id, min_price, max_price, status)
+    
+    if search and not products and skip == 0:
+        corrected = spelling_index.correct(search)
+        if corrected:
+            products = _query_products(db, skip, limit, corrected, category_id, min_price, max_price, status)
+            if products:
+                response.headers["X-Search-Corrected"] = corrected
     
     result = []
     for product in products:
@@ -76,6 +110,108 @@ def get_products(
     
     return result
 
+def _product_summaries(db: Session, product_ids) -> Dict[int, dict]:
+    """Load ProductInList style summaries for many products with one IN query"""
+    if not product_ids:
+        return {}
+    
+    products = db.query(Product).options(
+        joinedload(Product.descriptions)
+    ).filter(Product.product_id.in_(set(product_ids))).all()
+    
+    return {
+        product.product_id: {
+            "product_id": product.product_id,
+            "model": product.model,
+            "name": product.descriptions[0].name if product.descriptions else "",
+            "price": product.price,
+            "quantity": product.quantity,
+            "status": product.status,
+            "image": product.image,
+        } for product in products
+    }
+
+def _hydrate_lookup_matches(db: Session, matches_by_code: Dict[str, list]) -> Dict[str, list]:
+    """Attach product summaries to (field, product_id) matches"""
+    summaries = _product_summaries(
+        db, [product_id for matches in matches_by_code.values() for _, product_id in matches]
+    )
+    
+    result = {}
+    for code, matches in matches_by_code.items():
+        result[code] = [
+            {**summaries[product_id], "matched_field": field}
+            for field, product_id in matches
+            if product_id in summaries  # Skip products deleted since the index was built
+        ]
+    return result
+
+def _validate_lookup_field(field: Optional[str]):
+    if field is not None and field not in IDENTIFIER_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown identifier field, expected one of: {', '.join(IDENTIFIER_FIELDS)}"
+        )
+
+@router.get("/lookup", response_model=ProductLookupResult)
+def lookup_product(
+    code: str = Query(..., min_length=1, max_length=100),
+    field: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Find products by exact SKU, model, UPC, EAN, JAN, ISBN or MPN
+    """
+    _validate_lookup_field(field)
+    product_identifier_index.ensure_fresh(db)
+    
+    matches = _hydrate_lookup_matches(db, {code: product_identifier_index.lookup(code, field)})[code]
+    if not matches:
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    return {"code": code, "matches": matches}
+
+@router.post("/lookup/batch", response_model=ProductLookupBatchResult)
+def lookup_products_batch(
+    lookup_data: ProductLookupBatchRequest,
+    db: Session = Depends(get_db)
+):
+    """
+    Resolve many product identifiers in a single call
+    """
+    _validate_lookup_field(lookup_data.field)
+    product_identifier_index.ensure_fresh(db)
+    
+    results = _hydrate_lookup_matches(
+        db, product_identifier_index.lookup_many(lookup_data.codes, lookup_data.field)
+    )
+    
+    return {
+        "results": {code: matches for code, matches in results.items() if matches},
+        "not_found": [code for code, matches in results.items() if not matches]
+    }
+
+@router.get("/trending", response_model=List[SimilarProduct])
+def get_trending_products(
+    mode: str = Query("trending", pattern="^(trending|popular)$"),
+    category_id: int = Query(ALL_CATEGORIES, ge=0),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """
+    Trending (recently decayed) or popular products, optionally within a category
+    """
+    ranking = trending_tracker.top(mode, category_id, limit * 2)  # Spare rows for disabled products
+    summaries = _product_summaries(db, [product_id for product_id, _ in ranking])
+    
+    result = []
+    for product_id, score in ranking:
+        summary = summaries.get(product_id)
+        if summary and summary["status"]:
+            result.append({**summary, "score": score, "source": mode})
+    
+    return result[:limit]
+
 @router.get("/{product_id}", response_model=ProductDetail)
 def get_product(product_id: int, db: Session = Depends(get_db)):
     """
@@ -94,6 +230,56 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
     
     return product
 
+@router.get("/{product_id}/similar", response_model=List[SimilarProduct])
+def get_similar_products(
+    product_id: int,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """
+    Products with similar names, tags, descriptions and categories.
+    Falls back to the curated related products when no similarity data exists.
+    """
+    neighbors = similar_products.get(product_id, limit * 2)  # Spare rows for disabled products
+    source = "similarity"
+    if not neighbors:
+        related = db.query(ProductRelated.related_id).filter(
+            ProductRelated.product_id == product_id
+        ).all()
+        neighbors = [(related_id, None) for related_id, in related]
+        source = "related"
+    
+    summaries = _product_summaries(db, [neighbor_id for neighbor_id, _ in neighbors])
+    
+    result = []
+    for neighbor_id, score in neighbors:
+        summary = summaries.get(neighbor_id)
+        if summary and summary["status"]:
+            result.append({**summary, "score": score, "source": source})
+    
+    return result[:limit]
+
+@router.get("/{product_id}/recommendations", response_model=List[SimilarProduct])
+def get_product_recommendations(
+    product_id: int,
+    kind: str = Query("co_view", pattern="^(co_view|co_purchase)$"),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """
+    Customers who viewed (co_view) or bought (co_purchase) this product also viewed or bought
+    """
+    recommendations = recommendation_store.get(kind, product_id, limit * 2)  # Spare rows for disabled products
+    summaries = _product_summaries(db, [related_id for related_id, _ in recommendations])
+    
+    result = []
+    for related_id, score in recommendations:
+        summary = summaries.get(related_id)
+        if summary and summary["status"]:
+            result.append({**summary, "score": score, "source": kind})
+    
+    return result[:limit]
+
 @router.post("/", response_model=ProductDetail, status_code=201)
 def create_product(
     product_data: ProductCreate, 
@@ -181,6 +367,9 @@ def create_product(
     db.commit()
     db.refresh(new_product)
     
+    product_identifier_index.refresh_product(db, new_product.product_id)
+    catalog_changed()
+    
     return new_product
 
 @router.put("/{product_id}", response_model=ProductDetail)
@@ -236,6 +425,9 @@ def update_product(
     db.commit()
     db.refresh(product)
     
+    product_identifier_index.refresh_product(db, product_id)
+    catalog_changed()
+    
     return product
 
 @router.delete("/{product_id}", status_code=204)
@@ -261,4 +453,7 @@ def delete_product(
     db.delete(product)
     db.commit()
     
+    product_identifier_index.remove_product(product_id)
+    catalog_changed()
+    
     return None
\ No newline at end of file
@@ -8,6 +8,7 @@ from app.database import get_db
 from app.models.product import ProductDescription, Product
 from app.schemas.product import ProductDescriptionBase
 from app.utils.auth import get_current_admin  # Add this import
+from app.utils.catalog import catalog_changed
 
 router = APIRouter(
     prefix="/product-descriptions",
@@ -117,6 +118,8 @@ def create_product_description(
     db.commit()
     db.refresh(db_product_description)
     
+    catalog_changed()
+    
     return db_product_description
 
 @router.put("/{product_id}/{language_id}", response_model=ProductDescriptionBase)
@@ -149,6 +152,8 @@ def update_product_description(
     db.commit()
     db.refresh(db_product_description)
     
+    catalog_changed()
+    
     return db_product_description
 
 @router.delete("/{product_id}/{language_id}", status_code=204)
@@ -172,4 +177,6 @@ def delete_product_description(
     db.delete(db_product_description)
     db.commit()
     
+    catalog_changed()
+    
     return None
\ No newline at end of file
@@ -0,0 +1,50 @@
+from typing import Any, Dict
+from fastapi import APIRouter, Depends, Query
+
+from app.schemas.search import SearchSuggestResponse, SpellingCorrection
+from app.utils.auth import get_current_admin
+from app.utils.fuzzy_search import spelling_index
+from app.utils.search_suggest import MAX_SUGGESTIONS, suggestion_index
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"],
+)
+
+@router.get("/suggest", response_model=SearchSuggestResponse)
+def suggest(
+    q: str = Query(..., max_length=100),
+    limit: int = Query(MAX_SUGGESTIONS, ge=1, le=MAX_SUGGESTIONS)
+):
+    """
+    Type-ahead suggestions from product names and popular searches
+    """
+    return {
+        "query": q,
+        "suggestions": suggestion_index.suggest(q, limit)
+    }
+
+@router.get("/did-you-mean", response_model=SpellingCorrection)
+def did_you_mean(q: str = Query(..., max_length=255)):
+    """
+    Spelling correction for a search phrase, null when it looks correct
+    """
+    return {
+        "query": q,
+        "suggestion": spelling_index.correct(q)
+    }
+
+@router.get("/stats", response_model=Dict[str, Any])
+def get_search_index_stats(current_admin = Depends(get_current_admin)):
+    """
+    Size and build time of the in-memory search indexes (admin only)
+    """
+    return {
+        "suggest": {
+            "built_at": suggestion_index.built_at
+        },
+        "spelling": {
+            **spelling_index.index.stats(),
+            "built_at": spelling_index.built_at
+        }
+    }
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException, Request, status
+
+from app.utils.beacons import MAX_BATCH_BYTES, enqueue, parse_beacon, tracking_events
+from app.utils.bot_filter import is_bot_request
+
+router = APIRouter(
+    prefix="/track",
+    tags=["tracking"],
+)
+
+async def read_limited_body(request: Request, limit: int) -> bytes:
+    """Request body, rejected with 413 as soon as it is known to exceed `limit` bytes"""
+    too_large = HTTPException(status_code=413, detail=f"Batch larger than {limit} bytes")
+    try:
+        declared = int(request.headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if declared > limit:
+        raise too_large
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
+
+@router.post("/batch", status_code=status.HTTP_202_ACCEPTED)
+async def track_batch(request: Request):
+    """
+    Batched engagement events sent with navigator.sendBeacon: page
+    visibility, dwell time, scroll depth and product impressions. The body
+    is read raw because sendBeacon posts JSON as text/plain. Events are
+    queued and written in bulk, not per request.
+    """
+    if request.state.session.is_new:
+        raise HTTPException(status_code=400, detail="Missing session cookie")
+    session_id = request.state.session.session_id
+    body = await read_limited_body(request, MAX_BATCH_BYTES)
+    try:
+        events, rejected = parse_beacon(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {e}")
+
+    user_agent = request.headers.get("user-agent", "")
+    if is_bot_request(request):
+        return {"accepted": 0, "rejected": len(events) + rejected}
+    enqueue(tracking_events(events, session_id, request.client.host, user_agent))
+    return {"accepted": len(events), "rejected": rejected}
@@ -1,6 +1,6 @@
 from datetime import datetime
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
 
 # Schemas for request/response
 class ProductOptionValueBase(BaseModel):
@@ -154,9 +154,30 @@ class ProductDetail(BaseModel):
     date_modified: datetime
     descriptions: List[ProductDescriptionBase]
     images: List[ProductImageBase]
-    options: List[ProductOptionBase]
+    # The model calls the relationship product_options
+    options: List[ProductOptionBase] = Field(validation_alias="product_options")
     attributes: List[ProductAttributeBase]
     specifications: List[ProductSpecificationBase]
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Product identifier lookup models
+class ProductLookupMatch(ProductInList):
+    matched_field: str
+
+class ProductLookupResult(BaseModel):
+    code: str
+    matches: List[ProductLookupMatch]
+
+class ProductLookupBatchRequest(BaseModel):
+    codes: List[str] = Field(..., min_length=1, max_length=1000)
+    field: Optional[str] = None
+
+class ProductLookupBatchResult(BaseModel):
+    results: Dict[str, List[ProductLookupMatch]]
+    not_found: List[str]
+
+class SimilarProduct(ProductInList):
+    score: Optional[float] = None
+    source: str  # similarity, related, co_view, co_purchase, trending or popular
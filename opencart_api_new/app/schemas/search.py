@@ -0,0 +1,16 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+class SearchSuggestion(BaseModel):
+    text: str
+    type: str  # product or query
+    product_id: Optional[int] = None
+    score: int
+
+class SearchSuggestResponse(BaseModel):
+    query: str
+    suggestions: List[SearchSuggestion]
+
+class SpellingCorrection(BaseModel):
+    query: str
+    suggestion: Optional[str] = None
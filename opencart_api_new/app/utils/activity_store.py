@@ -0,0 +1,353 @@
+import argparse
+import hashlib
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import bindparam, desc, func, insert, text
+from sqlalchemy.orm import Session
+from user_agents import parse
+
+from app.database import Base, SessionLocal, engine
+from app.models.analytics import (
+    ActivityEvent, GeoDimension, RefererDimension, SessionKey, SpoolOffset, UrlDimension, UserActivity,
+    UserAgentDimension
+)
+
+# Small integer codes stored in api_activity_event, never renumber
+EVENT_TYPES = {
+    "other": 0,
+    "pageview": 1,
+    "search": 2,
+    "product_view": 3,
+    "add_to_cart": 4,
+    "remove_from_cart": 5,
+    "update_cart": 6,
+    # Client-side engagement beacons, see app/utils/beacons.py
+    "page_visible": 7,
+    "page_hidden": 8,
+    "dwell": 9,
+    "scroll_depth": 10,
+    "product_impression": 11,
+}
+EVENT_TYPE_NAMES = {code: name for name, code in EVENT_TYPES.items()}
+
+USER_TYPES = {"guest": 0, "customer": 1, "admin": 2}
+USER_TYPE_NAMES = {code: name for name, code in USER_TYPES.items()}
+
+# Dimension ids cached per worker and dimension
+DIMENSION_CACHE_SIZE = 50000
+
+BACKFILL_PROGRESS = "backfill:api_user_activity"
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def md5(value: str) -> bytes:
+    return hashlib.md5(value.encode("utf-8", "surrogatepass")).digest()
+
+
+def pack_ip(ip: Optional[str]) -> Optional[bytes]:
+    try:
+        return ipaddress.ip_address(ip).packed
+    except ValueError:
+        return None
+
+
+def unpack_ip(packed: Optional[bytes]) -> Optional[str]:
+    return str(ipaddress.ip_address(packed)) if packed else None
+
+
+def page_title(url: str) -> str:
+    return urlparse(url).path.rstrip("/").split("/")[-1] or "Home"
+
+
+def describe_user_agent(user_agent: str) -> Dict:
+    try:
+        parsed = parse(user_agent)
+    except Exception:
+        return {"device_type": None, "browser": None, "os": None}
+    device_type = "desktop"
+    if parsed.is_mobile:
+        device_type = "mobile"
+    elif parsed.is_tablet:
+        device_type = "tablet"
+    return {
+        "device_type": device_type,
+        "browser": f"{parsed.browser.family} {parsed.browser.version_string}".strip()[:50],
+        "os": f"{parsed.os.family} {parsed.os.version_string}".strip()[:50],
+    }
+
+
+class Dimension:
+    """
+    Get-or-create integer ids for the values of a dimension table.
+
+    Known values come from a per-worker LRU cache. Misses are inserted with
+    INSERT IGNORE and read back in one query, on a separate connection that
+    commits immediately, so a cached id always refers to a durable row even
+    if the caller's transaction is rolled back.
+    """
+
+    def __init__(self, model, id_column, key_column, row: Callable[[object], Dict], capacity: int = DIMENSION_CACHE_SIZE):
+        self.model = model
+        self.id_column = id_column
+        self.key_column = key_column
+        self.row = row
+        self.capacity = capacity
+        self._cache: "OrderedDict[object, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ids(self, values: Iterable) -> Dict[object, int]:
+        result = {}
+        missing = []
+        with self._lock:
+            for value in set(values):
+                if value is None:
+                    continue
+                cached = self._cache.get(value)
+                if cached is None:
+                    missing.append(value)
+                else:
+                    self._cache.move_to_end(value)
+                    result[value] = cached
+        if not missing:
+            return result
+
+        rows = {value: self.row(value) for value in missing}
+        keys = {row[self.key_column.key]: value for value, row in rows.items()}
+        db = SessionLocal()
+        try:
+            db.execute(insert(self.model).prefix_with("IGNORE"), list(rows.values()))
+            found = db.query(self.id_column, self.key_column).filter(self.key_column.in_(list(keys))).all()
+            db.commit()
+        finally:
+            db.close()
+
+        with self._lock:
+            for row_id, key in found:
+                value = keys[key]
+                result[value] = row_id
+                self._cache[value] = row_id
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return result
+
+
+session_keys = Dimension(
+    SessionKey, SessionKey.session_key, SessionKey.session_id,
+    lambda session_id: {"session_id": session_id}
+)
+urls = Dimension(
+    UrlDimension, UrlDimension.url_id, UrlDimension.url_hash,
+    lambda url: {"url_hash": md5(url), "url": url, "page_title": page_title(url)[:255]}
+)
+referers = Dimension(
+    RefererDimension, RefererDimension.referer_id, RefererDimension.referer_hash,
+    lambda referer: {"referer_hash": md5(referer), "referer": referer}
+)
+user_agents = Dimension(
+    UserAgentDimension, UserAgentDimension.user_agent_id, UserAgentDimension.user_agent_hash,
+    lambda user_agent: {"user_agent_hash": md5(user_agent), "user_agent": user_agent, **describe_user_agent(user_agent)}
+)
+geos = Dimension(
+    GeoDimension, GeoDimension.geo_id, GeoDimension.geo_hash,
+    lambda geo: {"geo_hash": md5("\x1f".join(part or "" for part in geo)),
+                 "country": geo[0], "region": geo[1], "city": geo[2]}
+)
+
+
+def _geo(event: dict):
+    geo = (event.get("country"), event.get("region"), event.get("city"))
+    return geo if any(geo) else None
+
+
+def event_rows(events: List[dict]) -> List[Dict]:
+    """api_activity_event rows for tracking events, resolving every dimension in bulk"""
+    session_ids = session_keys.ids(event["session_id"] for event in events)
+    url_ids = urls.ids(event.get("url") or "" for event in events)
+    referer_ids = referers.ids(event.get("referer") or None for event in events)
+    user_agent_ids = user_agents.ids(event.get("user_agent") or None for event in events)
+    geo_ids = geos.ids(_geo(event) for event in events)
+
+    rows = []
+    for event in events:
+        rows.append({
+            "date_added": datetime.utcfromtimestamp(event["ts"]),
+            "session_key": session_ids[event["session_id"]],
+            "customer_id": event.get("customer_id") or None,
+            "user_type": USER_TYPES.get(event.get("user_type"), 0),
+            "event_type": EVENT_TYPES.get(event.get("event_type"), 0),
+            "ip_address": pack_ip(event.get("ip_address")),
+            "url_id": url_ids[event.get("url") or ""],
+            "referer_id": referer_ids.get(event.get("referer") or None),
+            "user_agent_id": user_agent_ids.get(event.get("user_agent") or None),
+            "geo_id": geo_ids.get(_geo(event)),
+            "time_spent": event.get("time_spent"),
+            "event_data": event.get("event_data"),
+            "sample_weight": event.get("sample_weight", 1.0),
+        })
+    return rows
+
+
+def record_events(db: Session, events: List[dict]):
+    """Insert tracking events with one executemany, does not commit. Events sampled out (weight 0) are skipped."""
+    events = [event for event in events if event.get("sample_weight", 1.0)]
+    if events:
+        db.execute(insert(ActivityEvent), event_rows(events))
+
+
+def legacy_event(activity: UserActivity) -> dict:
+    """Tracking event equivalent of an api_user_activity row"""
+    return {
+        "ts": (activity.date_added - EPOCH).total_seconds(),
+        "session_id": activity.session_id,
+        "customer_id": activity.customer_id,
+        "user_type": activity.user_type,
+        "ip_address": activity.ip_address,
+        "user_agent": activity.user_agent,
+        "url": activity.url,
+        "referer": activity.referer,
+        "time_spent": activity.time_spent,
+        "event_type": activity.event_type,
+        "event_data": activity.event_data,
+        "country": activity.country,
+        "region": activity.region,
+        "city": activity.city,
+    }
+
+
+def backfill(chunk_size: int) -> int:
+    """Copy api_user_activity into the compact table, resumable after a stop"""
+    copied = 0
+    db = SessionLocal()
+    try:
+        while True:
+            progress = db.query(SpoolOffset).filter(SpoolOffset.segment == BACKFILL_PROGRESS).with_for_update().first()
+            if progress is None:
+                progress = SpoolOffset(segment=BACKFILL_PROGRESS, offset=0)
+                db.add(progress)
+            activities = db.query(UserActivity).filter(
+                UserActivity.activity_id > progress.offset
+            ).order_by(UserActivity.activity_id).limit(chunk_size).all()
+            if not activities:
+                db.commit()
+                return copied
+            record_events(db, [legacy_event(activity) for activity in activities])
+            # Advanced in the same transaction as the copy
+            progress.offset = activities[-1].activity_id
+            progress.date_modified = datetime.utcnow()
+            db.commit()
+            copied += len(activities)
+            print(f"Copied {copied} rows, up to activity_id {progress.offset}")
+    finally:
+        db.close()
+
+
+def add_missing_columns(model, names: List[str]):
+    """ALTER TABLE ... ADD COLUMN for columns added to a model after its table was created"""
+    table = model.__table__
+    with engine.begin() as connection:
+        existing = {name for (name,) in connection.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = :table"
+        ), {"table": table.name})}
+        for name in names:
+            if name in existing:
+                continue
+            column = table.c[name]
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+            connection.execute(text(
+                f"ALTER TABLE `{table.name}` ADD COLUMN `{name}` "
+                f"{column.type.compile(dialect=engine.dialect)}{'' if column.nullable else ' NOT NULL'}{default}"
+            ))
+            print(f"Added {table.name}.{name}")
+
+
+def table_sizes(db: Session, tables: List[str]) -> Dict[str, tuple]:
+    """(approximate rows, data bytes, index bytes) per table from information_schema"""
+    rows = db.execute(text(
+        "SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name IN :tables"
+    ).bindparams(bindparam("tables", expanding=True)), {"tables": tables})
+    return {name: (table_rows, data_length, index_length) for name, table_rows, data_length, index_length in rows}
+
+
+def popular_pages_legacy(db: Session, cutoff: datetime, limit: int):
+    return db.query(
+        UserActivity.url, UserActivity.page_title, func.count(UserActivity.activity_id).label("view_count")
+    ).filter(
+        UserActivity.date_added >= cutoff,
+        UserActivity.event_type == "pageview"
+    ).group_by(UserActivity.url, UserActivity.page_title).order_by(desc("view_count")).limit(limit).all()
+
+
+def popular_pages(db: Session, cutoff: datetime, limit: int):
+    """(url, page_title, views) of the most viewed pages since cutoff"""
+    top = db.query(
+        ActivityEvent.url_id, func.sum(ActivityEvent.sample_weight).label("view_count")
+    ).filter(
+        ActivityEvent.event_type == EVENT_TYPES["pageview"],
+        ActivityEvent.date_added >= cutoff
+    ).group_by(ActivityEvent.url_id).order_by(desc("view_count")).limit(limit).subquery()
+    return db.query(UrlDimension.url, UrlDimension.page_title, top.c.view_count).join(
+        top, top.c.url_id == UrlDimension.url_id
+    ).order_by(desc(top.c.view_count)).all()
+
+
+def compare(days: int, repeat: int):
+    db = SessionLocal()
+    try:
+        legacy_tables = [UserActivity.__tablename__]
+        compact_tables = [model.__tablename__ for model in (
+            ActivityEvent, SessionKey, UrlDimension, RefererDimension, UserAgentDimension, GeoDimension
+        )]
+        sizes = table_sizes(db, legacy_tables + compact_tables)
+        for label, tables in (("legacy", legacy_tables), ("compact", compact_tables)):
+            rows = sizes.get(tables[0], (0, 0, 0))[0] or 0  # Fact table only
+            data = sum(sizes.get(table, (0, 0, 0))[1] or 0 for table in tables)
+            index = sum(sizes.get(table, (0, 0, 0))[2] or 0 for table in tables)
+            per_row = (data + index) / rows if rows else 0
+            print(f"{label}: ~{rows} rows, data {data / 1048576:.1f} MiB, indexes {index / 1048576:.1f} MiB, "
+                  f"{per_row:.0f} bytes/row")
+
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        for label, query in (("legacy", popular_pages_legacy), ("compact", popular_pages)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                query(db, cutoff, 10)
+                timings.append(time.perf_counter() - started)
+            print(f"{label} popular pages over {days} days: best {min(timings) * 1000:.1f}ms, "
+                  f"median {sorted(timings)[len(timings) // 2] * 1000:.1f}ms")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact activity event schema tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create the compact event and dimension tables")
+    backfill_parser = subparsers.add_parser("backfill", help="copy api_user_activity into api_activity_event")
+    backfill_parser.add_argument("--chunk-size", type=int, default=5000)
+    compare_parser = subparsers.add_parser("compare", help="compare table sizes and popular pages latency")
+    compare_parser.add_argument("--days", type=int, default=7)
+    compare_parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        Base.metadata.create_all(engine, tables=[model.__table__ for model in (
+            ActivityEvent, SessionKey, UrlDimension, RefererDimension, UserAgentDimension, GeoDimension, SpoolOffset
+        )])
+        add_missing_columns(ActivityEvent, ["sample_weight"])
+        print("Created compact activity tables")
+    elif args.command == "backfill":
+        started = time.perf_counter()
+        count = backfill(args.chunk_size)
+        print(f"Backfilled {count} rows in {time.perf_counter() - started:.1f}s")
+    else:
+        compare(args.days, args.repeat)
@@ -0,0 +1,236 @@
+import argparse
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import Base, SessionLocal, engine
+from app.models.analytics import AttributionDaily, SessionTracking, SpoolOffset
+from app.models.order import Order
+from app.utils.background import PeriodicJob
+
+MODELS = ("first_touch", "last_touch")
+DIMENSIONS = ("source", "medium", "campaign")
+
+# Sessions started this long before an order can be credited with it
+LOOKBACK = timedelta(days=30)
+
+# api_spool_offset row holding the ordinal of the last aggregated day
+WATERMARK = "attribution:daily"
+
+DIRECT = ("(direct)", "(none)", "")
+# Guest orders carry no customer id to find their sessions by
+UNATTRIBUTED = ("(unattributed)", "(none)", "")
+
+Channel = Tuple[str, str, str]
+
+
+def fold(value: Optional[str]) -> str:
+    """
+    Tag as MySQL's case and accent insensitive collation compares it, so
+    variants like "Google" and "google " land in one aggregate row instead
+    of colliding on the primary key
+    """
+    value = unicodedata.normalize("NFKD", (value or "").strip().lower())
+    return "".join(char for char in value if not unicodedata.combining(char))[:100].rstrip()
+
+
+def channel(utm_source: Optional[str], utm_medium: Optional[str], utm_campaign: Optional[str],
+            referring_site: Optional[str]) -> Channel:
+    """(source, medium, campaign) of a session: its UTM tags, else the referring host, else direct"""
+    source = fold(utm_source)
+    if source:
+        return source, fold(utm_medium) or "(none)", fold(utm_campaign)
+    referrer = fold(referring_site)
+    if referrer:
+        return referrer, "referral", ""
+    return DIRECT
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+def day_rows(db: Session, day: date) -> Dict[Tuple[str, str, str, str], Dict]:
+    """Aggregate rows of one day from raw sessions and orders, keyed by (model, source, medium, campaign)"""
+    start, end = day_bounds(day)
+    rows = defaultdict(lambda: {"sessions": 0, "orders": 0, "revenue": 0.0})
+
+    sessions = db.query(
+        SessionTracking.utm_source, SessionTracking.utm_medium, SessionTracking.utm_campaign,
+        SessionTracking.referring_site, func.count(SessionTracking.session_id)
+    ).filter(
+        SessionTracking.first_visit >= start,
+        SessionTracking.first_visit < end
+    ).group_by(
+        SessionTracking.utm_source, SessionTracking.utm_medium, SessionTracking.utm_campaign,
+        SessionTracking.referring_site
+    )
+    for utm_source, utm_medium, utm_campaign, referring_site, count in sessions:
+        for model in MODELS:
+            rows[(model, *channel(utm_source, utm_medium, utm_campaign, referring_site))]["sessions"] += count
+
+    orders = db.query(Order.customer_id, Order.date_added, Order.total).filter(
+        Order.date_added >= start,
+        Order.date_added < end,
+        Order.order_status_id > 0  # 0 is an abandoned checkout
+    ).all()
+    customer_ids = {customer_id for customer_id, _, _ in orders if customer_id}
+    touches: Dict[int, List[Tuple[datetime, Channel]]] = defaultdict(list)
+    if customer_ids:
+        candidates = db.query(
+            SessionTracking.customer_id, SessionTracking.first_visit, SessionTracking.utm_source,
+            SessionTracking.utm_medium, SessionTracking.utm_campaign, SessionTracking.referring_site
+        ).filter(
+            SessionTracking.customer_id.in_(customer_ids),
+            SessionTracking.first_visit >= start - LOOKBACK,
+            SessionTracking.first_visit < end
+        ).order_by(SessionTracking.customer_id, SessionTracking.first_visit)
+        for customer_id, first_visit, *tags in candidates:
+            touches[customer_id].append((first_visit, channel(*tags)))
+
+    for customer_id, ordered_at, total in orders:
+        if not customer_id:
+            credited = {model: UNATTRIBUTED for model in MODELS}
+        else:
+            eligible = [touch for moment, touch in touches.get(customer_id, ())
+                        if ordered_at - LOOKBACK <= moment <= ordered_at]
+            credited = {"first_touch": eligible[0], "last_touch": eligible[-1]} if eligible else {
+                model: DIRECT for model in MODELS
+            }
+        for model, touch in credited.items():
+            row = rows[(model, *touch)]
+            row["orders"] += 1
+            row["revenue"] += float(total or 0)
+    return rows
+
+
+def write_day(db: Session, day: date, rows: Dict[Tuple[str, str, str, str], Dict]):
+    """
+    Insert a day's rows in one executemany. Tags fold() keeps apart but the
+    column collation equates are summed into one row instead of failing the
+    day on a duplicate key. Does not commit.
+    """
+    if not rows:
+        return
+    table = AttributionDaily.__table__
+    statement = insert(table)
+    statement = statement.on_duplicate_key_update([
+        ("sessions", table.c.sessions + statement.inserted.sessions),
+        ("orders", table.c.orders + statement.inserted.orders),
+        ("revenue", table.c.revenue + statement.inserted.revenue),
+    ])
+    db.execute(statement, [
+        {"day": day, "model": model, "source": source, "medium": medium, "campaign": campaign, **values}
+        for (model, source, medium, campaign), values in rows.items()
+    ])
+
+
+def aggregated_through(db: Session) -> Optional[date]:
+    state = db.query(SpoolOffset).filter(SpoolOffset.segment == WATERMARK).first()
+    return date.fromordinal(state.offset) if state and state.offset else None
+
+
+def aggregate_closed_days(max_days: Optional[int] = None) -> int:
+    """
+    Write aggregate rows for every closed (UTC) day after the watermark,
+    one transaction per day. The watermark row is locked, so workers
+    running the job at the same time take turns.
+    """
+    db = SessionLocal()
+    done = 0
+    try:
+        last_closed = datetime.utcnow().date() - timedelta(days=1)
+        while max_days is None or done < max_days:
+            state = db.query(SpoolOffset).filter(SpoolOffset.segment == WATERMARK).with_for_update().first()
+            if state is None:
+                oldest = db.query(func.min(SessionTracking.first_visit)).scalar()
+                state = SpoolOffset(segment=WATERMARK, offset=(oldest.date().toordinal() - 1) if oldest else 0)
+                db.add(state)
+            if not state.offset:
+                state.offset = last_closed.toordinal()  # No sessions yet, start from today
+            day = date.fromordinal(state.offset + 1)
+            if day > last_closed:
+                db.commit()
+                return done
+            db.query(AttributionDaily).filter(AttributionDaily.day == day).delete()
+            write_day(db, day, day_rows(db, day))
+            state.offset = day.toordinal()
+            state.date_modified = datetime.utcnow()
+            db.commit()
+            done += 1
+        return done
+    finally:
+        db.close()
+
+
+def attribution_report(db: Session, start: date, end: date, model: str, dimensions: List[str]) -> Dict:
+    """
+    Sessions, orders and revenue per channel for days start..end. Closed
+    days are read from api_attribution_daily only; today is computed from
+    raw sessions. Closed days not aggregated yet are reported, not scanned.
+    """
+    through = aggregated_through(db)
+    today = datetime.utcnow().date()
+    totals = defaultdict(lambda: {"sessions": 0, "orders": 0, "revenue": 0.0})
+
+    if through is not None and start <= through:
+        columns = [getattr(AttributionDaily, name) for name in dimensions]
+        rows = db.query(
+            *columns, func.sum(AttributionDaily.sessions), func.sum(AttributionDaily.orders),
+            func.sum(AttributionDaily.revenue)
+        ).filter(
+            AttributionDaily.day >= start,
+            AttributionDaily.day <= min(end, through),
+            AttributionDaily.model == model
+        ).group_by(*columns)
+        for *key, sessions, orders, revenue in rows:
+            total = totals[tuple(key)]
+            total["sessions"] += int(sessions or 0)
+            total["orders"] += int(orders or 0)
+            total["revenue"] += float(revenue or 0)
+
+    if start <= today <= end:
+        positions = [DIMENSIONS.index(name) for name in dimensions]
+        for (row_model, *touch), values in day_rows(db, today).items():
+            if row_model != model:
+                continue
+            total = totals[tuple(touch[i] for i in positions)]
+            for name, value in values.items():
+                total[name] += value
+
+    first_pending = max(start, through + timedelta(days=1)) if through else start
+    pending_days = max(0, (min(end, today - timedelta(days=1)) - first_pending).days + 1)
+    return {"rows": totals, "pending_days": pending_days, "aggregated_through": through}
+
+
+attribution_job = PeriodicJob(
+    "attribution-daily",
+    aggregate_closed_days,
+    interval=settings.ATTRIBUTION_REFRESH,
+    run_on_start=True
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daily UTM / referrer attribution aggregate")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create api_attribution_daily")
+    aggregate_parser = subparsers.add_parser("aggregate", help="aggregate closed days after the watermark")
+    aggregate_parser.add_argument("--max-days", type=int)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        Base.metadata.create_all(engine, tables=[AttributionDaily.__table__, SpoolOffset.__table__])
+        print("Created attribution tables")
+    else:
+        started = time.perf_counter()
+        count = aggregate_closed_days(args.max_days)
+        print(f"Aggregated {count} days in {time.perf_counter() - started:.1f}s")
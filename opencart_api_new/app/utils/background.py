@@ -0,0 +1,50 @@
+import threading
+from typing import Callable, Optional
+
+
+class PeriodicJob:
+    """
+    Run a function on a daemon thread every `interval` seconds.
+
+    `trigger()` asks for an early run, e.g. after a catalog change. Several
+    triggers arriving while a run is in progress collapse into one follow-up
+    run. Exceptions are printed and the job keeps its schedule.
+    """
+
+    def __init__(self, name: str, func: Callable[[], None], interval: float, run_on_start: bool = True):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.run_on_start = run_on_start
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        if self.run_on_start:
+            self._wakeup.set()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def trigger(self):
+        self._wakeup.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            if self._stopped.is_set():
+                break
+            self._wakeup.clear()
+            try:
+                self.func()
+            except Exception as e:
+                print(f"Error running background job {self.name}: {e}")
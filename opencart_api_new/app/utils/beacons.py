@@ -0,0 +1,194 @@
+import argparse
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from app.config import settings
+from app.database import SessionLocal
+from app.utils.activity_store import record_events
+from app.utils.background import PeriodicJob
+from app.utils.event_spool import event_spool
+from app.utils.sampling import event_sampler
+
+# Largest accepted request body and number of events in one beacon
+MAX_BATCH_BYTES = 64 * 1024
+MAX_BATCH_EVENTS = 100
+
+MAX_URL_LENGTH = 2048
+MAX_DWELL_MS = 24 * 3600 * 1000
+MAX_IMPRESSIONS = 50
+
+# Client event type -> numeric fields accepted with it and their inclusive bounds
+CLIENT_EVENTS = {
+    "page_visible": {},
+    "page_hidden": {"dwell_ms": (0, MAX_DWELL_MS)},
+    "dwell": {"dwell_ms": (0, MAX_DWELL_MS)},
+    "scroll_depth": {"depth": (0, 100)},
+    "product_impression": {},
+}
+
+# Events held in memory between flushes when the spool is disabled, the
+# oldest are dropped beyond this
+MAX_BUFFERED_EVENTS = 50000
+
+
+def validate_event(raw) -> Dict:
+    """Event fields kept from one client event, raises ValueError when invalid"""
+    if not isinstance(raw, dict):
+        raise ValueError("event must be an object")
+    event_type = raw.get("type")
+    fields = CLIENT_EVENTS.get(event_type)
+    if fields is None:
+        raise ValueError("unknown event type")
+    url = raw.get("url")
+    if not isinstance(url, str) or len(url) > MAX_URL_LENGTH:
+        raise ValueError("url must be a string")
+
+    data = {}
+    for name, (low, high) in fields.items():
+        value = raw.get(name)
+        # bool is an int subclass, reject it explicitly
+        if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+            raise ValueError(f"{name} must be an integer between {low} and {high}")
+        data[name] = value
+    if event_type == "product_impression":
+        product_ids = raw.get("product_ids")
+        if (not isinstance(product_ids, list) or not 0 < len(product_ids) <= MAX_IMPRESSIONS
+                or not all(isinstance(p, int) and not isinstance(p, bool) and p > 0 for p in product_ids)):
+            raise ValueError(f"product_ids must list 1 to {MAX_IMPRESSIONS} product ids")
+        data["product_ids"] = product_ids
+    return {"event_type": event_type, "url": url, "data": data}
+
+
+def parse_beacon(body: bytes) -> Tuple[List[Dict], int]:
+    """
+    Valid events of a beacon body and the number rejected. The body is a
+    JSON array of events, or an object with an "events" array; sendBeacon
+    usually sends it as text/plain.
+    """
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("events")
+    if not isinstance(payload, list):
+        raise ValueError("expected an array of events")
+    if len(payload) > MAX_BATCH_EVENTS:
+        raise ValueError(f"at most {MAX_BATCH_EVENTS} events per batch")
+    events = []
+    rejected = 0
+    for raw in payload:
+        try:
+            events.append(validate_event(raw))
+        except ValueError:
+            rejected += 1
+    return events, rejected
+
+
+def tracking_events(events: List[Dict], session_id: str, ip_address: str, user_agent: str) -> List[Dict]:
+    """Tracking event records, in the format of the middleware, for validated beacon events"""
+    now = time.time()
+    return [{
+        "ts": now,
+        "session_id": session_id,
+        "ip_address": ip_address,
+        "user_agent": user_agent,
+        "url": event["url"],
+        "event_type": event["event_type"],
+        "time_spent": event["data"].get("dwell_ms"),
+        "event_data": json.dumps(event["data"], separators=(",", ":")) if event["data"] else None,
+        "sample_weight": event_sampler.weight(session_id, event["event_type"]),
+        "beacon": True,  # Not a page hit, the spool ingester leaves api_session alone
+    } for event in events]
+
+
+class EventBuffer:
+    """Events waiting for the next bulk insert, shared by all requests of a worker"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._events: List[Dict] = []
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, events: List[Dict]):
+        with self._lock:
+            self._events.extend(events)
+            overflow = len(self._events) - self.capacity
+            if overflow > 0:
+                del self._events[:overflow]
+                self.dropped += overflow
+
+    def flush(self) -> int:
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+        db = SessionLocal()
+        try:
+            record_events(db, events)
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.add(events)  # Retried on the next flush
+            raise
+        finally:
+            db.close()
+        return len(events)
+
+
+beacon_buffer = EventBuffer(MAX_BUFFERED_EVENTS)
+
+beacon_flush_job = PeriodicJob(
+    "beacon-flush",
+    beacon_buffer.flush,
+    interval=settings.BEACON_FLUSH,
+    run_on_start=False
+)
+
+
+def enqueue(events: List[Dict]):
+    """Hand events to the spool when enabled, otherwise to the in-memory buffer"""
+    # Beacons never touch api_session, sampled out events are dropped here
+    events = [event for event in events if event["sample_weight"]]
+    if settings.EVENT_SPOOL:
+        for event in events:
+            event_spool.append(event)
+    else:
+        beacon_buffer.add(events)
+
+
+def sample_beacon(rng: random.Random, size: int) -> bytes:
+    events = []
+    for _ in range(size):
+        event_type = rng.choice(list(CLIENT_EVENTS))
+        event = {"type": event_type, "url": f"https://shop.example.com/product/{rng.randint(1, 5000)}"}
+        if "dwell_ms" in CLIENT_EVENTS[event_type]:
+            event["dwell_ms"] = rng.randint(0, 600000)
+        if event_type == "scroll_depth":
+            event["depth"] = rng.randint(0, 100)
+        if event_type == "product_impression":
+            event["product_ids"] = [rng.randint(1, 5000) for _ in range(rng.randint(1, 12))]
+        events.append(event)
+    return json.dumps(events).encode()
+
+
+if __name__ == "__main__":
+    # Parse, validate and enqueue throughput of one worker, without the database
+    parser = argparse.ArgumentParser(description="Benchmark beacon ingestion")
+    parser.add_argument("--batches", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=20, help="events per beacon")
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    bodies = [sample_beacon(rng, args.batch_size) for _ in range(200)]
+    buffer = EventBuffer(capacity=args.batches * args.batch_size)
+    started = time.perf_counter()
+    accepted = 0
+    for i in range(args.batches):
+        events, _ = parse_beacon(bodies[i % len(bodies)])
+        buffer.add(tracking_events(events, "benchmark", "127.0.0.1", "benchmark"))
+        accepted += len(events)
+    elapsed = time.perf_counter() - started
+    print(f"{accepted} events in {args.batches} beacons: {accepted / elapsed:,.0f} events/s, "
+          f"{elapsed / args.batches * 1e6:.0f}us per beacon")
@@ -0,0 +1,165 @@
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.cart import Cart
+from app.models.enhanced_cart import CartHistory, EnhancedCart
+from app.utils.background import PeriodicJob
+
+
+def guest_tables() -> Dict[str, Dict]:
+    """
+    Guest cart tables: primary key, guest row condition, last change column
+    and the clock that column is written with. OpenCart fills oc_cart with
+    local NOW(), the API writes api_cart in UTC.
+    """
+    return {
+        "oc_cart": {
+            "model": Cart,
+            "pk": Cart.cart_id,
+            "guest": Cart.customer_id == 0,
+            "session": Cart.session_id,
+            "changed": Cart.date_added,
+            "now": datetime.now,
+        },
+        "api_cart": {
+            "model": EnhancedCart,
+            "pk": EnhancedCart.cart_id,
+            "guest": EnhancedCart.customer_id.is_(None),
+            "session": EnhancedCart.session_id,
+            "changed": EnhancedCart.last_updated,
+            "now": datetime.utcnow,
+        },
+    }
+
+
+class GuestCartCollector:
+    """
+    Deletes guest carts untouched for `retention_days`.
+
+    Candidates are read in primary key order, `chunk_size` rows at a time,
+    and deleted by primary key together with their api_cart_history rows,
+    one transaction per chunk with `pause` seconds in between. A cart is
+    only deleted whole: rows of a session that still has a recent row are
+    kept.
+    """
+
+    def __init__(self, retention_days: int, chunk_size: int, pause: float, max_rows: int):
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.started_at = datetime.utcnow()
+        self.reclaimed: Dict[str, int] = {"oc_cart": 0, "api_cart": 0, "api_cart_history": 0}
+        self.runs = 0
+        self.last_run: Optional[Dict] = None
+
+    def _collect_table(self, db: Session, name: str, table: Dict, dry_run: bool, budget: int) -> Dict[str, int]:
+        pk, session = table["pk"], table["session"]
+        cutoff = table["now"]() - timedelta(days=self.retention_days)
+        counts = {"rows": 0, "history_rows": 0}
+        expired_sessions = set()
+        last_id = 0
+        while counts["rows"] < budget:
+            candidates = db.query(pk, session).filter(
+                pk > last_id, table["guest"], table["changed"] < cutoff
+            ).order_by(pk).limit(self.chunk_size).all()
+            if not candidates:
+                break
+            last_id = candidates[-1][0]
+            sessions = {session_id for _, session_id in candidates}
+            active = {session_id for (session_id,) in db.query(session).filter(
+                session.in_(sessions), table["changed"] >= cutoff
+            ).distinct()}
+            ids = [row_id for row_id, session_id in candidates if session_id not in active][:budget - counts["rows"]]
+            expired_sessions |= sessions - active
+            if not ids:
+                continue
+            if name == "api_cart":
+                if dry_run:
+                    counts["history_rows"] += db.query(func.count(CartHistory.history_id)).filter(
+                        CartHistory.cart_id.in_(ids)
+                    ).scalar() or 0
+                else:
+                    counts["history_rows"] += db.execute(
+                        delete(CartHistory.__table__).where(CartHistory.__table__.c.cart_id.in_(ids))
+                    ).rowcount
+            if not dry_run:
+                rows = table["model"].__table__
+                db.execute(delete(rows).where(rows.c[pk.key].in_(ids)))
+                db.commit()
+                time.sleep(self.pause)
+            counts["rows"] += len(ids)
+        db.commit()
+        counts["sessions"] = len(expired_sessions)
+        return counts
+
+    def run(self, dry_run: bool = False) -> Dict:
+        """Collect both tables, at most `max_rows` rows each. A dry run only counts."""
+        started = time.perf_counter()
+        db = SessionLocal()
+        result = {}
+        try:
+            for name, table in guest_tables().items():
+                result[name] = self._collect_table(db, name, table, dry_run, self.max_rows)
+        finally:
+            db.close()
+        result["dry_run"] = dry_run
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        if not dry_run:
+            with self._lock:
+                self.runs += 1
+                self.last_run = {"finished_at": datetime.utcnow(), **result}
+                self.reclaimed["oc_cart"] += result["oc_cart"]["rows"]
+                self.reclaimed["api_cart"] += result["api_cart"]["rows"]
+                self.reclaimed["api_cart_history"] += result["api_cart"]["history_rows"]
+        return result
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "since": self.started_at,
+                "retention_days": self.retention_days,
+                "runs": self.runs,
+                "rows_reclaimed": dict(self.reclaimed),
+                "last_run": self.last_run,
+            }
+
+
+guest_cart_collector = GuestCartCollector(
+    settings.GUEST_CART_RETENTION_DAYS,
+    settings.GUEST_CART_GC_CHUNK,
+    settings.GUEST_CART_GC_PAUSE,
+    settings.GUEST_CART_GC_MAX_ROWS
+)
+
+guest_cart_gc_job = PeriodicJob(
+    "guest-cart-gc",
+    guest_cart_collector.run,
+    interval=settings.GUEST_CART_GC_INTERVAL,
+    run_on_start=False
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Delete expired guest carts")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be deleted")
+    parser.add_argument("--retention-days", type=int, default=settings.GUEST_CART_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    guest_cart_collector.retention_days = args.retention_days
+    result = guest_cart_collector.run(dry_run=args.dry_run)
+    verb = "Would delete" if args.dry_run else "Deleted"
+    for name in ("oc_cart", "api_cart"):
+        counts = result[name]
+        print(f"{verb} {counts['rows']} {name} rows of {counts['sessions']} sessions"
+              + (f" and {counts['history_rows']} api_cart_history rows" if name == "api_cart" else ""))
+    print(f"in {result['seconds']}s")
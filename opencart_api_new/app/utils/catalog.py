@@ -0,0 +1,8 @@
+from app.utils.fuzzy_search import spelling_index_job
+from app.utils.search_suggest import suggestion_index_job
+
+
+def catalog_changed():
+    """Schedule a rebuild of the in-memory search indexes after a catalog write"""
+    suggestion_index_job.trigger()
+    spelling_index_job.trigger()
@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import os
+import shutil
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.analytics import ActivityEvent, ProductView, SearchQuery, SessionTracking
+
+# Column kinds: "time" -> int64 epoch seconds, "hash" -> uint64 of a string
+# key (distinct counts), "category" -> int32 codes plus a per-day array of
+# values, anything else is a NumPy integer dtype with NULL stored as 0
+TABLES = {
+    "activity": (ActivityEvent, ActivityEvent.date_added, [
+        ("date_added", "time"), ("session_key", "int32"), ("customer_id", "int32"), ("user_type", "int8"),
+        ("event_type", "int16"), ("url_id", "int32"), ("user_agent_id", "int32"), ("geo_id", "int32"),
+        ("time_spent", "int32"), ("sample_weight", "float32"),
+    ]),
+    # Sessions are filed under the day of their first visit
+    "session": (SessionTracking, SessionTracking.first_visit, [
+        ("session_id", "hash"), ("customer_id", "int32"), ("first_visit", "time"), ("last_activity", "time"),
+        ("visit_count", "int32"), ("device_type", "category"), ("country", "category"),
+    ]),
+    "search": (SearchQuery, SearchQuery.date_added, [
+        ("date_added", "time"), ("session_id", "hash"), ("customer_id", "int32"), ("keyword", "category"),
+        ("results_count", "int32"),
+    ]),
+    "product_view": (ProductView, ProductView.date_added, [
+        ("date_added", "time"), ("session_id", "hash"), ("customer_id", "int32"), ("product_id", "int32"),
+    ]),
+}
+
+# Values of columns added after a day was exported
+MISSING_COLUMN_DEFAULTS = {("activity", "sample_weight"): 1.0}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Longest a session cookie lives, sessions that first visited this long
+# before a window can still be active in it
+SESSION_LIFETIME = timedelta(days=30)
+
+
+def string_hash(value: Optional[str]) -> int:
+    return int.from_bytes(hashlib.blake2b((value or "").encode(), digest_size=8).digest(), "little")
+
+
+def to_epoch(moment: datetime) -> int:
+    return int((moment - EPOCH).total_seconds())
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time())
+
+
+def encode_column(values: list, kind: str) -> Dict[str, np.ndarray]:
+    """Arrays written for one column, keyed by file suffix"""
+    if kind == "time":
+        return {"": np.array(values, dtype="datetime64[s]").astype(np.int64)}
+    if kind == "hash":
+        return {"": np.fromiter((string_hash(v) for v in values), dtype=np.uint64, count=len(values))}
+    if kind == "category":
+        uniques, codes = np.unique(np.array([v or "" for v in values], dtype=str), return_inverse=True)
+        return {"": codes.astype(np.int32), ".values": uniques}
+    return {"": np.array([v or 0 for v in values], dtype=kind)}
+
+
+def export_day(db: Session, table: str, day: date, root: str) -> int:
+    """Write one day of a table as one .npy file per column, replacing any earlier export"""
+    model, date_column, columns = TABLES[table]
+    rows = db.query(*[getattr(model, name) for name, _ in columns]).filter(
+        date_column >= day_start(day),
+        date_column < day_start(day + timedelta(days=1))
+    ).yield_per(20000)
+    values = [[] for _ in columns]
+    for row in rows:
+        for column_values, value in zip(values, row):
+            column_values.append(value)
+
+    directory = os.path.join(root, table, day.isoformat())
+    temp_directory = directory + ".tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    for (name, kind), column_values in zip(columns, values):
+        for suffix, array in encode_column(column_values, kind).items():
+            np.save(os.path.join(temp_directory, f"{name}{suffix}.npy"), array, allow_pickle=False)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    return len(values[0])
+
+
+def exportable_days(db: Session, table: str, root: str, since: Optional[date] = None) -> List[date]:
+    """
+    Closed days without an export. A day is exported once it is
+    COLUMNAR_EXPORT_DELAY_DAYS old, after which its sessions can no longer
+    change and none of its rows are still being written.
+    """
+    model, date_column, _ = TABLES[table]
+    last = datetime.utcnow().date() - timedelta(days=settings.COLUMNAR_EXPORT_DELAY_DAYS)
+    if since is None:
+        oldest = db.query(date_column).order_by(date_column).limit(1).scalar()
+        if oldest is None:
+            return []
+        since = oldest.date()
+    existing = set(archived_days(table, root))
+    days = []
+    day = since
+    while day <= last:
+        if day not in existing:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def archived_days(table: str, root: str) -> List[date]:
+    directory = os.path.join(root, table)
+    if not os.path.isdir(directory):
+        return []
+    days = []
+    for name in os.listdir(directory):
+        try:
+            days.append(date.fromisoformat(name))
+        except ValueError:
+            continue  # Unfinished .tmp export
+    return sorted(days)
+
+
+class ColumnarArchive:
+    """
+    Read side of the day-partitioned archive. Columns are memory-mapped, so
+    a scan only touches the files of the columns and days it needs.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _column(self, table: str, day: date, name: str, suffix: str = "", rows: int = 0) -> np.ndarray:
+        path = os.path.join(self.root, table, day.isoformat(), f"{name}{suffix}.npy")
+        if (table, name) in MISSING_COLUMN_DEFAULTS and not os.path.exists(path):
+            return np.full(rows, MISSING_COLUMN_DEFAULTS[(table, name)])
+        return np.load(path, mmap_mode="r")
+
+    def scan(self, table: str, start: datetime, end: datetime, columns: List[str],
+             time_column: str) -> Iterator[Dict[str, np.ndarray]]:
+        """Per archived day, the requested columns of rows with start <= time_column < end"""
+        available = set(archived_days(table, self.root))
+        kinds = dict((name, kind) for name, kind in TABLES[table][2])
+        day = start.date()
+        while day_start(day) < end:
+            if day in available:
+                times = self._column(table, day, time_column)
+                mask = (times >= to_epoch(start)) & (times < to_epoch(end))
+                if mask.any():
+                    data = {}
+                    for name in columns:
+                        data[name] = self._column(table, day, name, rows=len(times))[mask]
+                        if kinds[name] == "category":
+                            data[name] = self._column(table, day, name, ".values")[data[name]]
+                    yield data
+            day += timedelta(days=1)
+
+    def missing_days(self, table: str, start: datetime, end: datetime) -> int:
+        available = set(archived_days(table, self.root))
+        count = 0
+        day = start.date()
+        while day_start(day) < end:
+            count += day not in available
+            day += timedelta(days=1)
+        return count
+
+    def dashboard(self, start: datetime, end: datetime) -> Dict:
+        """Dashboard figures for [start, end) computed from archived days"""
+        # Weighted, each stored event stands for sample_weight events
+        event_counts = Counter()
+        for data in self.scan("activity", start, end, ["event_type", "sample_weight"], "date_added"):
+            codes, inverse = np.unique(data["event_type"], return_inverse=True)
+            counts = np.bincount(inverse, weights=data["sample_weight"], minlength=len(codes))
+            event_counts.update(dict(zip(codes.tolist(), counts.tolist())))
+
+        new_sessions = 0
+        customers: List[np.ndarray] = []
+        devices = Counter()
+        countries = Counter()
+        for data in self.scan("session", start, end,
+                              ["customer_id", "device_type", "country"], "first_visit"):
+            new_sessions += len(data["customer_id"])
+            customers.append(data["customer_id"][data["customer_id"] > 0])
+            devices.update(Counter(data["device_type"].tolist()))
+            countries.update(Counter(value for value in data["country"].tolist() if value))
+
+        # Sessions started before the window, still active in it
+        returning_sessions = 0
+        for data in self.scan("session", start - SESSION_LIFETIME, start, ["last_activity"], "first_visit"):
+            returning_sessions += int(np.count_nonzero(data["last_activity"] >= to_epoch(start)))
+
+        searches = sum(len(data["date_added"]) for data in self.scan("search", start, end, ["date_added"], "date_added"))
+        return {
+            "event_counts": event_counts,
+            "new_sessions": new_sessions,
+            "returning_sessions": returning_sessions,
+            "customer_ids": np.unique(np.concatenate(customers)) if customers else np.zeros(0, dtype=np.int32),
+            "devices": devices,
+            "countries": countries,
+            "searches": searches,
+        }
+
+    def top_values(self, table: str, column: str, start: datetime, end: datetime,
+                   filters: Optional[Dict[str, int]] = None, weight: Optional[str] = None) -> Counter:
+        """Row counts per value of a column over archived days, or sums of the `weight` column"""
+        counts = Counter()
+        names = [column] + list(filters or {}) + ([weight] if weight else [])
+        for data in self.scan(table, start, end, names, "date_added"):
+            keep = np.ones(len(data[column]), dtype=bool)
+            for name, wanted in (filters or {}).items():
+                keep &= data[name] == wanted
+            uniques, inverse = np.unique(data[column][keep], return_inverse=True)
+            value_counts = np.bincount(
+                inverse, weights=data[weight][keep] if weight else None, minlength=len(uniques)
+            )
+            counts.update(dict(zip(uniques.tolist(), value_counts.tolist())))
+        return counts
+
+
+def hot_window_start() -> datetime:
+    """Start of the range served from MySQL, older whole days come from the archive"""
+    return day_start(datetime.utcnow().date() - timedelta(days=settings.ANALYTICS_HOT_DAYS))
+
+
+columnar_archive = ColumnarArchive(settings.COLUMNAR_DIR)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export closed days of tracking tables to the columnar archive")
+    parser.add_argument("--table", choices=[*TABLES, "all"], default="all")
+    parser.add_argument("--since", type=date.fromisoformat, help="first day to export (YYYY-MM-DD)")
+    parser.add_argument("--day", type=date.fromisoformat, help="re-export a single day")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for table in (TABLES if args.table == "all" else [args.table]):
+            days = [args.day] if args.day else exportable_days(db, table, settings.COLUMNAR_DIR, args.since)
+            started = time.perf_counter()
+            rows = sum(export_day(db, table, day, settings.COLUMNAR_DIR) for day in days)
+            print(f"{table}: exported {len(days)} days, {rows} rows in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
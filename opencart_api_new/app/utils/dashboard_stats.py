@@ -0,0 +1,285 @@
+import argparse
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, distinct, event, func, select, text, true
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, engine
+from app.models.analytics import ActivityEvent, SearchQuery, SessionTracking
+from app.models.enhanced_cart import AbandonedCart, CartHistory
+from app.utils.activity_store import EVENT_TYPES
+from app.utils.columnar_archive import columnar_archive, hot_window_start
+from app.utils.hyperloglog import unique_counter
+
+COMPARE_MODES = ("previous_period",)
+
+PAGEVIEW = EVENT_TYPES["pageview"]
+PRODUCT_VIEW = EVENT_TYPES["product_view"]
+
+
+def dashboard_windows(days: int, compare: Optional[str]) -> List[Tuple[datetime, datetime]]:
+    """[start, end) of the requested window, followed by the one it is compared with"""
+    end = datetime.utcnow()
+    start = end - timedelta(days=days)
+    windows = [(start, end)]
+    if compare == "previous_period":
+        windows.append((start - timedelta(days=days), start))
+    return windows
+
+
+def _between(column, start: datetime, end: datetime):
+    return and_(column >= start, column < end)
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def session_breakdown(db: Session, windows, hot_windows) -> List[Dict]:
+    """
+    New, returning and active sessions per window with device and country
+    breakdowns, from one scan of api_session grouped by (device, country)
+    """
+    columns = []
+    for i, ((start, end), (hot_start, _)) in enumerate(zip(windows, hot_windows)):
+        columns += [
+            _count_if(_between(SessionTracking.first_visit, hot_start, end)).label(f"new_{i}"),
+            _count_if(and_(SessionTracking.first_visit < start, SessionTracking.last_activity >= start,
+                           SessionTracking.last_activity < end)).label(f"returning_{i}"),
+            _count_if(and_(SessionTracking.last_activity >= hot_start,
+                           SessionTracking.first_visit < end)).label(f"active_{i}"),
+        ]
+    rows = db.execute(select(SessionTracking.device_type, SessionTracking.country, *columns).where(
+        SessionTracking.last_activity >= min(hot_start for hot_start, _ in hot_windows)
+    ).group_by(SessionTracking.device_type, SessionTracking.country)).mappings().all()
+
+    results = []
+    for i in range(len(windows)):
+        devices = Counter()
+        countries = Counter()
+        for row in rows:
+            devices[row["device_type"]] += row[f"active_{i}"] or 0
+            if row["country"] is not None:
+                countries[row["country"]] += row[f"active_{i}"] or 0
+        results.append({
+            "new_sessions": sum(row[f"new_{i}"] or 0 for row in rows),
+            "returning_sessions": sum(row[f"returning_{i}"] or 0 for row in rows),
+            "devices": +devices,
+            "countries": +countries,
+        })
+    return results
+
+
+def window_totals(db: Session, windows, hot_windows, exact_customers: bool) -> List[Dict]:
+    """
+    Scalar figures of every window in one round trip: one conditional
+    aggregate per table, cross joined into a single row
+    """
+    scan_start = min(start for start, _ in windows)
+    hot_scan_start = min(hot_start for hot_start, _ in hot_windows)
+    scan_end = max(end for _, end in windows)
+    activity, searches, carts, abandoned, customers = [], [], [], [], []
+    for i, ((start, end), (hot_start, _)) in enumerate(zip(windows, hot_windows)):
+        in_hot = _between(ActivityEvent.date_added, hot_start, end)
+        activity += [
+            func.sum(case((and_(in_hot, ActivityEvent.event_type == PAGEVIEW), ActivityEvent.sample_weight),
+                          else_=0)).label(f"page_views_{i}"),
+            func.sum(case((and_(in_hot, ActivityEvent.event_type == PRODUCT_VIEW), ActivityEvent.sample_weight),
+                          else_=0)).label(f"product_views_{i}"),
+        ]
+        searches.append(_count_if(_between(SearchQuery.date_added, hot_start, end)).label(f"searches_{i}"))
+        carts.append(_count_if(_between(CartHistory.date_added, start, end)).label(f"cart_adds_{i}"))
+        abandoned.append(_count_if(_between(AbandonedCart.abandoned_date, start, end)).label(f"abandoned_{i}"))
+        customers.append(func.count(distinct(case((and_(
+            SessionTracking.last_activity >= hot_start, SessionTracking.first_visit < end
+        ), SessionTracking.customer_id)))).label(f"customers_{i}"))
+
+    subqueries = [
+        select(*activity).where(
+            ActivityEvent.date_added >= hot_scan_start, ActivityEvent.date_added < scan_end,
+            ActivityEvent.event_type.in_((PAGEVIEW, PRODUCT_VIEW))
+        ).subquery(),
+        select(*searches).where(SearchQuery.date_added >= hot_scan_start).subquery(),
+        select(*carts).where(CartHistory.date_added >= scan_start, CartHistory.action == "add").subquery(),
+        select(*abandoned).where(
+            AbandonedCart.abandoned_date >= scan_start, AbandonedCart.recovery_status == "pending"
+        ).subquery(),
+    ]
+    if exact_customers:
+        subqueries.append(select(*customers).where(
+            SessionTracking.last_activity >= hot_scan_start, SessionTracking.customer_id.isnot(None)
+        ).subquery())
+    joined = subqueries[0]
+    for subquery in subqueries[1:]:
+        joined = joined.join(subquery, true())
+    row = db.execute(select(*[column for subquery in subqueries for column in subquery.c]).select_from(joined)).mappings().one()
+
+    return [{
+        "page_views": row[f"page_views_{i}"] or 0,
+        "product_views": row[f"product_views_{i}"] or 0,
+        "searches": row[f"searches_{i}"] or 0,
+        "cart_adds": row[f"cart_adds_{i}"] or 0,
+        "abandoned_carts": row[f"abandoned_{i}"] or 0,
+        "customers": row[f"customers_{i}"] if exact_customers else None,
+    } for i in range(len(windows))]
+
+
+def dashboard_stats(db: Session, days: int, exact: bool = False, compare: Optional[str] = None) -> Dict:
+    """
+    Dashboard figures of the requested window (and the compared one) from
+    two queries: api_session grouped by device and country, and a single
+    row of conditional aggregates over the event tables. Unique customers
+    take one more query per window: the api_unique_count registers of hours
+    not cached yet by default, or the distinct customer ids in exact mode
+    when the window reaches into the columnar archive, which serves whole
+    days older than the hot window.
+    """
+    windows = dashboard_windows(days, compare)
+    boundary = hot_window_start()
+    hot_windows = [(min(max(start, boundary), end), end) for start, end in windows]
+    archived = [
+        columnar_archive.dashboard(start, hot_start) if start < hot_start else None
+        for (start, _), (hot_start, _) in zip(windows, hot_windows)
+    ]
+    # COUNT(DISTINCT) cannot be merged with archived ids, those windows list them
+    exact_in_sql = exact and not any(archived)
+    sessions = session_breakdown(db, windows, hot_windows)
+    totals = window_totals(db, windows, hot_windows, exact_in_sql)
+
+    periods = []
+    for (start, end), (hot_start, _), hot_sessions, hot_totals, old in zip(windows, hot_windows, sessions, totals, archived):
+        devices = Counter(hot_sessions["devices"])
+        countries = Counter(hot_sessions["countries"])
+        total_sessions = hot_sessions["new_sessions"]
+        returning_sessions = hot_sessions["returning_sessions"]
+        page_views = hot_totals["page_views"]
+        product_views = hot_totals["product_views"]
+        searches = hot_totals["searches"]
+        if old:
+            # Sessions started before the hot window were all archived.
+            # Archived sessions are counted under their first visit, one
+            # active across the hot window boundary appears on both sides
+            total_sessions += old["new_sessions"]
+            returning_sessions = old["returning_sessions"]
+            for device, count in old["devices"].items():
+                devices[device or None] += count
+            countries.update(old["countries"])
+            page_views += old["event_counts"].get(PAGEVIEW, 0)
+            product_views += old["event_counts"].get(PRODUCT_VIEW, 0)
+            searches += old["searches"]
+
+        if exact_in_sql:
+            unique_customers = hot_totals["customers"]
+        elif exact:
+            customer_ids = db.query(distinct(SessionTracking.customer_id)).filter(
+                SessionTracking.customer_id.isnot(None),
+                SessionTracking.last_activity >= hot_start,
+                SessionTracking.first_visit < end
+            )
+            unique_customers = len({customer_id for (customer_id,) in customer_ids} | (
+                set(old["customer_ids"].tolist()) if old else set()
+            ))
+        else:
+            unique_customers = unique_counter.count(db, "customer", start, end)
+
+        periods.append({
+            "visitors": {
+                "total_sessions": total_sessions,
+                "returning_sessions": returning_sessions,
+                "unique_customers": unique_customers,
+                "unique_customers_approximate": not exact,
+                "device_breakdown": dict(devices)
+            },
+            "activity": {
+                "page_views": round(page_views),
+                "product_views": round(product_views),
+                "searches": searches,
+                "cart_adds": hot_totals["cart_adds"],
+                "abandoned_carts": hot_totals["abandoned_carts"]
+            },
+            "geo": {
+                "top_countries": [{"country": country, "count": count} for country, count in countries.most_common(5)]
+            },
+            "start": start,
+            "end": end,
+            "archived_days_missing": columnar_archive.missing_days("activity", start, hot_start) if old else 0
+        })
+    return {"current": periods[0], "previous": periods[1] if len(periods) > 1 else None}
+
+
+def period_change(current: Dict, previous: Dict) -> Dict:
+    """Relative change of every visitor and activity figure, None when the previous one is 0"""
+    change = {}
+    for section in ("visitors", "activity"):
+        for name, value in current[section].items():
+            before = previous[section][name]
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            change[name] = round((value - before) / before, 4) if before else None
+    return change
+
+
+def legacy_dashboard(db: Session, days: int):
+    """The per-figure scalar queries the dashboard used to run, for the benchmark"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    db.query(func.count(distinct(SessionTracking.session_id))).filter(SessionTracking.first_visit >= cutoff).scalar()
+    db.query(func.count(distinct(SessionTracking.session_id))).filter(
+        SessionTracking.first_visit < cutoff, SessionTracking.last_activity >= cutoff
+    ).scalar()
+    db.query(SessionTracking.device_type, func.count(distinct(SessionTracking.session_id))).filter(
+        SessionTracking.last_activity >= cutoff
+    ).group_by(SessionTracking.device_type).all()
+    for event_type in (PAGEVIEW, PRODUCT_VIEW):
+        db.query(func.sum(ActivityEvent.sample_weight)).filter(
+            ActivityEvent.event_type == event_type, ActivityEvent.date_added >= cutoff
+        ).scalar()
+    db.query(func.count(SearchQuery.search_id)).filter(SearchQuery.date_added >= cutoff).scalar()
+    db.query(func.count(CartHistory.history_id)).filter(
+        CartHistory.date_added >= cutoff, CartHistory.action == "add"
+    ).scalar()
+    db.query(func.count(AbandonedCart.abandoned_id)).filter(
+        AbandonedCart.abandoned_date >= cutoff, AbandonedCart.recovery_status == "pending"
+    ).scalar()
+    db.query(SessionTracking.country, func.count(distinct(SessionTracking.session_id))).filter(
+        SessionTracking.last_activity >= cutoff, SessionTracking.country.isnot(None)
+    ).group_by(SessionTracking.country).limit(5).all()
+    unique_counter.count(db, "customer", cutoff)
+
+
+def rows_read(db: Session) -> int:
+    """Rows the MySQL storage engine handed to this connection so far"""
+    return sum(int(value) for _, value in db.execute(text("SHOW SESSION STATUS LIKE 'Handler_read%'")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare round trips and rows read of the dashboard queries")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *params: statements.append(params[2]))
+    db = SessionLocal()
+    try:
+        runs = (
+            ("legacy", lambda: legacy_dashboard(db, args.days)),
+            ("conditional", lambda: dashboard_stats(db, args.days)),
+            ("conditional + previous period", lambda: dashboard_stats(db, args.days, compare="previous_period")),
+        )
+        for label, run in runs:
+            timings = []
+            for _ in range(args.repeat):
+                before = rows_read(db)
+                del statements[:]
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+                round_trips = len(statements)
+                rows = rows_read(db) - before
+            print(f"{label}: {round_trips} round trips, {rows} rows read, "
+                  f"best {min(timings) * 1000:.1f}ms, median {sorted(timings)[len(timings) // 2] * 1000:.1f}ms")
+    finally:
+        db.close()
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.utils.background import PeriodicJob
+
+# Segment being written by a worker, renamed to SEALED_SUFFIX when rotated
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".ndjson"
+
+# Seal segments at least this often (seconds) so the ingester can delete them
+SEGMENT_MAX_AGE = 300
+
+# Columns of api_session only written when a session is first seen
+SESSION_DETAIL_FIELDS = (
+    "ip_address", "user_agent", "country", "region", "city", "device_type", "browser", "os",
+    "utm_source", "utm_medium", "utm_campaign", "referring_site",
+)
+
+
+class EventSpool:
+    """
+    Append-only local spool of tracking events, one JSON object per line.
+
+    Each worker process writes its own segment file with O_APPEND, one
+    write() per event, so a crashed worker leaves at most a truncated last
+    line. Segments are sealed by renaming once they reach `segment_bytes`
+    or SEGMENT_MAX_AGE. Data reaches the disk on `sync()`, which a
+    background job calls every EVENT_SPOOL_FSYNC seconds instead of paying
+    an fsync per request.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._path: Optional[str] = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._dirty = False
+        self._sequence = 0
+
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Time first so segments sort in write order, pid keeps workers apart
+        self._sequence += 1
+        name = f"{int(time.time() * 1000):013d}-{os.getpid()}-{self._sequence:06d}"
+        self._path = os.path.join(self.directory, name + OPEN_SUFFIX)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        self._opened_at = time.monotonic()
+
+    def _seal_segment(self):
+        if self._fd is None:
+            return
+        if self._dirty:
+            os.fsync(self._fd)
+            self._dirty = False
+        os.close(self._fd)
+        os.replace(self._path, self._path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self._fd = None
+        self._path = None
+
+    def append(self, event: dict):
+        line = json.dumps(
+            {key: value for key, value in event.items() if value is not None},
+            separators=(",", ":"), default=str
+        ).encode() + b"\n"
+        with self._lock:
+            if self._fd is not None and (
+                self._size >= self.segment_bytes or time.monotonic() - self._opened_at > SEGMENT_MAX_AGE
+            ):
+                self._seal_segment()
+            if self._fd is None:
+                self._open_segment()
+            os.write(self._fd, line)
+            self._size += len(line)
+            self._dirty = True
+
+    def sync(self):
+        """fsync everything appended since the last call, seal idle segments"""
+        with self._lock:
+            if self._fd is None:
+                return
+            if time.monotonic() - self._opened_at > SEGMENT_MAX_AGE:
+                self._seal_segment()
+            elif self._dirty:
+                os.fsync(self._fd)
+                self._dirty = False
+
+    def close(self):
+        with self._lock:
+            self._seal_segment()
+
+
+def session_details(event: dict) -> Dict:
+    """First-visit api_session column values for a spooled event"""
+    details = {field: event.get(field) for field in SESSION_DETAIL_FIELDS}
+    details["ip_address"] = details["ip_address"] or ""
+    return details
+
+
+def session_rows(events: List[dict]) -> List[Dict]:
+    """One api_session row per session in a batch, hits folded into visit_count"""
+    sessions: Dict[str, Dict] = {}
+    for event in events:
+        if event.get("beacon"):
+            continue  # Client engagement events are not page hits
+        moment = datetime.utcfromtimestamp(event["ts"])
+        customer_id = event.get("customer_id") or None
+        row = sessions.get(event["session_id"])
+        if row is None:
+            row = sessions[event["session_id"]] = {
+                "session_id": event["session_id"],
+                "customer_id": customer_id,
+                "user_type": event.get("user_type", "guest"),
+                "first_visit": moment,
+                "last_activity": moment,
+                "visit_count": 0,
+                **session_details(event)
+            }
+        row["visit_count"] += 1
+        row["first_visit"] = min(row["first_visit"], moment)
+        row["last_activity"] = max(row["last_activity"], moment)
+        if customer_id and not row["customer_id"]:
+            row["customer_id"] = customer_id
+            row["user_type"] = event.get("user_type", "guest")
+    return list(sessions.values())
+
+
+event_spool = EventSpool(settings.EVENT_SPOOL_DIR, settings.EVENT_SPOOL_SEGMENT_BYTES)
+
+event_spool_sync_job = PeriodicJob(
+    "event-spool-sync",
+    event_spool.sync,
+    interval=settings.EVENT_SPOOL_FSYNC,
+    run_on_start=False
+)
@@ -0,0 +1,249 @@
+import argparse
+import bisect
+import math
+import random
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.analytics import ActivityEvent, SessionKey, SessionTracking
+from app.models.order import Order
+from app.utils.activity_store import EVENT_TYPES
+from app.utils.sampling import EventSampler, parse_rates
+
+FUNNEL_STEPS = ("view", "product_view", "add_to_cart", "order")
+
+# Session columns funnels can be broken down by
+DIMENSIONS = {
+    "device": SessionTracking.device_type,
+    "utm_source": SessionTracking.utm_source,
+    "country": SessionTracking.country,
+}
+
+# An order counts for a session when placed this long after its first add to cart
+ORDER_ATTRIBUTION = timedelta(hours=24)
+
+# Rows fetched per round trip from the server-side cursors
+STREAM_CHUNK = 10000
+
+# Funnels kept per worker, least recently used are evicted
+CACHE_SIZE = 64
+
+PRODUCT_VIEW = EVENT_TYPES["product_view"]
+ADD_TO_CART = EVENT_TYPES["add_to_cart"]
+FUNNEL_EVENT_TYPES = (EVENT_TYPES["pageview"], PRODUCT_VIEW, ADD_TO_CART)
+
+
+def session_stream(db: Session, start: datetime, end: datetime,
+                   dimension: Optional[str]) -> Iterator[Tuple[int, Optional[int], Optional[str]]]:
+    """(session_key, customer_id, dimension value) of sessions active in the window, by session_key"""
+    column = DIMENSIONS[dimension] if dimension else SessionTracking.customer_id
+    query = select(SessionKey.session_key, SessionTracking.customer_id, column).join(
+        SessionTracking, SessionTracking.session_id == SessionKey.session_id
+    ).where(
+        SessionTracking.last_activity >= start,
+        SessionTracking.first_visit < end
+    ).order_by(SessionKey.session_key)
+    for session_key, customer_id, value in db.execute(query.execution_options(yield_per=STREAM_CHUNK)):
+        yield session_key, customer_id, value if dimension else None
+
+
+def event_stream(db: Session, start: datetime, end: datetime) -> Iterator[Tuple[int, int, datetime, float]]:
+    """
+    (session_key, event_type, date_added, sample_weight) of funnel events in
+    the window, by session then time, events of the same second in insertion order
+    """
+    query = select(
+        ActivityEvent.session_key, ActivityEvent.event_type, ActivityEvent.date_added, ActivityEvent.sample_weight
+    ).where(
+        ActivityEvent.date_added >= start,
+        ActivityEvent.date_added < end,
+        ActivityEvent.event_type.in_(FUNNEL_EVENT_TYPES)
+    ).order_by(ActivityEvent.session_key, ActivityEvent.date_added, ActivityEvent.event_id)
+    yield from db.execute(query.execution_options(yield_per=STREAM_CHUNK))
+
+
+def customer_orders(db: Session, start: datetime, end: datetime) -> Dict[int, List[datetime]]:
+    """Sorted order times per customer. Guest orders (customer_id 0) cannot be tied to a session."""
+    orders = defaultdict(list)
+    rows = db.query(Order.customer_id, Order.date_added).filter(
+        Order.customer_id > 0,
+        Order.order_status_id > 0,  # 0 is an abandoned checkout
+        Order.date_added >= start,
+        Order.date_added < end + ORDER_ATTRIBUTION
+    ).order_by(Order.customer_id, Order.date_added).yield_per(STREAM_CHUNK)
+    for customer_id, date_added in rows:
+        orders[customer_id].append(date_added)
+    return orders
+
+
+def session_step(events, customer_id: Optional[int], orders: Dict[int, List[datetime]]) -> List[float]:
+    """
+    Weights of the funnel steps a session completed, in order.
+
+    Sampling keeps or drops all events of a type in a session, independently
+    per type, so each step is weighted by the inverse of the probability
+    that it is seen. Product view and add to cart are only seen when their
+    types were kept, and stand for the product of those types' weights.
+    A session is a view when any of its types was kept: 1 - prod(1 - weight)
+    over the types seen estimates that without bias, exactly 1 as soon as
+    an unsampled type is seen, and below 1 or negative for some sessions
+    seen only through several sampled types.
+    """
+    type_weights = {}
+    weights = [None]
+    cart_time = None
+    for _, event_type, moment, weight in events:
+        type_weights[event_type] = weight  # Any tracked page is a view
+        if len(weights) == 1 and event_type == PRODUCT_VIEW:
+            weights.append(weight)
+        elif len(weights) == 2 and event_type == ADD_TO_CART:
+            weights.append(weights[1] * weight)
+            cart_time = moment
+    if not type_weights:
+        return []
+    weights[0] = 1.0 - math.prod(1.0 - weight for weight in type_weights.values())
+    if len(weights) == 3 and customer_id:
+        times = orders.get(customer_id, ())
+        i = bisect.bisect_left(times, cart_time)
+        if i < len(times) and times[i] <= cart_time + ORDER_ATTRIBUTION:
+            weights.append(weights[2])
+    return weights
+
+
+def simulate_funnel(sampler: EventSampler, sessions: int, seed: int = 7) -> Tuple[List[int], List[float]]:
+    """
+    True step counts of random sessions, and the counts estimated from
+    the events `sampler` keeps, to check the weighting of session_step
+    """
+    rng = random.Random(seed)
+    names = {code: name for name, code in EVENT_TYPES.items()}
+    start = datetime(2024, 1, 1)
+    true_counts = [0] * len(FUNNEL_STEPS)
+    estimated = [0.0] * len(FUNNEL_STEPS)
+    for session in range(sessions):
+        session_id = f"session-{session}"
+        events = [EVENT_TYPES["pageview"]] * rng.choice((0, 1, 1, 2, 4))
+        if rng.random() < 0.5:
+            events += [PRODUCT_VIEW] * rng.randint(1, 3)
+            if rng.random() < 0.3:
+                events.append(ADD_TO_CART)
+        if not events:
+            events = [PRODUCT_VIEW]
+        customer_id = session if rng.random() < 0.5 else None
+        orders = {session: [start + timedelta(hours=1)]} if customer_id and rng.random() < 0.4 else {}
+        rows = [(session, event_type, start + timedelta(seconds=i), 1.0) for i, event_type in enumerate(events)]
+        for i in range(len(session_step(rows, customer_id, orders))):
+            true_counts[i] += 1
+        kept = [(key, event_type, moment, sampler.weight(session_id, names[event_type]))
+                for key, event_type, moment, _ in rows]
+        for i, weight in enumerate(session_step([row for row in kept if row[3]], customer_id, orders)):
+            estimated[i] += weight
+    return true_counts, estimated
+
+
+def compute_funnel(start: datetime, end: datetime, dimension: Optional[str]) -> Dict[Optional[str], List[int]]:
+    """
+    Sessions reaching each funnel step, per dimension value, in one pass.
+
+    Events and sessions are read as two session_key ordered streams from
+    server-side cursors, each on its own connection, and merge-joined, so
+    only the current session is held in memory. Sessions with events but
+    no api_session row are counted under None. Counts are weighted for
+    EVENT_SAMPLE_RATES (see session_step) and rounded.
+    """
+    events_db = SessionLocal()
+    sessions_db = SessionLocal()
+    try:
+        orders = customer_orders(sessions_db, start, end)
+        reached: Dict[Optional[str], List[float]] = defaultdict(lambda: [0.0] * len(FUNNEL_STEPS))
+        sessions = session_stream(sessions_db, start, end, dimension)
+        current = next(sessions, None)
+        for session_key, events in groupby(event_stream(events_db, start, end), key=lambda row: row[0]):
+            while current is not None and current[0] < session_key:
+                current = next(sessions, None)
+            if current is not None and current[0] == session_key:
+                customer_id, value = current[1], current[2]
+            else:
+                customer_id, value = None, None
+            counts = reached[value]
+            for i, weight in enumerate(session_step(events, customer_id, orders)):
+                counts[i] += weight
+        # Negative session weights can leave a small group below zero
+        return {value: [max(0, round(count)) for count in counts] for value, counts in reached.items()}
+    finally:
+        events_db.close()
+        sessions_db.close()
+
+
+def funnel_report(counts: List[int]) -> Dict:
+    steps = []
+    previous = None
+    for name, sessions in zip(FUNNEL_STEPS, counts):
+        steps.append({
+            "step": name,
+            "sessions": sessions,
+            "conversion": sessions / previous if previous else None,
+            "drop_off": previous - sessions if previous is not None else None,
+        })
+        previous = sessions
+    return {"steps": steps, "overall_conversion": counts[-1] / counts[0] if counts[0] else 0.0}
+
+
+class FunnelCache:
+    """Computed funnels per (window in days, dimension), recomputed after `ttl` seconds"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, Optional[str]], Tuple[float, datetime, Dict]]" = OrderedDict()
+
+    def get(self, days: int, dimension: Optional[str]) -> Tuple[datetime, Dict[Optional[str], List[int]]]:
+        key = (days, dimension)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1], entry[2]
+        end = datetime.utcnow()
+        counts = compute_funnel(end - timedelta(days=days), end, dimension)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), end, counts)
+            self._entries.move_to_end(key)
+            while len(self._entries) > CACHE_SIZE:
+                self._entries.popitem(last=False)
+        return end, counts
+
+
+funnel_cache = FunnelCache(settings.FUNNEL_CACHE_TTL)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute a conversion funnel")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--dimension", choices=list(DIMENSIONS))
+    parser.add_argument("--simulate", metavar="RATES",
+                        help='check the sample weighting on random sessions instead, e.g. "pageview=0.1,product_view=0.1"')
+    parser.add_argument("--sessions", type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.simulate is not None:
+        true_counts, estimated = simulate_funnel(EventSampler(parse_rates(args.simulate)), args.sessions)
+        for name, actual, estimate in zip(FUNNEL_STEPS, true_counts, estimated):
+            print(f"{name}: {actual} sessions, estimate {estimate:.0f} ({(estimate - actual) / max(1, actual):+.2%})")
+        raise SystemExit
+
+    end = datetime.utcnow()
+    started = time.perf_counter()
+    counts = compute_funnel(end - timedelta(days=args.days), end, args.dimension)
+    print(f"Computed in {time.perf_counter() - started:.2f}s")
+    for value, value_counts in sorted(counts.items(), key=lambda item: -item[1][0]):
+        print(f"{value}: " + " -> ".join(f"{name} {count}" for name, count in zip(FUNNEL_STEPS, value_counts)))
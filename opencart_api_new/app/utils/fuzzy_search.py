@@ -0,0 +1,324 @@
+import argparse
+import random
+import re
+import string
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.product import Product, ProductDescription
+from app.utils.background import PeriodicJob
+
+TOKEN = re.compile(r"[a-z0-9]+")
+
+# Tokens shorter than this are never corrected, there are too many neighbours
+MIN_CORRECTABLE_LENGTH = 3
+
+# Upper bound on tokens corrected per phrase so lookups stay bounded in time
+MAX_PHRASE_TOKENS = 8
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower()) if text else []
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal string alignment distance (Damerau-Levenshtein without repeated
+    edits of a substring). Returns max_distance + 1 once the bound is exceeded.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = i
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[len(b)], max_distance + 1)
+
+
+class SpellingIndex:
+    """
+    SymSpell style symmetric-delete spelling corrector.
+
+    Every vocabulary word contributes all deletions (up to max_distance
+    characters) of its first prefix_length characters to a hash map. A query
+    generates the same bounded set of deletions and only words sharing one of
+    them are compared with a real edit distance, so the cost of a lookup
+    depends on the word length and distance bound, not on vocabulary size.
+    """
+
+    def __init__(self, word_counts: Dict[str, int], max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words: List[str] = []
+        self.counts: Dict[str, int] = {}
+        # hash(deletion) -> word id, or list of word ids when shared. Hash
+        # collisions only add candidates, which are verified by edit distance.
+        self.deletes: Dict[int, object] = {}
+
+        for word, count in word_counts.items():
+            if len(word) < MIN_CORRECTABLE_LENGTH:
+                continue
+            word_id = len(self.words)
+            self.words.append(word)
+            self.counts[word] = count
+            for key in self._deletions(word[:prefix_length], max_distance):
+                key = hash(key)
+                existing = self.deletes.get(key)
+                if existing is None:
+                    self.deletes[key] = word_id
+                elif isinstance(existing, list):
+                    existing.append(word_id)
+                else:
+                    self.deletes[key] = [existing, word_id]
+
+    @staticmethod
+    def _deletions(key: str, max_distance: int) -> set:
+        result = {key}
+        frontier = [key]
+        for _ in range(max_distance):
+            next_frontier = []
+            for item in frontier:
+                if len(item) <= 1:
+                    continue
+                for i in range(len(item)):
+                    deletion = item[:i] + item[i + 1:]
+                    if deletion not in result:
+                        result.add(deletion)
+                        next_frontier.append(deletion)
+            frontier = next_frontier
+        return result
+
+    def _max_distance_for(self, word: str) -> int:
+        # One typo per short word, otherwise the configured bound
+        return 1 if len(word) <= 4 else self.max_distance
+
+    def lookup(self, word: str) -> List[Tuple[str, int, int]]:
+        """Closest vocabulary words as (word, distance, count), best first"""
+        word = word.lower()
+        if word in self.counts:
+            return [(word, 0, self.counts[word])]
+        if len(word) < MIN_CORRECTABLE_LENGTH:
+            return []
+
+        max_distance = self._max_distance_for(word)
+        input_prefix_length = min(len(word), self.prefix_length)
+        candidates = deque([word[:self.prefix_length]])
+        considered = {candidates[0]}
+        checked = set()
+        suggestions = []
+
+        while candidates:
+            candidate = candidates.popleft()
+            length_diff = input_prefix_length - len(candidate)
+            if length_diff > max_distance:
+                break  # Breadth first, every later candidate is shorter still
+
+            word_ids = self.deletes.get(hash(candidate), ())
+            if isinstance(word_ids, int):
+                word_ids = (word_ids,)
+            for word_id in word_ids:
+                if word_id in checked:
+                    continue
+                checked.add(word_id)
+                suggestion = self.words[word_id]
+                distance = edit_distance(word, suggestion, max_distance)
+                if distance > max_distance:
+                    continue
+                if distance < max_distance:
+                    # Only keep the closest matches
+                    suggestions = [s for s in suggestions if s[1] <= distance]
+                    max_distance = distance
+                suggestions.append((suggestion, distance, self.counts[suggestion]))
+
+            if length_diff < max_distance and len(candidate) > 1:
+                for i in range(len(candidate)):
+                    deletion = candidate[:i] + candidate[i + 1:]
+                    if deletion not in considered:
+                        considered.add(deletion)
+                        candidates.append(deletion)
+
+        suggestions.sort(key=lambda s: (s[1], -s[2]))
+        return suggestions
+
+    def correct(self, phrase: str) -> Optional[str]:
+        """Correct each unknown token of a phrase, None if nothing changed"""
+        tokens = tokenize(phrase)
+        if not tokens or len(tokens) > MAX_PHRASE_TOKENS:
+            return None
+        corrected = []
+        for token in tokens:
+            suggestions = self.lookup(token)
+            corrected.append(suggestions[0][0] if suggestions else token)
+        return " ".join(corrected) if corrected != tokens else None
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the vocabulary and deletion map"""
+        total = sys.getsizeof(self.words) + sys.getsizeof(self.counts) + sys.getsizeof(self.deletes)
+        total += sum(sys.getsizeof(word) for word in self.words)
+        for key, word_ids in self.deletes.items():
+            total += sys.getsizeof(key)
+            if isinstance(word_ids, list):
+                total += sys.getsizeof(word_ids)
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "words": len(self.words),
+            "delete_entries": len(self.deletes),
+            "memory_bytes": self.memory_usage(),
+            "max_distance": self.max_distance,
+            "prefix_length": self.prefix_length
+        }
+
+
+def load_vocabulary(db: Session) -> Counter:
+    """Word frequencies over product names and tags"""
+    counts = Counter()
+    rows = db.query(
+        ProductDescription.name,
+        ProductDescription.tag
+    ).join(
+        Product, Product.product_id == ProductDescription.product_id
+    ).filter(
+        ProductDescription.language_id == 1,  # Default language
+        Product.status == True
+    ).yield_per(5000)
+    for name, tag in rows:
+        counts.update(tokenize(name))
+        counts.update(tokenize(tag))
+    return counts
+
+
+class SpellingIndexHolder:
+    """Keeps the current SpellingIndex and rebuilds it from the catalog"""
+
+    def __init__(self):
+        self._index: Optional[SpellingIndex] = None
+        self._build_lock = threading.Lock()
+        self.built_at: Optional[datetime] = None
+
+    def _build(self):
+        db = SessionLocal()
+        try:
+            vocabulary = load_vocabulary(db)
+        finally:
+            db.close()
+        self._index = SpellingIndex(vocabulary, max_distance=settings.SEARCH_MAX_EDIT_DISTANCE)
+        self.built_at = datetime.utcnow()
+
+    def rebuild(self):
+        with self._build_lock:
+            self._build()
+
+    @property
+    def index(self) -> SpellingIndex:
+        if self._index is None:
+            with self._build_lock:
+                if self._index is None:
+                    self._build()
+        return self._index
+
+    def correct(self, phrase: str) -> Optional[str]:
+        return self.index.correct(phrase)
+
+
+spelling_index = SpellingIndexHolder()
+
+spelling_index_job = PeriodicJob(
+    "search-spelling-rebuild",
+    spelling_index.rebuild,
+    interval=settings.SEARCH_SUGGEST_REFRESH
+)
+
+
+def make_typo(word: str, rng: random.Random) -> str:
+    """Apply one random insertion, deletion, substitution or transposition"""
+    i = rng.randrange(len(word))
+    kind = rng.choice(("insert", "delete", "substitute", "transpose"))
+    letter = rng.choice(string.ascii_lowercase)
+    if kind == "insert":
+        return word[:i] + letter + word[i:]
+    if kind == "delete":
+        return word[:i] + word[i + 1:]
+    if kind == "substitute":
+        return word[:i] + letter + word[i + 1:]
+    if i == len(word) - 1:
+        i -= 1
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def benchmark(vocabulary: Dict[str, int], samples: int, seed: int = 7):
+    """Measure build time, memory, lookup latency and accuracy over a typo corpus"""
+    start = time.perf_counter()
+    index = SpellingIndex(vocabulary, max_distance=settings.SEARCH_MAX_EDIT_DISTANCE)
+    build_seconds = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    words = [w for w in index.words if len(w) >= 5]
+    corpus = []
+    for _ in range(samples):
+        word = rng.choice(words)
+        typo = make_typo(word, rng)
+        if rng.random() < 0.3:
+            typo = make_typo(typo, rng)
+        corpus.append((typo, word))
+
+    correct = 0
+    latencies = []
+    for typo, expected in corpus:
+        start = time.perf_counter()
+        suggestions = index.lookup(typo)
+        latencies.append(time.perf_counter() - start)
+        if suggestions and suggestions[0][0] == expected:
+            correct += 1
+
+    latencies.sort()
+    stats = index.stats()
+    print(f"words: {stats['words']}, delete entries: {stats['delete_entries']}")
+    print(f"memory: {stats['memory_bytes'] / 1024 / 1024:.1f} MiB, build: {build_seconds:.2f}s")
+    print(f"top-1 accuracy: {correct / len(corpus) * 100:.1f}% over {len(corpus)} typos")
+    print(f"latency p50: {latencies[len(latencies) // 2] * 1e6:.0f}us, "
+          f"p99: {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us, "
+          f"max: {latencies[-1] * 1e6:.0f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the spelling correction index")
+    parser.add_argument("--samples", type=int, default=10000, help="number of misspelled words to look up")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="use N random words instead of the product catalog")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        rng = random.Random(1)
+        vocabulary = {
+            "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))): rng.randint(1, 100)
+            for _ in range(args.synthetic)
+        }
+    else:
+        db = SessionLocal()
+        try:
+            vocabulary = load_vocabulary(db)
+        finally:
+            db.close()
+    benchmark(vocabulary, args.samples)
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Set
+
+from app.config import settings
+
+# Sessions seen within this many seconds count as online
+ONLINE_WINDOW = 300
+
+# Rates are hits over the last RATE_WINDOW seconds, kept in one-second buckets
+RATE_WINDOW = 60
+
+RECENT_ORDERS = 10
+
+# Payloads queued per subscriber; a slow client loses the oldest, never
+# holds memory or the publisher
+SUBSCRIBER_QUEUE_SIZE = 5
+
+
+class RateWindow:
+    """Hits in the last RATE_WINDOW seconds, in a ring of per-second buckets"""
+
+    def __init__(self):
+        self._counts = [0] * RATE_WINDOW
+        self._seconds = [0] * RATE_WINDOW
+
+    def add(self, second: int):
+        i = second % RATE_WINDOW
+        if self._seconds[i] != second:
+            self._seconds[i] = second
+            self._counts[i] = 0
+        self._counts[i] += 1
+
+    def total(self, second: int) -> int:
+        return sum(count for count, at in zip(self._counts, self._seconds) if second - at < RATE_WINDOW)
+
+
+class LiveCounters:
+    """In-memory figures of this worker fed by the tracking path, cheap to snapshot"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._online: "OrderedDict[str, float]" = OrderedDict()
+        self._rates = {"pageview": RateWindow(), "product_view": RateWindow(), "add_to_cart": RateWindow()}
+        self._orders = deque(maxlen=RECENT_ORDERS)
+
+    def record_hit(self, session_id: str, event_type: str):
+        now = time.time()
+        with self._lock:
+            self._online[session_id] = now
+            self._online.move_to_end(session_id)
+            self._prune(now)
+            rate = self._rates.get(event_type)
+            if rate is not None:
+                rate.add(int(now))
+
+    def record_order(self, order_id: int, customer_id: int, total: float):
+        with self._lock:
+            self._orders.appendleft({
+                "order_id": order_id, "customer_id": customer_id, "total": total, "time": time.time()
+            })
+
+    def _prune(self, now: float):
+        # Least recently seen first, drop until a session is still online.
+        # Each session is dropped once, so pruning on every hit is amortised O(1)
+        while self._online and now - next(iter(self._online.values())) > ONLINE_WINDOW:
+            self._online.popitem(last=False)
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            return {
+                "time": now,
+                "online_visitors": len(self._online),
+                "per_minute": {name: rate.total(int(now)) for name, rate in self._rates.items()},
+                "recent_orders": list(self._orders),
+            }
+
+
+class LiveBroadcaster:
+    """
+    Computes one snapshot every `interval` seconds while anyone listens and
+    fans the serialized payload out to every subscriber queue.
+    """
+
+    def __init__(self, counters: LiveCounters, interval: float):
+        self.counters = counters
+        self.interval = interval
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._latest: Optional[str] = None
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if self._latest is not None:
+            queue.put_nowait(self._latest)
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, payload: str):
+        self._latest = payload
+        for queue in list(self._subscribers):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(payload)
+
+    async def _run(self):
+        # Stops with the last subscriber, the next subscribe starts it again
+        while self._subscribers:
+            try:
+                self.publish(json.dumps(self.counters.snapshot(), separators=(",", ":")))
+            except Exception as e:
+                print(f"Error publishing live stats: {e}")
+            await asyncio.sleep(self.interval)
+
+
+live_counters = LiveCounters()
+live_broadcaster = LiveBroadcaster(live_counters, settings.LIVE_STATS_INTERVAL)
+
+
+if __name__ == "__main__":
+    # Fan-out cost of one snapshot to many subscribers, one of them never reading
+    async def benchmark(subscribers: int, rounds: int):
+        broadcaster = LiveBroadcaster(LiveCounters(), interval=3600)
+        queues = [broadcaster.subscribe() for _ in range(subscribers)]
+        for i in range(10000):
+            broadcaster.counters.record_hit(f"session-{i % 2000}", "pageview")
+        started = time.perf_counter()
+        for _ in range(rounds):
+            broadcaster.publish(json.dumps(broadcaster.counters.snapshot()))
+            for queue in queues[1:]:
+                queue.get_nowait()
+        elapsed = time.perf_counter() - started
+        print(f"{subscribers} subscribers: {elapsed / rounds * 1000:.2f}ms per snapshot, "
+              f"stalled client holds {queues[0].qsize()} payloads, {broadcaster.dropped} dropped")
+        broadcaster._subscribers.clear()
+
+    asyncio.run(benchmark(1000, 200))
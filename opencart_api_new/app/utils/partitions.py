@@ -0,0 +1,280 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import re
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.engine import Connection
+
+from app.config import settings
+from app.database import engine
+from app.models.analytics import ActivityEvent, ProductView, UserActivity
+from app.models.enhanced_cart import CartHistory
+
+# Append-only tables partitioned by month: table -> (id column, date column).
+# Unique keys of a partitioned table must contain the partition column, so
+# the primary key becomes (id, date) and foreign keys are dropped.
+PARTITIONED_TABLES = {
+    "api_activity_event": ("event_id", "date_added"),
+    "api_user_activity": ("activity_id", "date_added"),
+    "api_cart_history": ("history_id", "date_added"),
+    "api_product_view": ("view_id", "date_added"),
+}
+
+# Tables keyed by session id / ip and updated in place. Their upserts rely on
+# that key being unique on its own, which a date-partitioned table cannot
+# guarantee, so old rows are archived and deleted in primary key chunks.
+PURGED_TABLES = {
+    "api_session": ("session_id", "last_activity"),
+    "oc_customer_online": ("ip", "date_added"),
+}
+
+PARTITION_NAME = re.compile(r"^p(\d{4})(\d{2})$")
+CATCH_ALL_PARTITION = "pmax"
+
+# Rows deleted per statement when purging, keeps locks and undo log short
+PURGE_CHUNK = 5000
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def partition_clause(month: date) -> str:
+    """Partition holding rows of `month`"""
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1).isoformat()}')"
+
+
+def list_partitions(connection: Connection, table: str) -> List[str]:
+    rows = connection.execute(text(
+        "SELECT partition_name FROM information_schema.partitions "
+        "WHERE table_schema = DATABASE() AND table_name = :table AND partition_name IS NOT NULL "
+        "ORDER BY partition_ordinal_position"
+    ), {"table": table})
+    return [name for (name,) in rows]
+
+
+def partition_month(name: str) -> Optional[date]:
+    match = PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+def foreign_keys(connection: Connection, table: str) -> List[str]:
+    rows = connection.execute(text(
+        "SELECT constraint_name FROM information_schema.table_constraints "
+        "WHERE table_schema = DATABASE() AND table_name = :table AND constraint_type = 'FOREIGN KEY'"
+    ), {"table": table})
+    return [name for (name,) in rows]
+
+
+def convert_table(connection: Connection, table: str, months_ahead: int):
+    """
+    Partition an existing table by month of its date column. This rebuilds
+    the table (ALTER TABLE copies every row), run it in a maintenance window.
+    """
+    if list_partitions(connection, table):
+        print(f"{table} is already partitioned")
+        return
+    id_column, date_column = PARTITIONED_TABLES[table]
+    for constraint in foreign_keys(connection, table):
+        connection.execute(text(f"ALTER TABLE `{table}` DROP FOREIGN KEY `{constraint}`"))
+
+    oldest = connection.execute(text(f"SELECT MIN(`{date_column}`) FROM `{table}`")).scalar()
+    first = month_start(oldest.date() if oldest else date.today())
+    last = add_months(month_start(date.today()), months_ahead)
+    clauses = []
+    month = first
+    while month <= last:
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append(f"PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN (MAXVALUE)")
+
+    connection.execute(text(
+        f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (`{id_column}`, `{date_column}`) "
+        f"PARTITION BY RANGE COLUMNS(`{date_column}`) ({', '.join(clauses)})"
+    ))
+    print(f"Partitioned {table} into {len(clauses)} partitions")
+
+
+def add_future_partitions(connection: Connection, table: str, months_ahead: int) -> int:
+    """Split the catch-all partition so the coming months have their own"""
+    existing = {partition_month(name) for name in list_partitions(connection, table)} - {None}
+    if not existing:
+        return 0
+    last = add_months(month_start(date.today()), months_ahead)
+    month = add_months(max(existing), 1)
+    clauses = []
+    while month <= last:
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    if clauses:
+        # pmax only holds rows dated beyond the last monthly partition, normally none
+        connection.execute(text(
+            f"ALTER TABLE `{table}` REORGANIZE PARTITION {CATCH_ALL_PARTITION} INTO "
+            f"({', '.join(clauses)}, PARTITION {CATCH_ALL_PARTITION} VALUES LESS THAN (MAXVALUE))"
+        ))
+    return len(clauses)
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot archive {type(value).__name__}")
+
+
+def archive_rows(connection: Connection, query: str, params: Dict, path: str) -> int:
+    """Stream a query into a gzip NDJSON file, written atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    count = 0
+    result = connection.execution_options(stream_results=True).execute(text(query), params)
+    with open(temp_path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for row in result.mappings():
+                f.write(json.dumps(dict(row), default=_json_default, separators=(",", ":")).encode() + b"\n")
+                count += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp_path, path)
+    return count
+
+
+def drop_old_partitions(connection: Connection, table: str, keep_months: int, archive_dir: str) -> List[Tuple[str, int]]:
+    """Archive then drop monthly partitions older than `keep_months`"""
+    cutoff = add_months(month_start(date.today()), -keep_months)
+    dropped = []
+    for name in list_partitions(connection, table):
+        month = partition_month(name)
+        if month is None or month >= cutoff:
+            continue
+        path = os.path.join(archive_dir, table, f"{name}.ndjson.gz")
+        count = archive_rows(connection, f"SELECT * FROM `{table}` PARTITION (`{name}`)", {}, path)
+        # Dropping a partition is a metadata operation, unlike deleting its rows
+        connection.execute(text(f"ALTER TABLE `{table}` DROP PARTITION `{name}`"))
+        dropped.append((name, count))
+    return dropped
+
+
+def purge_table(connection: Connection, table: str, keep_months: int, archive_dir: str) -> int:
+    """Archive rows older than the retention window and delete them by primary key chunks"""
+    key_column, date_column = PURGED_TABLES[table]
+    cutoff = datetime.combine(add_months(month_start(date.today()), -keep_months), datetime.min.time())
+    stamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
+    path = os.path.join(archive_dir, table, f"before-{cutoff:%Y%m}-{stamp}.ndjson.gz")
+    archived = archive_rows(
+        connection, f"SELECT * FROM `{table}` WHERE `{date_column}` < :cutoff", {"cutoff": cutoff}, path
+    )
+    if not archived:
+        os.remove(path)
+        return 0
+
+    deleted = 0
+    while True:
+        keys = [key for (key,) in connection.execute(text(
+            f"SELECT `{key_column}` FROM `{table}` WHERE `{date_column}` < :cutoff "
+            f"ORDER BY `{key_column}` LIMIT {PURGE_CHUNK}"
+        ), {"cutoff": cutoff})]
+        if not keys:
+            return deleted
+        # Re-check the date: a row touched since it was archived stays
+        connection.execute(text(
+            f"DELETE FROM `{table}` WHERE `{key_column}` IN :keys AND `{date_column}` < :cutoff"
+        ).bindparams(bindparam("keys", expanding=True)), {"keys": keys, "cutoff": cutoff})
+        connection.commit()
+        deleted += len(keys)
+
+
+def pruning_checks(cutoff: datetime) -> Dict[str, object]:
+    """Representative analytics queries on the partitioned tables"""
+    return {
+        "dashboard page views": select(func.count(ActivityEvent.event_id)).where(
+            ActivityEvent.event_type == 1, ActivityEvent.date_added >= cutoff
+        ),
+        "legacy popular pages": select(UserActivity.url, func.count(UserActivity.activity_id)).where(
+            UserActivity.date_added >= cutoff, UserActivity.event_type == "pageview"
+        ).group_by(UserActivity.url),
+        "dashboard cart adds": select(func.count(CartHistory.history_id)).where(
+            CartHistory.date_added >= cutoff, CartHistory.action == "add"
+        ),
+        "popular products": select(ProductView.product_id, func.count(ProductView.view_id)).where(
+            ProductView.date_added >= cutoff
+        ).group_by(ProductView.product_id),
+    }
+
+
+def explain_pruning(connection: Connection, days: int) -> bool:
+    """EXPLAIN each check and report the partitions it reads, False if one reads them all"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    all_pruned = True
+    for name, statement in pruning_checks(cutoff).items():
+        table = statement.get_final_froms()[0].name
+        partitions = list_partitions(connection, table)
+        compiled = statement.compile(dialect=connection.dialect)
+        plan = connection.exec_driver_sql("EXPLAIN " + str(compiled), compiled.params).mappings().all()
+        scanned = set()
+        for row in plan:
+            if row.get("partitions"):
+                scanned.update(row["partitions"].split(","))
+        pruned = bool(partitions) and len(scanned) < len(partitions)
+        all_pruned = all_pruned and (pruned or not partitions)
+        status = "pruned" if pruned else ("not partitioned" if not partitions else "ALL PARTITIONS")
+        print(f"{name}: {status}, reads {len(scanned)}/{len(partitions)} ({', '.join(sorted(scanned))})")
+    return all_pruned
+
+
+def rotate(keep_months: int, months_ahead: int, archive_dir: str):
+    """Create upcoming partitions, archive and drop expired ones, purge keyed tables"""
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            if not list_partitions(connection, table):
+                print(f"{table} is not partitioned, run convert first")
+                continue
+            added = add_future_partitions(connection, table, months_ahead)
+            dropped = drop_old_partitions(connection, table, keep_months, archive_dir)
+            connection.commit()
+            print(f"{table}: added {added} partitions, dropped "
+                  f"{', '.join(f'{name} ({count} rows)' for name, count in dropped) or 'none'}")
+        for table in PURGED_TABLES:
+            deleted = purge_table(connection, table, keep_months, archive_dir)
+            print(f"{table}: archived and deleted {deleted} rows")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly partitions and retention for tracking tables")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="partition existing tables (rebuilds them)")
+    convert_parser.add_argument("tables", nargs="*", default=list(PARTITIONED_TABLES))
+    subparsers.add_parser("rotate", help="add future partitions, archive and drop expired data (run daily)")
+    explain_parser = subparsers.add_parser("explain", help="check that analytics queries prune partitions")
+    explain_parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        with engine.connect() as connection:
+            for table in args.tables:
+                convert_table(connection, table, settings.PARTITION_MONTHS_AHEAD)
+                connection.commit()
+    elif args.command == "rotate":
+        rotate(settings.TRACKING_RETENTION_MONTHS, settings.PARTITION_MONTHS_AHEAD, settings.ARCHIVE_DIR)
+    else:
+        with engine.connect() as connection:
+            if not explain_pruning(connection, args.days):
+                raise SystemExit("some analytics queries read every partition")
@@ -0,0 +1,121 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.product import Product
+
+# Identifier columns of oc_product that can be looked up exactly
+IDENTIFIER_FIELDS = ("model", "sku", "upc", "ean", "jan", "isbn", "mpn")
+
+# GTIN style barcodes (UPC-A, EAN-13, JAN) are the same number with different
+# zero padding, so a scanner may report either form
+GTIN_FIELDS = ("upc", "ean", "jan")
+
+
+def normalize_code(code: Optional[str], field: str) -> str:
+    """Normalize an identifier so that scanner and catalog spellings match"""
+    if not code:
+        return ""
+    key = code.strip().upper()
+    if field in GTIN_FIELDS or field == "isbn":
+        key = key.replace("-", "").replace(" ", "")
+    if field in GTIN_FIELDS:
+        key = key.lstrip("0")
+    return key
+
+
+class ProductIdentifierIndex:
+    """
+    Hash index from normalized identifier to product IDs, one map per column.
+
+    The index is built lazily on first use, refreshed per product by the
+    product write endpoints and fully rebuilt after PRODUCT_LOOKUP_TTL seconds
+    so that writes made by other workers are eventually picked up.
+    """
+
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fields: Dict[str, Dict[str, Set[int]]] = {}
+        self._entries: Dict[int, List[Tuple[str, str]]] = {}
+        self._built_at: Optional[float] = None
+
+    def _is_stale(self) -> bool:
+        return self._built_at is None or time.monotonic() - self._built_at > self.ttl
+
+    def _add(self, fields, entries, product_id: int, values: Iterable[Optional[str]]):
+        keys = []
+        for field, value in zip(IDENTIFIER_FIELDS, values):
+            key = normalize_code(value, field)
+            if key:
+                fields[field].setdefault(key, set()).add(product_id)
+                keys.append((field, key))
+        entries[product_id] = keys
+
+    def _discard(self, product_id: int):
+        for field, key in self._entries.pop(product_id, []):
+            ids = self._fields[field].get(key)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._fields[field][key]
+
+    def rebuild(self, db: Session):
+        """Load every product identifier and atomically swap in the new maps"""
+        fields = {field: {} for field in IDENTIFIER_FIELDS}
+        entries = {}
+        rows = db.query(
+            Product.product_id,
+            *[getattr(Product, field) for field in IDENTIFIER_FIELDS]
+        ).yield_per(5000)
+        for row in rows:
+            self._add(fields, entries, row[0], row[1:])
+
+        with self._lock:
+            self._fields = fields
+            self._entries = entries
+            self._built_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session):
+        if self._is_stale():
+            self.rebuild(db)
+
+    def refresh_product(self, db: Session, product_id: int):
+        """Re-index a single product after it was created or updated"""
+        if self._built_at is None:
+            return  # Nothing built yet, the next lookup loads everything
+        row = db.query(
+            *[getattr(Product, field) for field in IDENTIFIER_FIELDS]
+        ).filter(Product.product_id == product_id).first()
+
+        with self._lock:
+            self._discard(product_id)
+            if row:
+                self._add(self._fields, self._entries, product_id, row)
+
+    def remove_product(self, product_id: int):
+        """Drop a deleted product from the index"""
+        with self._lock:
+            if self._built_at is not None:
+                self._discard(product_id)
+
+    def lookup(self, code: str, field: Optional[str] = None) -> List[Tuple[str, int]]:
+        """Return (field, product_id) pairs whose identifier equals the code"""
+        fields = (field,) if field else IDENTIFIER_FIELDS
+        matches = []
+        with self._lock:
+            for name in fields:
+                key = normalize_code(code, name)
+                for product_id in self._fields.get(name, {}).get(key, ()):
+                    matches.append((name, product_id))
+        return matches
+
+    def lookup_many(self, codes: Iterable[str], field: Optional[str] = None) -> Dict[str, List[Tuple[str, int]]]:
+        """Resolve many codes at once, keyed by the code as given"""
+        return {code: self.lookup(code, field) for code in codes}
+
+
+product_identifier_index = ProductIdentifierIndex(ttl=settings.PRODUCT_LOOKUP_TTL)
@@ -0,0 +1,358 @@
+import argparse
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import Base, SessionLocal, engine
+from app.models.analytics import ProductView, ProductRecommendation
+from app.models.order import Order, OrderProduct
+
+# Distinct products counted per session or order, longer baskets are
+# usually crawlers and would add a quadratic number of pairs
+MAX_GROUP_ITEMS = 50
+
+# Pairs seen together fewer times than this are treated as noise
+MIN_CO_COUNT = 2
+
+# Finished groups resolved together when looking up items seen in earlier runs
+GROUP_BATCH = 1000
+
+PAIR_SHIFT = 32
+PAIR_MASK = (1 << PAIR_SHIFT) - 1
+
+
+def pair_key(a: int, b: int) -> int:
+    """Pack an unordered product pair into one integer key"""
+    if a > b:
+        a, b = b, a
+    return (a << PAIR_SHIFT) | b
+
+
+class CoOccurrenceSource:
+    """Rows of (row_id, group, product_id), e.g. views grouped by session"""
+
+    def __init__(self, kind: str, model, row_id, group, product_id, filters=(), joins=()):
+        self.kind = kind
+        self.model = model
+        self.row_id = row_id
+        self.group = group
+        self.product_id = product_id
+        self.filters = filters
+        self.joins = joins
+
+    def _query(self, db: Session, *columns):
+        query = db.query(*columns)
+        for target, condition in self.joins:
+            query = query.join(target, condition)
+        return query.filter(*self.filters)
+
+    def rows(self, db: Session, after_id: int, chunk_size: int,
+             up_to_id: Optional[int] = None) -> Iterator[Tuple[int, object, int]]:
+        """New rows ordered by group, streamed from a server-side cursor"""
+        query = self._query(db, self.row_id, self.group, self.product_id).filter(self.row_id > after_id)
+        if up_to_id is not None:
+            query = query.filter(self.row_id <= up_to_id)
+        return query.order_by(self.group, self.row_id).yield_per(chunk_size)
+
+    def previous_items(self, db: Session, groups: List[object], up_to_id: int) -> Dict[object, Set[int]]:
+        """Products each group already contributed in earlier runs"""
+        items: Dict[object, Set[int]] = {}
+        rows = self._query(db, self.group, self.product_id).filter(
+            self.group.in_(groups),
+            self.row_id <= up_to_id
+        )
+        for group, product_id in rows:
+            items.setdefault(group, set()).add(product_id)
+        return items
+
+
+SOURCES = {
+    "co_view": CoOccurrenceSource(
+        "co_view", ProductView, ProductView.view_id, ProductView.session_id, ProductView.product_id
+    ),
+    "co_purchase": CoOccurrenceSource(
+        "co_purchase", OrderProduct, OrderProduct.order_product_id, OrderProduct.order_id, OrderProduct.product_id,
+        filters=(Order.order_status_id > 0,),  # Status 0 marks abandoned checkouts in OpenCart
+        joins=((Order, Order.order_id == OrderProduct.order_id),)
+    ),
+}
+
+
+class CoOccurrenceCounts:
+    """
+    Item and pair counters that survive between runs.
+
+    Counts are kept in plain int -> int dicts while accumulating and saved as
+    NumPy arrays together with the last processed row id, so a daily run
+    only reads rows added since the previous one.
+    """
+
+    def __init__(self):
+        self.items: Dict[int, int] = {}
+        self.pairs: Dict[int, int] = {}
+        self.watermark = 0
+
+    @classmethod
+    def load(cls, path: str) -> "CoOccurrenceCounts":
+        counts = cls()
+        if os.path.exists(path):
+            with np.load(path) as data:
+                counts.items = dict(zip(data["item_ids"].tolist(), data["item_counts"].tolist()))
+                counts.pairs = dict(zip(data["pair_keys"].tolist(), data["pair_counts"].tolist()))
+                counts.watermark = int(data["watermark"])
+        return counts
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                f,
+                item_ids=np.fromiter(self.items.keys(), dtype=np.int64, count=len(self.items)),
+                item_counts=np.fromiter(self.items.values(), dtype=np.int64, count=len(self.items)),
+                pair_keys=np.fromiter(self.pairs.keys(), dtype=np.int64, count=len(self.pairs)),
+                pair_counts=np.fromiter(self.pairs.values(), dtype=np.int64, count=len(self.pairs)),
+                watermark=np.int64(self.watermark)
+            )
+        os.replace(temp_path, path)
+
+    def add_group(self, new_items: Set[int], old_items: Set[int]):
+        """Count a group's new products against each other and its earlier products"""
+        new_items = new_items - old_items
+        if not new_items:
+            return
+        items, pairs = self.items, self.pairs
+        for product_id in new_items:
+            items[product_id] = items.get(product_id, 0) + 1
+        for a, b in combinations(new_items, 2):
+            key = pair_key(a, b)
+            pairs[key] = pairs.get(key, 0) + 1
+        for a in new_items:
+            for b in old_items:
+                key = pair_key(a, b)
+                pairs[key] = pairs.get(key, 0) + 1
+
+
+def accumulate(db: Session, source: CoOccurrenceSource, counts: CoOccurrenceCounts, chunk_size: int,
+               up_to_id: Optional[int] = None) -> int:
+    """
+    Stream rows added since the last run into the counters, returns rows read.
+
+    Earlier items are looked up on a connection of their own: a query on
+    `db` while its server-side cursor is open would consume the rest of
+    the unbuffered result.
+    """
+    previous_watermark = counts.watermark
+    pending: List[Tuple[object, Set[int]]] = []
+    rows_read = 0
+    lookup_db = SessionLocal() if previous_watermark else None
+
+    def flush():
+        old = source.previous_items(lookup_db, [group for group, _ in pending], previous_watermark) if lookup_db else {}
+        for group, items in pending:
+            old_items = old.get(group, set())
+            room = MAX_GROUP_ITEMS - len(old_items)
+            if room > 0:
+                counts.add_group(set(sorted(items)[:room]), old_items)
+        pending.clear()
+
+    current_group = None
+    current_items: Set[int] = set()
+    try:
+        for row_id, group, product_id in source.rows(db, previous_watermark, chunk_size, up_to_id):
+            rows_read += 1
+            counts.watermark = max(counts.watermark, row_id)
+            if group != current_group:
+                if current_items:
+                    pending.append((current_group, current_items))
+                    if len(pending) >= GROUP_BATCH:
+                        flush()
+                current_group, current_items = group, set()
+            current_items.add(product_id)
+        if current_items:
+            pending.append((current_group, current_items))
+        if pending:
+            flush()
+    finally:
+        if lookup_db is not None:
+            lookup_db.close()
+    return rows_read
+
+
+def check_incremental(db: Session, kind: str, chunk_size: int) -> dict:
+    """
+    Counters built by a run up to the middle row id followed by an
+    incremental run, compared with a full rebuild. Groups with more than
+    MAX_GROUP_ITEMS products may legitimately differ.
+    """
+    source = SOURCES[kind]
+    full = CoOccurrenceCounts()
+    accumulate(db, source, full, chunk_size)
+    split = full.watermark // 2
+    incremental = CoOccurrenceCounts()
+    first_rows = accumulate(db, source, incremental, chunk_size, up_to_id=split)
+    incremental.watermark = max(incremental.watermark, split)
+    second_rows = accumulate(db, source, incremental, chunk_size)
+    item_diff = sum(1 for key in full.items.keys() | incremental.items.keys()
+                    if full.items.get(key) != incremental.items.get(key))
+    pair_diff = sum(1 for key in full.pairs.keys() | incremental.pairs.keys()
+                    if full.pairs.get(key) != incremental.pairs.get(key))
+    return {"kind": kind, "split_id": split, "rows": (first_rows, second_rows),
+            "items_differing": item_diff, "pairs_differing": pair_diff}
+
+
+def top_k_recommendations(counts: CoOccurrenceCounts, top_k: int) -> Iterator[Tuple[int, int, float, int]]:
+    """(product_id, related_id, score, co_count) with cosine normalized scores"""
+    if not counts.pairs:
+        return iter(())
+    keys = np.fromiter(counts.pairs.keys(), dtype=np.int64, count=len(counts.pairs))
+    co = np.fromiter(counts.pairs.values(), dtype=np.int64, count=len(counts.pairs))
+    keep = co >= MIN_CO_COUNT
+    keys, co = keys[keep], co[keep]
+    a = keys >> PAIR_SHIFT
+    b = keys & PAIR_MASK
+
+    item_ids = np.fromiter(counts.items.keys(), dtype=np.int64, count=len(counts.items))
+    item_counts = np.fromiter(counts.items.values(), dtype=np.float64, count=len(counts.items))
+    order = np.argsort(item_ids)
+    item_ids, item_counts = item_ids[order], item_counts[order]
+    count_a = item_counts[np.searchsorted(item_ids, a)]
+    count_b = item_counts[np.searchsorted(item_ids, b)]
+    score = co / np.sqrt(count_a * count_b)
+
+    # Both directions of every pair, then the best K per source product
+    source = np.concatenate([a, b])
+    target = np.concatenate([b, a])
+    score = np.concatenate([score, score])
+    co = np.concatenate([co, co])
+    order = np.lexsort((-score, source))
+    source, target, score, co = source[order], target[order], score[order], co[order]
+    group_start = np.concatenate([[0], np.flatnonzero(np.diff(source)) + 1])
+    rank = np.arange(len(source)) - np.repeat(group_start, np.diff(np.append(group_start, len(source))))
+    keep = rank < top_k
+    return zip(source[keep].tolist(), target[keep].tolist(), score[keep].tolist(), co[keep].tolist())
+
+
+def state_path(kind: str) -> str:
+    return os.path.join(settings.DATA_DIR, f"co_occurrence_{kind}.npz")
+
+
+def update_recommendations(db: Session, kind: str, top_k: int, chunk_size: int = 10000, full: bool = False) -> dict:
+    """Fold new rows into the saved counters and replace the stored top-K lists"""
+    source = SOURCES[kind]
+    counts = CoOccurrenceCounts() if full else CoOccurrenceCounts.load(state_path(kind))
+    rows_read = accumulate(db, source, counts, chunk_size)
+
+    now = datetime.utcnow()
+    db.execute(delete(ProductRecommendation).where(ProductRecommendation.kind == kind))
+    batch = []
+    stored = 0
+    for product_id, related_id, score, co_count in top_k_recommendations(counts, top_k):
+        batch.append({
+            "product_id": product_id,
+            "kind": kind,
+            "related_id": related_id,
+            "score": score,
+            "co_count": co_count,
+            "date_modified": now
+        })
+        if len(batch) >= 5000:
+            db.execute(insert(ProductRecommendation), batch)
+            stored += len(batch)
+            batch = []
+    if batch:
+        db.execute(insert(ProductRecommendation), batch)
+        stored += len(batch)
+    db.commit()
+
+    # Saved after the commit: a failed run is simply repeated from the old state
+    counts.save(state_path(kind))
+    return {"kind": kind, "rows_read": rows_read, "products": len(counts.items),
+            "pairs": len(counts.pairs), "recommendations": stored}
+
+
+class RecommendationStore:
+    """In-memory copy of api_product_recommendation, reloaded periodically"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data: Dict[Tuple[str, int], Tuple[array, array]] = {}
+        self._loaded_at: Optional[float] = None
+
+    def _load(self):
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                ProductRecommendation.kind,
+                ProductRecommendation.product_id,
+                ProductRecommendation.related_id,
+                ProductRecommendation.score
+            ).order_by(
+                ProductRecommendation.kind,
+                ProductRecommendation.product_id,
+                ProductRecommendation.score.desc()
+            ).yield_per(20000)
+            data = {}
+            for kind, product_id, related_id, score in rows:
+                entry = data.get((kind, product_id))
+                if entry is None:
+                    entry = data[(kind, product_id)] = (array("i"), array("f"))
+                entry[0].append(related_id)
+                entry[1].append(score)
+        finally:
+            db.close()
+        self._data = data
+        self._loaded_at = time.monotonic()
+
+    def get(self, kind: str, product_id: int, limit: int) -> List[Tuple[int, float]]:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                    self._load()
+        entry = self._data.get((kind, product_id))
+        if entry is None:
+            return []
+        return list(zip(entry[0][:limit], entry[1][:limit]))
+
+
+recommendation_store = RecommendationStore(ttl=settings.RECOMMENDATIONS_RELOAD)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Co-view and co-purchase recommendations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="create api_product_recommendation")
+    update_parser = subparsers.add_parser("update", help="update the stored recommendations")
+    update_parser.add_argument("--kind", choices=[*SOURCES, "all"], default="all")
+    update_parser.add_argument("--top-k", type=int, default=settings.RECOMMENDATIONS_TOP_K)
+    update_parser.add_argument("--chunk-size", type=int, default=10000, help="rows fetched per round trip")
+    update_parser.add_argument("--full", action="store_true", help="discard saved counters and reprocess all history")
+    update_parser.add_argument("--check", action="store_true",
+                               help="compare an incremental run with a full rebuild, nothing is stored")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        Base.metadata.create_all(engine, tables=[ProductRecommendation.__table__])
+        print("Created recommendation table")
+    else:
+        for kind in (SOURCES if args.kind == "all" else [args.kind]):
+            started = time.perf_counter()
+            db = SessionLocal()
+            try:
+                if args.check:
+                    result = check_incremental(db, kind, args.chunk_size)
+                else:
+                    result = update_recommendations(db, kind, args.top_k, args.chunk_size, args.full)
+            finally:
+                db.close()
+            print(f"{result} in {time.perf_counter() - started:.1f}s")
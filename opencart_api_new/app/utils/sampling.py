@@ -0,0 +1,78 @@
+import argparse
+import zlib
+from collections import Counter
+from typing import Dict
+
+from app.config import settings
+
+HASH_RANGE = 2 ** 32
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """Rates from "pageview=0.1,search=0.5", event types not listed keep every event"""
+    rates = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            event_type, rate = item.split("=")
+            rates[event_type.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError as e:
+            print(f"Error parsing sample rate {item!r}: {e}")
+    return rates
+
+
+class EventSampler:
+    """
+    Per event type sampling of stored activity events.
+
+    The decision is a hash of (session id, event type), so a session keeps
+    all or none of its events of a type and funnels within it stay whole.
+    Kept events store 1 / rate as their weight, which analytics sum instead
+    of counting rows.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        self.rates = rates
+        # Integer thresholds, compared with the crc32 of the key
+        self._thresholds = {event_type: int(rate * HASH_RANGE) for event_type, rate in rates.items()}
+
+    def weight(self, session_id: str, event_type: str) -> float:
+        """Sample weight of the event, 0 when it is not stored"""
+        threshold = self._thresholds.get(event_type)
+        if threshold is None or threshold >= HASH_RANGE:
+            return 1.0
+        if zlib.crc32(f"{session_id}:{event_type}".encode()) >= threshold:
+            return 0.0
+        return 1.0 / self.rates[event_type]
+
+
+event_sampler = EventSampler(parse_rates(settings.EVENT_SAMPLE_RATES))
+
+
+if __name__ == "__main__":
+    # Check that weighted counts of sampled sessions match the true counts
+    parser = argparse.ArgumentParser(description="Simulate event sampling")
+    parser.add_argument("--rates", default="pageview=0.1,search=0.5")
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--events-per-session", type=int, default=8)
+    args = parser.parse_args()
+
+    sampler = EventSampler(parse_rates(args.rates))
+    event_types = list(sampler.rates) + ["add_to_cart"]
+    true_counts = Counter()
+    stored = Counter()
+    estimated = Counter()
+    for session in range(args.sessions):
+        session_id = f"session-{session}"
+        for i in range(args.events_per_session):
+            event_type = event_types[(session + i) % len(event_types)]
+            true_counts[event_type] += 1
+            weight = sampler.weight(session_id, event_type)
+            if weight:
+                stored[event_type] += 1
+                estimated[event_type] += weight
+    for event_type in event_types:
+        error = (estimated[event_type] - true_counts[event_type]) / true_counts[event_type]
+        print(f"{event_type}: {true_counts[event_type]} events, {stored[event_type]} stored, "
+              f"estimate {estimated[event_type]:.0f} ({error:+.2%})")
@@ -0,0 +1,204 @@
+import heapq
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.analytics import SearchQuery
+from app.models.product import Product, ProductDescription
+from app.utils.background import PeriodicJob
+
+WHITESPACE = re.compile(r"\s+")
+
+# Suggestions kept per trie node, i.e. the largest page a query can return
+MAX_SUGGESTIONS = 10
+
+# Product names are also reachable from the start of each of their first words
+MAX_NAME_WORDS = 6
+
+
+def normalize_query(text: str) -> str:
+    return WHITESPACE.sub(" ", text.strip().lower())
+
+
+class _Node:
+    __slots__ = ("children", "terms", "top")
+
+    def __init__(self):
+        self.children: Dict[str, Tuple[str, "_Node"]] = {}  # first char -> (edge label, child)
+        self.terms: List[int] = []
+        self.top: Tuple[int, ...] = ()
+
+
+class SuggestionTrie:
+    """
+    Compressed (radix) prefix trie with the best suggestions precomputed per node.
+
+    Answering a prefix is a walk down at most len(prefix) characters followed
+    by a slice of the node's ranked term list, so lookups cost microseconds
+    regardless of catalog size.
+    """
+
+    def __init__(self, terms: List[dict]):
+        # terms: dicts with text, type, score and optional product_id
+        self.terms = terms
+        self.root = _Node()
+        for term_id, term in enumerate(terms):
+            for key in self._keys(term):
+                self._insert(key, term_id)
+        self._rank()
+
+    @staticmethod
+    def _keys(term: dict) -> List[str]:
+        key = normalize_query(term["text"])
+        if term["type"] != "product":
+            return [key]
+        words = key.split(" ")
+        return [" ".join(words[i:]) for i in range(min(len(words), MAX_NAME_WORDS))]
+
+    def _insert(self, key: str, term_id: int):
+        node = self.root
+        i = 0
+        while i < len(key):
+            edge = node.children.get(key[i])
+            if edge is None:
+                leaf = _Node()
+                node.children[key[i]] = (key[i:], leaf)
+                node = leaf
+                break
+            label, child = edge
+            j = 0
+            end = min(len(label), len(key) - i)
+            while j < end and label[j] == key[i + j]:
+                j += 1
+            if j < len(label):
+                # Split the edge at the first differing character
+                middle = _Node()
+                middle.children[label[j]] = (label[j:], child)
+                node.children[key[i]] = (label[:j], middle)
+                child = middle
+            node = child
+            i += j
+        node.terms.append(term_id)
+
+    def _rank(self):
+        score = lambda term_id: self.terms[term_id]["score"]
+        # Post-order traversal without recursion, long names make deep tries
+        stack = [(self.root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend((child, False) for _, child in node.children.values())
+                continue
+            candidates = set(node.terms)
+            for _, child in node.children.values():
+                candidates.update(child.top)
+            node.top = tuple(heapq.nlargest(MAX_SUGGESTIONS, candidates, key=score))
+
+    def suggest(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[dict]:
+        prefix = normalize_query(prefix)
+        node = self.root
+        i = 0
+        while i < len(prefix):
+            edge = node.children.get(prefix[i])
+            if edge is None:
+                return []
+            label, child = edge
+            rest = prefix[i:]
+            if rest.startswith(label):
+                i += len(label)
+            elif not label.startswith(rest):
+                return []
+            else:
+                i = len(prefix)
+            node = child
+        return [self.terms[term_id] for term_id in node.top[:limit]]
+
+
+def load_suggestion_terms(db: Session) -> List[dict]:
+    """Collect product names and frequent successful search keywords"""
+    terms = []
+    products = db.query(
+        Product.product_id,
+        ProductDescription.name,
+        Product.viewed
+    ).join(
+        ProductDescription, Product.product_id == ProductDescription.product_id
+    ).filter(
+        ProductDescription.language_id == 1,  # Default language
+        Product.status == True
+    ).yield_per(5000)
+    for product_id, name, viewed in products:
+        if name:
+            terms.append({
+                "text": name,
+                "type": "product",
+                "product_id": product_id,
+                "score": (viewed or 0) + 1
+            })
+
+    cutoff_date = datetime.utcnow() - timedelta(days=settings.SEARCH_SUGGEST_QUERY_DAYS)
+    keyword = func.lower(func.trim(SearchQuery.keyword))
+    popular_searches = db.query(
+        keyword.label("keyword"),
+        func.count(SearchQuery.search_id).label("count")
+    ).filter(
+        SearchQuery.date_added >= cutoff_date,
+        SearchQuery.results_count > 0
+    ).group_by(keyword).order_by(
+        func.count(SearchQuery.search_id).desc()
+    ).limit(settings.SEARCH_SUGGEST_MAX_QUERIES).all()
+    for keyword, count in popular_searches:
+        if keyword:
+            terms.append({
+                "text": keyword,
+                "type": "query",
+                "product_id": None,
+                "score": count
+            })
+    return terms
+
+
+class SuggestionIndex:
+    """Holds the current trie and swaps in a freshly built one on rebuild"""
+
+    def __init__(self):
+        self._trie: Optional[SuggestionTrie] = None
+        self._build_lock = threading.Lock()
+        self.built_at: Optional[datetime] = None
+
+    def _build(self):
+        db = SessionLocal()
+        try:
+            terms = load_suggestion_terms(db)
+        finally:
+            db.close()
+        self._trie = SuggestionTrie(terms)
+        self.built_at = datetime.utcnow()
+
+    def rebuild(self):
+        with self._build_lock:
+            self._build()
+
+    def suggest(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[dict]:
+        if self._trie is None:
+            # First request before the background job finished its first build
+            with self._build_lock:
+                if self._trie is None:
+                    self._build()
+        return self._trie.suggest(prefix, limit)
+
+
+suggestion_index = SuggestionIndex()
+
+suggestion_index_job = PeriodicJob(
+    "search-suggest-rebuild",
+    suggestion_index.rebuild,
+    interval=settings.SEARCH_SUGGEST_REFRESH
+)
@@ -0,0 +1,164 @@
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import update
+
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.models.analytics import ActivityEvent, ProductView, SearchQuery, SessionKey, SessionTracking, UserActivity
+from app.models.enhanced_cart import CartHistory
+from app.utils.background import PeriodicJob
+
+# Guest history tables keyed by the session cookie
+SESSION_TABLES = (UserActivity, ProductView, CartHistory, SearchQuery)
+
+# Seconds a login waits before stitching, so events still in the beacon
+# buffer, the event spool or the product view counter are written first
+STITCH_DELAY = 60
+
+
+def stitch_statements(session_id: str, session_key: int, customer_id: int) -> List[Tuple[str, object]]:
+    """(table name, UPDATE) filling customer_id on the guest rows of one session"""
+    statements = [
+        (model.__tablename__, update(model.__table__).where(
+            model.__table__.c.session_id == session_id,
+            model.__table__.c.customer_id.is_(None)
+        ).values(customer_id=customer_id))
+        for model in SESSION_TABLES
+    ]
+    if session_key is not None:
+        statements.append((ActivityEvent.__tablename__, update(ActivityEvent.__table__).where(
+            ActivityEvent.__table__.c.session_key == session_key,
+            ActivityEvent.__table__.c.customer_id.is_(None)
+        ).values(customer_id=customer_id)))
+    statements.append((SessionTracking.__tablename__, update(SessionTracking.__table__).where(
+        SessionTracking.__table__.c.session_id == session_id,
+        SessionTracking.__table__.c.customer_id.is_(None)
+    ).values(customer_id=customer_id)))
+    return statements
+
+
+class SessionStitcher:
+    """
+    Backfills customer_id on the guest history of sessions that logged in.
+
+    Logins only queue the session; the stitch job runs the UPDATEs off the
+    request path, `chunk_size` rows per statement and transaction with a
+    pause in between, so no statement holds row locks for long. Rows that
+    already carry a customer_id are never touched, which makes a stitch
+    safe to repeat.
+    """
+
+    def __init__(self, chunk_size: int, pause: float):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._lock = threading.Lock()
+        self._pending: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.stitched_sessions = 0
+        self.updated_rows: Dict[str, int] = {}
+
+    def enqueue(self, session_id: str, customer_id: int):
+        if not session_id or not customer_id:
+            return
+        with self._lock:
+            self._pending[session_id] = (customer_id, time.time() + STITCH_DELAY)
+            self._pending.move_to_end(session_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def _take_due(self, now: float) -> List[Tuple[str, int]]:
+        with self._lock:
+            due = [(session_id, customer_id) for session_id, (customer_id, at) in self._pending.items() if at <= now]
+            for session_id, _ in due:
+                del self._pending[session_id]
+            return due
+
+    def stitch(self, db, session_id: str, customer_id: int) -> int:
+        """Run the chunked UPDATEs for one session, committing after each chunk"""
+        session_key = db.query(SessionKey.session_key).filter(SessionKey.session_id == session_id).scalar()
+        total = 0
+        for table, statement in stitch_statements(session_id, session_key, customer_id):
+            statement = statement.with_dialect_options(mysql_limit=self.chunk_size)
+            while True:
+                count = db.execute(statement).rowcount
+                db.commit()
+                total += count
+                self.updated_rows[table] = self.updated_rows.get(table, 0) + count
+                if count < self.chunk_size:
+                    break
+                time.sleep(self.pause)
+        self.stitched_sessions += 1
+        return total
+
+    def run(self, force: bool = False):
+        due = self._take_due(float("inf") if force else time.time())
+        if not due:
+            return
+        db = SessionLocal()
+        try:
+            for i, (session_id, customer_id) in enumerate(due):
+                try:
+                    self.stitch(db, session_id, customer_id)
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error stitching session {session_id}: {e}")
+                    # Keep the rest for the next run
+                    for later_id, later_customer in due[i + 1:]:
+                        self.enqueue(later_id, later_customer)
+                    return
+                time.sleep(self.pause)
+        finally:
+            db.close()
+
+
+session_stitcher = SessionStitcher(settings.STITCH_CHUNK, settings.STITCH_PAUSE)
+
+session_stitch_job = PeriodicJob(
+    "session-stitch",
+    session_stitcher.run,
+    interval=settings.STITCH_INTERVAL,
+    run_on_start=False
+)
+
+
+def create_session_indexes():
+    """The stitch UPDATEs look rows up by session_id, index it where it is missing"""
+    for model in SESSION_TABLES:
+        for index in model.__table__.indexes:
+            if "session_id" in index.columns:
+                index.create(engine, checkfirst=True)
+                print(f"Checked {index.name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stitch guest history to customers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("migrate", help="index session_id on the guest history tables")
+    backfill_parser = subparsers.add_parser("backfill", help="stitch every session that has a customer_id")
+    backfill_parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        create_session_indexes()
+    else:
+        db = SessionLocal()
+        try:
+            query = db.query(SessionTracking.session_id, SessionTracking.customer_id).filter(
+                SessionTracking.customer_id > 0
+            ).order_by(SessionTracking.session_id)
+            if args.limit:
+                query = query.limit(args.limit)
+            sessions = query.all()
+        finally:
+            db.close()
+        for session_id, customer_id in sessions:
+            session_stitcher.enqueue(session_id, customer_id)
+        started = time.perf_counter()
+        session_stitcher.run(force=True)
+        print(f"Stitched {session_stitcher.stitched_sessions} sessions in {time.perf_counter() - started:.1f}s: "
+              + ", ".join(f"{table} {count}" for table, count in session_stitcher.updated_rows.items()))
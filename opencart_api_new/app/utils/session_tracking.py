@@ -0,0 +1,164 @@
+import argparse
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.analytics import SessionTracking
+
+# Session ids this worker has already written, repeat hits skip the insert payload
+KNOWN_SESSIONS_CAPACITY = 100000
+
+
+class KnownSessions:
+    """Bounded LRU set of session ids that exist in api_session"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._ids:
+                self._ids.move_to_end(session_id)
+                return True
+            return False
+
+    def add(self, session_id: str):
+        with self._lock:
+            self._ids[session_id] = None
+            self._ids.move_to_end(session_id)
+            if len(self._ids) > self.capacity:
+                self._ids.popitem(last=False)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._ids.pop(session_id, None)
+
+
+known_sessions = KnownSessions(KNOWN_SESSIONS_CAPACITY)
+
+
+def _hit_assignments(now: datetime, customer_id: Optional[int], user_type: str) -> list:
+    """
+    SET clauses applied to an existing session on every hit. MySQL evaluates
+    them left to right, so user_type is decided from the old customer_id
+    before customer_id itself is filled in.
+    """
+    table = SessionTracking.__table__
+    assignments = []
+    if customer_id:
+        # Associate the session with the customer once they log in
+        assignments.append(("user_type", case(
+            (table.c.customer_id.is_(None), user_type),
+            else_=table.c.user_type
+        )))
+        assignments.append(("customer_id", func.coalesce(table.c.customer_id, customer_id)))
+    assignments.append(("visit_count", table.c.visit_count + 1))
+    assignments.append(("last_activity", now))
+    return assignments
+
+
+def touch_session(db: Session, session_id: str, customer_id: Optional[int], user_type: str, **details):
+    """
+    Count a hit on a session in a single statement.
+
+    Unknown sessions go through INSERT ... ON DUPLICATE KEY UPDATE carrying
+    the full first-visit payload (`details`: ip_address, user_agent, geo,
+    device and UTM columns). Sessions this worker has seen before take a
+    plain UPDATE of the counters, falling back to the upsert if the row is
+    gone. Either way concurrent hits never lose an increment.
+    Does not commit.
+    """
+    now = datetime.utcnow()
+    customer_id = customer_id or None
+    assignments = _hit_assignments(now, customer_id, user_type)
+
+    if session_id in known_sessions:
+        result = db.execute(
+            update(SessionTracking.__table__)
+            .where(SessionTracking.__table__.c.session_id == session_id)
+            .ordered_values(*assignments)
+        )
+        if result.rowcount:
+            return
+        known_sessions.discard(session_id)
+
+    statement = insert(SessionTracking.__table__).values(
+        session_id=session_id,
+        customer_id=customer_id,
+        user_type=user_type,
+        first_visit=now,
+        last_activity=now,
+        visit_count=1,
+        **details
+    ).on_duplicate_key_update(assignments)
+    db.execute(statement)
+    known_sessions.add(session_id)
+
+
+def merge_sessions(db: Session, rows: List[Dict]):
+    """
+    Fold pre-aggregated hits into api_session with one executemany upsert.
+    Each row carries a full first-visit payload and the number of hits in
+    visit_count. Does not commit.
+    """
+    if not rows:
+        return
+    table = SessionTracking.__table__
+    statement = insert(table)
+    statement = statement.on_duplicate_key_update([
+        ("user_type", case(
+            (table.c.customer_id.is_(None) & statement.inserted.customer_id.isnot(None), statement.inserted.user_type),
+            else_=table.c.user_type
+        )),
+        ("customer_id", func.coalesce(table.c.customer_id, statement.inserted.customer_id)),
+        ("visit_count", table.c.visit_count + statement.inserted.visit_count),
+        ("last_activity", func.greatest(table.c.last_activity, statement.inserted.last_activity)),
+    ])
+    db.execute(statement, rows)
+
+
+if __name__ == "__main__":
+    # Hammer one session from many connections and check no increment was lost
+    parser = argparse.ArgumentParser(description="Concurrent session tracking check")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--hits", type=int, default=200, help="hits per thread")
+    args = parser.parse_args()
+
+    session_id = uuid.uuid4().hex
+
+    def hit_session(_):
+        for _ in range(args.hits):
+            db = SessionLocal()
+            try:
+                touch_session(db, session_id, None, "guest", ip_address="127.0.0.1")
+                db.commit()
+            finally:
+                db.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        list(pool.map(hit_session, range(args.threads)))
+    elapsed = time.perf_counter() - started
+
+    db = SessionLocal()
+    try:
+        visit_count = db.query(SessionTracking.visit_count).filter(SessionTracking.session_id == session_id).scalar()
+        db.query(SessionTracking).filter(SessionTracking.session_id == session_id).delete()
+        db.commit()
+    finally:
+        db.close()
+    expected = args.threads * args.hits
+    print(f"visit_count {visit_count}, expected {expected}, {expected / elapsed:.0f} hits/s")
+    if visit_count != expected:
+        raise SystemExit("lost increments")
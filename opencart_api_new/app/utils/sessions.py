@@ -0,0 +1,185 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.analytics import SessionTracking
+from app.models.enhanced_cart import EnhancedCart
+
+COOKIE_NAME = "session_id"
+
+# Unsigned UUID cookies issued before signing. Only ids with an api_session
+# row or a guest cart are adopted, until SESSION_LEGACY_UNTIL when set, and
+# re-signed so existing guest carts survive the switch. Signed ids are hex
+# without dashes and never match.
+LEGACY_SESSION_ID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+SIGNATURE_BYTES = 16
+
+
+class SessionData:
+    """The visitor session of a request, available as request.state.session"""
+
+    __slots__ = ("session_id", "customer_id", "created_at", "last_seen", "is_new", "needs_cookie")
+
+    def __init__(self, session_id: str, customer_id: Optional[int] = None, created_at: Optional[datetime] = None,
+                 is_new: bool = False):
+        self.session_id = session_id
+        self.customer_id = customer_id
+        self.created_at = created_at or datetime.utcnow()
+        self.last_seen = time.time()
+        self.is_new = is_new
+        self.needs_cookie = is_new
+
+
+class SessionStore:
+    """
+    Issues and verifies signed session cookies and keeps recently seen
+    sessions in an LRU of `capacity` entries. A valid cookie missing from
+    the LRU, e.g. after a restart or on another worker, is restored from
+    its api_session row.
+    """
+
+    def __init__(self, secret: str, capacity: int, legacy_until: Optional[datetime] = None):
+        self._key = hashlib.sha256(secret.encode()).digest()
+        self.capacity = capacity
+        self.legacy_until = legacy_until
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, SessionData]" = OrderedDict()
+        self.hits = 0
+        self.restored = 0
+        self.issued = 0
+        self.adopted = 0
+
+    def _signature(self, session_id: str) -> str:
+        digest = hmac.new(self._key, session_id.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def sign(self, session_id: str) -> str:
+        return f"{session_id}.{self._signature(session_id)}"
+
+    def unsign(self, cookie: Optional[str]) -> Optional[str]:
+        """Session id of a signed cookie value, None when missing, unsigned or forged"""
+        if not cookie:
+            return None
+        session_id, _, signature = cookie.rpartition(".")
+        if session_id and hmac.compare_digest(signature, self._signature(session_id)):
+            return session_id
+        return None
+
+    def _legacy_candidate(self, cookie: Optional[str]) -> bool:
+        if not cookie or not LEGACY_SESSION_ID.match(cookie):
+            return False
+        return self.legacy_until is None or datetime.utcnow() < self.legacy_until
+
+    def _remember(self, session: SessionData):
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+
+    def cached(self, cookie: Optional[str]) -> Optional[SessionData]:
+        """Session of a cookie if this worker has it in memory, without database access"""
+        session_id = self.unsign(cookie)
+        if session_id is None:
+            return None
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_seen = time.time()
+                session.is_new = False  # The client sent it back
+                self.hits += 1
+        return session
+
+    def load(self, cookie: Optional[str]) -> SessionData:
+        """
+        Session of a cookie, restored from api_session when not cached, or a
+        newly issued one when the cookie is missing or invalid. A legacy
+        unsigned cookie is adopted only when the database knows its id,
+        otherwise it counts as forged. Blocking.
+        """
+        session_id = self.unsign(cookie)
+        legacy = session_id is None and self._legacy_candidate(cookie)
+        if legacy:
+            session_id = cookie
+        elif session_id is None:
+            return self.issue()
+        else:
+            session = self.cached(cookie)
+            if session is not None:
+                return session
+        session = SessionData(session_id)
+        session.needs_cookie = legacy  # Re-sign adopted cookies
+        known = False
+        db = SessionLocal()
+        try:
+            row = db.query(SessionTracking.customer_id, SessionTracking.first_visit).filter(
+                SessionTracking.session_id == session_id
+            ).first()
+            if row is not None:
+                session.customer_id, session.created_at = row[0], row[1]
+                self.restored += 1
+                known = True
+            elif legacy:
+                known = db.query(EnhancedCart.cart_id).filter(
+                    EnhancedCart.session_id == session_id
+                ).limit(1).first() is not None
+        except Exception as e:
+            print(f"Error restoring session: {e}")
+        finally:
+            db.close()
+        if legacy and not known:
+            return self.issue()
+        if legacy:
+            self.adopted += 1
+        self._remember(session)
+        return session
+
+    def issue(self) -> SessionData:
+        session = SessionData(uuid.uuid4().hex, is_new=True)
+        self._remember(session)
+        self.issued += 1
+        return session
+
+    def bind_customer(self, session: SessionData, customer_id: int):
+        """Remember the customer a session logged in as"""
+        session.customer_id = customer_id
+        self._remember(session)
+
+
+session_store = SessionStore(
+    settings.SESSION_SECRET,
+    settings.SESSION_CACHE_SIZE,
+    datetime.fromisoformat(settings.SESSION_LEGACY_UNTIL) if settings.SESSION_LEGACY_UNTIL else None
+)
+
+
+if __name__ == "__main__":
+    # Cost of resolving a cookie from the LRU, the per-request overhead
+    parser = argparse.ArgumentParser(description="Benchmark the session store")
+    parser.add_argument("--sessions", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+
+    store = SessionStore("benchmark", args.sessions)
+    cookies = [store.sign(store.issue().session_id) for _ in range(args.sessions)]
+    started = time.perf_counter()
+    for i in range(args.lookups):
+        store.cached(cookies[i % len(cookies)])
+    elapsed = time.perf_counter() - started
+    print(f"{elapsed / args.lookups * 1e6:.2f}µs per cached lookup, {store.hits} hits")
+    started = time.perf_counter()
+    for i in range(args.lookups):
+        store.unsign(cookies[i % len(cookies)][:-1] + "A")
+    print(f"{(time.perf_counter() - started) / args.lookups * 1e6:.2f}µs to reject a forged cookie")
@@ -0,0 +1,218 @@
+import argparse
+import html
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.product import Product, ProductDescription, ProductToCategory
+
+TOKEN = re.compile(r"[a-z0-9]{2,}")
+HTML_TAG = re.compile(r"<[^>]+>")
+
+# Relative weight of each feature block in the combined product vector
+FIELD_WEIGHTS = {
+    "name": 1.0,
+    "tag": 0.7,
+    "description": 0.4,
+    "category": 0.6,
+}
+
+SIMILAR_PRODUCTS_FILE = "similar_products.npz"
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    # Descriptions are stored HTML-escaped by OpenCart
+    text = HTML_TAG.sub(" ", html.unescape(html.unescape(text)))
+    return TOKEN.findall(text.lower())
+
+
+def load_product_features(db: Session) -> Tuple[List[int], Dict[str, List[List[str]]]]:
+    """Tokens per field for every enabled product, rows in product_id order"""
+    documents = {}
+    rows = db.query(
+        ProductDescription.product_id,
+        ProductDescription.name,
+        ProductDescription.tag,
+        ProductDescription.description
+    ).join(
+        Product, Product.product_id == ProductDescription.product_id
+    ).filter(
+        ProductDescription.language_id == 1,  # Default language
+        Product.status == True
+    ).order_by(ProductDescription.product_id).yield_per(2000)
+    for product_id, name, tag, description in rows:
+        documents[product_id] = (tokenize(name), tokenize(tag), tokenize(description))
+
+    categories = defaultdict(list)
+    for product_id, category_id in db.query(ProductToCategory.product_id, ProductToCategory.category_id):
+        if product_id in documents:
+            categories[product_id].append(str(category_id))
+
+    product_ids = list(documents)
+    fields = {
+        "name": [documents[p][0] for p in product_ids],
+        "tag": [documents[p][1] for p in product_ids],
+        "description": [documents[p][2] for p in product_ids],
+        "category": [categories[p] for p in product_ids],
+    }
+    return product_ids, fields
+
+
+def tfidf_matrix(documents: List[List[str]]) -> sparse.csr_matrix:
+    """Sublinear TF-IDF with smoothed IDF, rows L2 normalized"""
+    vocabulary: Dict[str, int] = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for tokens in documents:
+        for token, count in Counter(tokens).items():
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+            data.append(1.0 + np.log(count))
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+        shape=(len(documents), max(len(vocabulary), 1))
+    )
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1.0 + len(documents)) / (1.0 + document_frequency)) + 1.0
+    matrix = matrix @ sparse.diags(idf.astype(np.float32))
+    return normalize_rows(matrix.tocsr())
+
+
+def normalize_rows(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags((1.0 / norms).astype(np.float32)) @ matrix
+
+
+def top_k_neighbors(matrix: sparse.csr_matrix, top_k: int, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cosine top-K neighbours of every row via batched sparse products.
+
+    Each batch of rows is multiplied with the transposed matrix, which only
+    touches products sharing at least one feature, and the K best columns of
+    each result row are picked with argpartition. Missing neighbours are -1.
+    """
+    n = matrix.shape[0]
+    neighbors = np.full((n, top_k), -1, dtype=np.int32)
+    scores = np.zeros((n, top_k), dtype=np.float32)
+    transposed = matrix.T.tocsr()
+
+    for start in range(0, n, batch_size):
+        block = (matrix[start:start + batch_size] @ transposed).tocsr()
+        for offset in range(block.shape[0]):
+            row = start + offset
+            begin, end = block.indptr[offset], block.indptr[offset + 1]
+            columns = block.indices[begin:end]
+            values = block.data[begin:end]
+            keep = columns != row
+            columns, values = columns[keep], values[keep]
+            if len(columns) > top_k:
+                best = np.argpartition(-values, top_k)[:top_k]
+                columns, values = columns[best], values[best]
+            order = np.argsort(-values)
+            neighbors[row, :len(order)] = columns[order]
+            scores[row, :len(order)] = values[order]
+    return neighbors, scores
+
+
+def build_similar_products(db: Session, path: str, top_k: int, batch_size: int = 512) -> int:
+    """Vectorize the catalog, precompute neighbours and write them to `path`"""
+    product_ids, fields = load_product_features(db)
+    if not product_ids:
+        return 0
+
+    blocks = [FIELD_WEIGHTS[field] * tfidf_matrix(documents) for field, documents in fields.items()]
+    matrix = normalize_rows(sparse.hstack(blocks, format="csr"))
+    neighbors, scores = top_k_neighbors(matrix, top_k, batch_size)
+
+    product_ids = np.asarray(product_ids, dtype=np.int32)
+    # Store neighbours as product IDs so the file is usable on its own
+    neighbor_ids = np.where(neighbors >= 0, product_ids[np.maximum(neighbors, 0)], -1).astype(np.int32)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.savez_compressed(f, product_ids=product_ids, neighbors=neighbor_ids, scores=scores.astype(np.float16))
+    os.replace(temp_path, path)
+    return len(product_ids)
+
+
+class SimilarProductStore:
+    """
+    Serves precomputed neighbours from the file written by the offline job.
+    The file is reloaded when the job replaces it and published as one
+    (rows, neighbors, scores) tuple, so readers never mix two versions.
+    """
+
+    def __init__(self, path: str, check_interval: float = 60.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index: Tuple[Dict[int, int], Optional[np.ndarray], Optional[np.ndarray]] = ({}, None, None)
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval and self._mtime is not None:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            with np.load(self.path) as data:
+                product_ids = data["product_ids"]
+                neighbors = data["neighbors"]
+                scores = data["scores"]
+            rows = {int(product_id): row for row, product_id in enumerate(product_ids)}
+            self._index = (rows, neighbors, scores)
+            self._mtime = mtime
+
+    def get(self, product_id: int, limit: int) -> List[Tuple[int, float]]:
+        """(product_id, score) pairs, most similar first"""
+        self._maybe_reload()
+        rows, neighbors, scores = self._index
+        row = rows.get(product_id)
+        if row is None:
+            return []
+        return [
+            (int(neighbor), float(score))
+            for neighbor, score in zip(neighbors[row, :limit], scores[row, :limit])
+            if neighbor >= 0
+        ]
+
+
+similar_products = SimilarProductStore(os.path.join(settings.DATA_DIR, SIMILAR_PRODUCTS_FILE))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute content based similar products")
+    parser.add_argument("--top-k", type=int, default=settings.SIMILAR_PRODUCTS_TOP_K)
+    parser.add_argument("--batch-size", type=int, default=512, help="rows per sparse matrix product")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        count = build_similar_products(db, similar_products.path, args.top_k, args.batch_size)
+    finally:
+        db.close()
+    print(f"Computed {args.top_k} neighbours for {count} products in {time.perf_counter() - started:.1f}s "
+          f"-> {similar_products.path}")
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.analytics import SpoolOffset
+from app.utils.activity_store import record_events
+from app.utils.event_spool import OPEN_SUFFIX, SEALED_SUFFIX, session_rows
+from app.utils.session_tracking import merge_sessions
+
+# Open segments untouched for this long belong to a worker that died, they
+# are loaded and removed like sealed ones
+STALE_SEGMENT_SECONDS = 3600
+
+
+def list_segments(directory: str) -> List[Tuple[str, str, bool]]:
+    """(segment name, path, finished) in write order"""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    now = time.time()
+    for file_name in os.listdir(directory):
+        path = os.path.join(directory, file_name)
+        if file_name.endswith(SEALED_SUFFIX):
+            segments.append((file_name[:-len(SEALED_SUFFIX)], path, True))
+        elif file_name.endswith(OPEN_SUFFIX):
+            stale = now - os.path.getmtime(path) > STALE_SEGMENT_SECONDS
+            segments.append((file_name[:-len(OPEN_SUFFIX)], path, stale))
+    return sorted(segments)
+
+
+def read_events(path: str, offset: int, limit: int) -> Tuple[List[dict], int]:
+    """Up to `limit` complete lines after `offset`, and the offset after them"""
+    events = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while len(events) < limit:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break  # End of file or a line still being written
+            offset += len(line)
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                print(f"Skipping malformed spool line in {path} at byte {offset - len(line)}")
+    return events, offset
+
+
+def ingest_segment(db: Session, segment: str, path: str, batch_size: int) -> Tuple[int, int]:
+    """
+    Load new events of one segment, returns (events loaded, bytes consumed).
+
+    Every batch is inserted in the same transaction that advances the
+    segment's offset, so a crash or restart resumes exactly after the last
+    committed batch. The offset row is locked, which also keeps two
+    ingesters from loading the same lines.
+    """
+    loaded = 0
+    while True:
+        state = db.query(SpoolOffset).filter(SpoolOffset.segment == segment).with_for_update().first()
+        if state is None:
+            state = SpoolOffset(segment=segment, offset=0)
+            db.add(state)
+        events, offset = read_events(path, state.offset, batch_size)
+        if offset == state.offset:
+            db.rollback()
+            return loaded, offset
+
+        record_events(db, events)
+        merge_sessions(db, session_rows(events))
+        state.offset = offset
+        state.date_modified = datetime.utcnow()
+        db.commit()
+        loaded += len(events)
+
+
+def remove_segment(db: Session, segment: str, path: str):
+    # The offset row goes last: if we stop in between, the file is already gone
+    os.remove(path)
+    db.query(SpoolOffset).filter(SpoolOffset.segment == segment).delete()
+    db.commit()
+
+
+def ingest_once(directory: str, batch_size: int) -> int:
+    db = SessionLocal()
+    total = 0
+    try:
+        for segment, path, finished in list_segments(directory):
+            loaded, offset = ingest_segment(db, segment, path, batch_size)
+            total += loaded
+            if finished and offset >= os.path.getsize(path):
+                remove_segment(db, segment, path)
+    finally:
+        db.close()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load spooled tracking events into MySQL")
+    parser.add_argument("--directory", default=settings.EVENT_SPOOL_DIR)
+    parser.add_argument("--batch-size", type=int, default=2000, help="events per transaction")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds to wait when the spool is drained")
+    parser.add_argument("--once", action="store_true", help="drain the spool and exit")
+    args = parser.parse_args()
+
+    while True:
+        started = time.perf_counter()
+        try:
+            count = ingest_once(args.directory, args.batch_size)
+        except Exception as e:
+            print(f"Error ingesting event spool: {e}")
+            count = 0
+        if count:
+            print(f"Loaded {count} events in {time.perf_counter() - started:.2f}s")
+        if args.once:
+            break
+        if not count:
+            time.sleep(args.poll)
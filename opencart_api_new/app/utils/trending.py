@@ -0,0 +1,225 @@
+import heapq
+import math
+import os
+import pickle
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.product import ProductToCategory
+from app.utils.background import PeriodicJob
+
+# Event weights, an add to cart says more about interest than a view
+EVENT_WEIGHTS = {
+    "product_view": 1.0,
+    "add_to_cart": 3.0,
+}
+
+# Scope key for the catalog wide rankings
+ALL_CATEGORIES = 0
+
+# Ranked lists are rebuilt from the sketches at most this often (seconds)
+RANKING_TTL = 30
+
+# Rescale decayed scores before the exponent gets large enough to overflow
+MAX_DECAY_EXPONENT = 50.0
+
+
+class CountMinSketch:
+    """Fixed size frequency estimates that never undercount"""
+
+    def __init__(self, width: int = 4096, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.float64)
+        self._rows = np.arange(depth)
+
+    def _columns(self, key: int) -> List[int]:
+        return [hash((seed, key)) % self.width for seed in range(self.depth)]
+
+    def add(self, key: int, weight: float = 1.0):
+        self.table[self._rows, self._columns(key)] += weight
+
+    def estimate(self, key: int) -> float:
+        return float(self.table[self._rows, self._columns(key)].min())
+
+    def scale(self, factor: float):
+        self.table *= factor
+
+
+class SpaceSaving:
+    """
+    Weighted Space-Saving heavy hitters: at most `capacity` counters, the
+    smallest one is recycled for an unseen key. Any key whose true weight
+    exceeds total / capacity is guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []  # Lazy min-heap, stale entries skipped
+
+    def add(self, key: int, weight: float = 1.0):
+        counts = self.counts
+        if key in counts:
+            counts[key] += weight
+        elif len(counts) < self.capacity:
+            counts[key] = weight
+        else:
+            while True:
+                count, victim = heapq.heappop(self._heap)
+                if counts.get(victim) == count:
+                    break
+            del counts[victim]
+            counts[key] = count + weight
+        heapq.heappush(self._heap, (counts[key], key))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, key) for key, count in counts.items()]
+            heapq.heapify(self._heap)
+
+    def scale(self, factor: float):
+        self.counts = {key: count * factor for key, count in self.counts.items()}
+        self._heap = [(count, key) for key, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        return heapq.nlargest(k, self.counts.items(), key=lambda item: item[1])
+
+
+class TrendingTracker:
+    """
+    Popularity and trending scores per category from product view and
+    add-to-cart events.
+
+    "popular" keeps plain weighted counts. "trending" uses forward
+    exponential decay: an event at time t adds exp((t - landmark) / tau),
+    which equals weighting every event by exp(-age / tau) at query time
+    without ever touching old entries. Ranked top lists are cached so a
+    query is a dictionary lookup.
+    """
+
+    def __init__(self, capacity: int, half_life: float):
+        self.capacity = capacity
+        self.tau = half_life / math.log(2)
+        self.landmark = time.time()
+        self.popular: Dict[int, SpaceSaving] = {}
+        self.trending: Dict[int, SpaceSaving] = {}
+        self.sketch = CountMinSketch()
+        self.categories: Dict[int, Tuple[int, ...]] = {}
+        self._rankings: Dict[Tuple[str, int], Tuple[float, List[Tuple[int, float]]]] = {}
+        self._lock = threading.Lock()
+
+    def _scopes(self, product_id: int) -> Tuple[int, ...]:
+        return (ALL_CATEGORIES,) + self.categories.get(product_id, ())
+
+    def record(self, event_type: str, product_id: int, now: Optional[float] = None):
+        weight = EVENT_WEIGHTS.get(event_type)
+        if weight is None:
+            return
+        now = now or time.time()
+        with self._lock:
+            exponent = (now - self.landmark) / self.tau
+            if exponent > MAX_DECAY_EXPONENT:
+                self._move_landmark(now)
+                exponent = 0.0
+            decayed = weight * math.exp(exponent)
+            self.sketch.add(product_id, weight)
+            for scope in self._scopes(product_id):
+                popular = self.popular.get(scope)
+                if popular is None:
+                    popular = self.popular[scope] = SpaceSaving(self.capacity)
+                    self.trending[scope] = SpaceSaving(self.capacity)
+                popular.add(product_id, weight)
+                self.trending[scope].add(product_id, decayed)
+
+    def _move_landmark(self, now: float):
+        factor = math.exp(-(now - self.landmark) / self.tau)
+        for counters in self.trending.values():
+            counters.scale(factor)
+        self.landmark = now
+
+    def top(self, mode: str, category_id: int = ALL_CATEGORIES, limit: int = 10) -> List[Tuple[int, float]]:
+        """(product_id, score) pairs, trending scores are event weights decayed to now"""
+        cached = self._rankings.get((mode, category_id))
+        now = time.time()
+        if cached is None or now - cached[0] > RANKING_TTL:
+            with self._lock:
+                counters = (self.trending if mode == "trending" else self.popular).get(category_id)
+                ranking = counters.top(self.capacity) if counters else []
+                if mode == "trending":
+                    factor = math.exp(-(now - self.landmark) / self.tau)
+                    ranking = [(product_id, score * factor) for product_id, score in ranking]
+            cached = self._rankings[(mode, category_id)] = (now, ranking)
+        return cached[1][:limit]
+
+    def estimate(self, product_id: int) -> float:
+        """Approximate weighted event count for any product, tracked or not"""
+        return self.sketch.estimate(product_id)
+
+    def load_categories(self):
+        categories: Dict[int, List[int]] = {}
+        db = SessionLocal()
+        try:
+            for product_id, category_id in db.query(ProductToCategory.product_id, ProductToCategory.category_id):
+                categories.setdefault(product_id, []).append(category_id)
+        finally:
+            db.close()
+        self.categories = {product_id: tuple(ids) for product_id, ids in categories.items()}
+
+    def checkpoint(self, path: str):
+        with self._lock:
+            state = pickle.dumps({
+                "landmark": self.landmark,
+                "popular": {scope: c.counts for scope, c in self.popular.items()},
+                "trending": {scope: c.counts for scope, c in self.trending.items()},
+                "sketch": self.sketch.table,
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(state)
+        os.replace(temp_path, path)
+
+    def restore(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        with self._lock:
+            self.landmark = state["landmark"]
+            for attribute in ("popular", "trending"):
+                scopes = {}
+                for scope, counts in state[attribute].items():
+                    counters = SpaceSaving(self.capacity)
+                    counters.counts = counts
+                    counters.scale(1.0)  # Rebuilds the heap
+                    scopes[scope] = counters
+                setattr(self, attribute, scopes)
+            if state["sketch"].shape == self.sketch.table.shape:
+                self.sketch.table = state["sketch"]
+            self._rankings = {}
+
+
+CHECKPOINT_PATH = os.path.join(settings.DATA_DIR, "trending.pkl")
+
+trending_tracker = TrendingTracker(
+    capacity=settings.TRENDING_CAPACITY,
+    half_life=settings.TRENDING_HALF_LIFE
+)
+
+
+def checkpoint_trending():
+    """Refresh the product to category map and save the sketches to disk"""
+    trending_tracker.load_categories()
+    trending_tracker.checkpoint(CHECKPOINT_PATH)
+
+
+trending_checkpoint_job = PeriodicJob(
+    "trending-checkpoint",
+    checkpoint_trending,
+    interval=settings.TRENDING_CHECKPOINT
+)